@@ -1,5 +1,9 @@
+import hmac
+import http.client
 import json
 import os
+import re
+import time
 import urllib.request
 import urllib.parse
 import psycopg2
@@ -9,7 +13,18 @@ DATABASE_URL = os.environ.get('DATABASE_URL', '')
 VSEGPT_API_KEY = os.environ.get('VSEGPT_API_KEY', '')
 YOOKASSA_PAYMENT_URL = 'https://functions.poehali.dev/b41b8133-a3ad-4896-bda6-2b5ffa2bdeb3'
 SELF_URL = 'https://functions.poehali.dev/a795746d-3812-4427-898e-b756ff0edc4f'
+# Общий секрет служебных вызовов (_internal): очередь генерации будят только сама функция и cron-триггер
+INTERNAL_KEY = os.environ.get('INTERNAL_KEY', '')
 UNPACKING_PRICE = 1
+# Очередь генерации: аренда покрывает таймаут VseGPT (290 с) и отправку результата
+GENERATION_LEASE_SECONDS = 330
+GENERATION_MAX_ATTEMPTS = 3
+# Потоковая доставка: раздел уходит в Telegram, как только начался следующий заголовок или набралось MESSAGE_LIMIT символов
+MESSAGE_LIMIT = 4000
+STREAM_MIN_SECTION = 300
+STREAM_READ_TIMEOUT = 60
+STREAM_DEADLINE = 290
+_SECTION_HEADING = re.compile(r'^\s*(#{1,6}\s+\S|\d{1,2}\.\s+[A-ZА-ЯЁ][A-ZА-ЯЁ0-9 ,:\-–—«»"()/&]+$)')
 
 QUESTIONS = {
     1: "Как вас зовут?",
@@ -43,6 +58,7 @@ WELCOME_MESSAGE = (
 
 WELCOME_VIDEO_YANDEX_URL = "https://disk.yandex.ru/i/Ga2vfizEeiNgYQ"
 _welcome_video_file_id = None
+MEDIA_CACHE_BOT = "expert-unpacker-bot"
 
 SYSTEM_PROMPT = """Ты — топовый маркетолог, бренд-стратег и продюсер экспертов с 10-летним опытом. Твоя задача — проанализировать ответы эксперта на вопросы глубокой распаковки и выдать готовую, структурированную стратегию для его позиционирования, продвижения и продаж. Твой тон: профессиональный, вдохновляющий, структурный, без "воды", говоришь по делу, как наставник.
 Ты работаешь по методологии, которая объединяет:
@@ -196,10 +212,38 @@ def send_message(chat_id, text, parse_mode=None):
         return None
 
 
-def send_long_message(chat_id, text, parse_mode=None):
-    max_len = 4000
-    if len(text) <= max_len:
-        return send_message(chat_id, text, parse_mode)
+class TelegramSender:
+    """Серия сообщений через одно keep-alive соединение с api.telegram.org вместо нового соединения на каждое"""
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._conn = None
+
+    def send_message(self, chat_id, text, parse_mode=None):
+        payload = {"chat_id": chat_id, "text": text}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        data = json.dumps(payload).encode('utf-8')
+        for attempt in range(2):
+            try:
+                if self._conn is None:
+                    self._conn = http.client.HTTPSConnection('api.telegram.org', timeout=self.timeout)
+                self._conn.request('POST', f'/bot{BOT_TOKEN}/sendMessage', body=data, headers={"Content-Type": "application/json"})
+                return json.loads(self._conn.getresponse().read())
+            except (http.client.HTTPException, OSError) as e:
+                # Telegram закрыл простаивающее соединение — переподключаемся один раз
+                self.close()
+                if attempt:
+                    print(f"Error sending message: {e}")
+        return None
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def split_message(text, max_len=MESSAGE_LIMIT):
     parts = []
     while text:
         if len(text) <= max_len:
@@ -210,8 +254,20 @@ def send_long_message(chat_id, text, parse_mode=None):
             split_pos = max_len
         parts.append(text[:split_pos])
         text = text[split_pos:].lstrip('\n')
-    for part in parts:
-        send_message(chat_id, part, parse_mode)
+    return parts
+
+
+def send_long_message(chat_id, text, parse_mode=None, sender=None):
+    if len(text) <= MESSAGE_LIMIT and sender is None:
+        return send_message(chat_id, text, parse_mode)
+    own = sender is None
+    sender = sender or TelegramSender()
+    try:
+        for part in split_message(text):
+            sender.send_message(chat_id, part, parse_mode)
+    finally:
+        if own:
+            sender.close()
 
 
 def send_message_with_buttons(chat_id, text, buttons, parse_mode='HTML'):
@@ -260,14 +316,55 @@ def send_video(chat_id, video, caption=None):
         return None
 
 
-def send_welcome_video(chat_id):
+def get_cached_file_id(conn, source_url):
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT file_id FROM telegram_media_cache WHERE bot = %s AND source_url = %s",
+            (MEDIA_CACHE_BOT, source_url)
+        )
+        row = cur.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    except Exception as e:
+        conn.rollback()
+        print(f"[VIDEO] media cache read failed: {e}")
+        return None
+
+
+def save_cached_file_id(conn, source_url, file_id):
+    """Сохраняет file_id в telegram_media_cache; при file_id=None удаляет протухшую запись"""
+    try:
+        cur = conn.cursor()
+        if file_id:
+            cur.execute(
+                "INSERT INTO telegram_media_cache (bot, source_url, file_id) VALUES (%s, %s, %s) "
+                "ON CONFLICT (bot, source_url) DO UPDATE SET file_id = EXCLUDED.file_id, updated_at = NOW()",
+                (MEDIA_CACHE_BOT, source_url, file_id)
+            )
+        else:
+            cur.execute(
+                "DELETE FROM telegram_media_cache WHERE bot = %s AND source_url = %s",
+                (MEDIA_CACHE_BOT, source_url)
+            )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"[VIDEO] media cache write failed: {e}")
+
+
+def send_welcome_video(conn, chat_id):
+    """Приветственное видео: file_id из памяти инстанса или из БД, и только без него — скачивание с Яндекс.Диска"""
     global _welcome_video_file_id
 
+    if not _welcome_video_file_id:
+        _welcome_video_file_id = get_cached_file_id(conn, WELCOME_VIDEO_YANDEX_URL)
     if _welcome_video_file_id:
         result = send_video(chat_id, _welcome_video_file_id, WELCOME_MESSAGE)
         if result and result.get("ok"):
             return result
         _welcome_video_file_id = None
+        save_cached_file_id(conn, WELCOME_VIDEO_YANDEX_URL, None)
 
     download_url = get_yandex_download_url(WELCOME_VIDEO_YANDEX_URL)
     if not download_url:
@@ -278,6 +375,7 @@ def send_welcome_video(chat_id):
         video_obj = result.get("result", {}).get("video")
         if video_obj and video_obj.get("file_id"):
             _welcome_video_file_id = video_obj["file_id"]
+            save_cached_file_id(conn, WELCOME_VIDEO_YANDEX_URL, _welcome_video_file_id)
             print(f"[VIDEO] Cached file_id: {_welcome_video_file_id[:20]}...")
     else:
         print(f"[VIDEO] Failed to send video: {result}")
@@ -402,7 +500,6 @@ def mark_finished(conn, telegram_id):
 def clean_markdown(text):
     if not text:
         return None
-    import re
     text = re.sub(r'#{1,6}\s*', '', text)
     text = re.sub(r'\*\*(.+?)\*\*', r'\1', text)
     text = re.sub(r'__(.+?)__', r'\1', text)
@@ -495,9 +592,277 @@ def generate_unpacking(answers_text):
         return None
 
 
+def internal_authorized(event):
+    """Служебный вызов (_internal) разрешён только с X-Internal-Key, совпадающим с INTERNAL_KEY.
+    Если секрет не задан, служебные вызовы отклоняются"""
+    if not INTERNAL_KEY:
+        return False
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    return hmac.compare_digest(headers.get('x-internal-key') or '', INTERNAL_KEY)
+
+
+def kick_worker():
+    """Будит воркер очереди генерации отдельным вызовом функции. Ответа не ждём — задача уже лежит в БД"""
+    payload = json.dumps({"_internal": "process_jobs"}).encode('utf-8')
+    req = urllib.request.Request(
+        SELF_URL, data=payload, headers={"Content-Type": "application/json", "X-Internal-Key": INTERNAL_KEY}
+    )
+    try:
+        urllib.request.urlopen(req, timeout=1)
+    except Exception:
+        pass
+
+
+def enqueue_generation(conn, telegram_id, chat_id):
+    """Ставит задачу генерации. Возвращает id или None, если у пользователя уже есть активная задача"""
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO expert_generation_jobs (telegram_id, chat_id) VALUES (%s, %s) "
+        "ON CONFLICT (telegram_id) WHERE status IN ('pending', 'processing') DO NOTHING RETURNING id",
+        (telegram_id, chat_id)
+    )
+    row = cur.fetchone()
+    conn.commit()
+    return row[0] if row else None
+
+
+def has_active_job(conn, telegram_id):
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT 1 FROM expert_generation_jobs WHERE telegram_id = %s AND status IN ('pending', 'processing')",
+        (telegram_id,)
+    )
+    return cur.fetchone() is not None
+
+
+def claim_job(conn):
+    """Берёт в работу одну pending-задачу или задачу с истёкшей арендой (инстанс умер посреди генерации)"""
+    cur = conn.cursor()
+    cur.execute(
+        "UPDATE expert_generation_jobs SET status = 'processing', attempts = attempts + 1, "
+        "locked_until = NOW() + %s * INTERVAL '1 second', updated_at = NOW() "
+        "WHERE id = (SELECT id FROM expert_generation_jobs "
+        "WHERE (status = 'pending' OR (status = 'processing' AND locked_until < NOW())) AND attempts < %s "
+        "ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED) "
+        "RETURNING id, telegram_id, chat_id, result, attempts",
+        (GENERATION_LEASE_SECONDS, GENERATION_MAX_ATTEMPTS)
+    )
+    row = cur.fetchone()
+    conn.commit()
+    return row
+
+
+def fail_job(conn, job_id, telegram_id, chat_id, attempts, error):
+    """Неудачная попытка: задача возвращается в очередь, после GENERATION_MAX_ATTEMPTS — пользователь получает ошибку"""
+    cur = conn.cursor()
+    if attempts < GENERATION_MAX_ATTEMPTS:
+        cur.execute(
+            "UPDATE expert_generation_jobs SET status = 'pending', locked_until = NULL, error_message = %s, updated_at = NOW() "
+            "WHERE id = %s",
+            (error, job_id)
+        )
+        conn.commit()
+        return True
+    cur.execute(
+        "UPDATE expert_generation_jobs SET status = 'failed', locked_until = NULL, error_message = %s, updated_at = NOW() "
+        "WHERE id = %s",
+        (error, job_id)
+    )
+    cur.execute("UPDATE expert_users SET status = 'completed', updated_at = NOW() WHERE telegram_id = %s", (telegram_id,))
+    conn.commit()
+    send_message(chat_id, "❌ Не удалось получить ответ от нейросети. Попробуйте позже — напишите /done")
+    return False
+
+
+def run_job(conn, job):
+    """Генерирует распаковку, сохраняет её в задаче и отправляет пользователю.
+    Первая попытка идёт потоком — разделы уходят в Telegram по мере генерации; повторные используют
+    обычный запрос. Результат пишется в задачу до завершения, поэтому повтор после падения на доставке
+    не запускает генерацию заново"""
+    job_id, telegram_id, chat_id, result, attempts = job
+    sender = TelegramSender()
+    streamed = []
+    try:
+        if result is None:
+            answers = get_all_answers(conn, telegram_id)
+            conn.commit()
+            answers_text = ""
+            for q_num, q_text, answer in answers:
+                answers_text += f"Вопрос {q_num}: {q_text}\nОтвет: {answer}\n\n"
+            print(f"[GENERATE] job={job_id} attempt={attempts} starting VseGPT call for {telegram_id}")
+            if attempts == 1:
+                def on_section(text):
+                    if not streamed:
+                        sender.send_message(chat_id, "✅ Ваша распаковка экспертности — присылаю по разделам по мере готовности\n\n" + "=" * 30)
+                    sender.send_message(chat_id, text)
+                    streamed.append(len(text))
+                result = stream_unpacking(answers_text, on_section)
+                if not result and streamed:
+                    sender.send_message(chat_id, "⚠️ Генерация прервалась. Запускаю заново — пришлю распаковку целиком.")
+            else:
+                result = generate_unpacking(answers_text)
+            if not result:
+                print(f"[GENERATE] job={job_id} failed for {telegram_id}")
+                return fail_job(conn, job_id, telegram_id, chat_id, attempts, 'Пустой ответ нейросети')
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE expert_generation_jobs SET result = %s, locked_until = NOW() + %s * INTERVAL '1 second', updated_at = NOW() "
+                "WHERE id = %s",
+                (result, GENERATION_LEASE_SECONDS, job_id)
+            )
+            conn.commit()
+            print(f"[GENERATE] job={job_id} success for {telegram_id}, length={len(result)}, streamed_sections={len(streamed)}")
+
+        if not streamed:
+            sender.send_message(chat_id, "✅ Ваша распаковка экспертности готова!\n\n" + "=" * 30)
+            send_long_message(chat_id, result, sender=sender)
+        mark_finished(conn, telegram_id)
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE expert_generation_jobs SET status = 'done', locked_until = NULL, updated_at = NOW() WHERE id = %s",
+            (job_id,)
+        )
+        conn.commit()
+        sender.send_message(chat_id, "\n🎉 Распаковка завершена! Чтобы пройти заново — напишите /start")
+        return False
+    finally:
+        sender.close()
+
+
+def process_jobs():
+    """Воркер очереди: одна задача на вызов (генерация занимает минуты). Если очередь не пуста — будит следующий вызов"""
+    conn = get_db_connection()
+    try:
+        job = claim_job(conn)
+        retry = False
+        if job:
+            try:
+                retry = run_job(conn, job)
+            except Exception as e:
+                print(f"[GENERATE] job={job[0]} crashed: {type(e).__name__}: {e}")
+                conn.rollback()
+                retry = fail_job(conn, job[0], job[1], job[2], job[4], str(e)[:1000])
+        cur = conn.cursor()
+        # последняя попытка оборвалась вместе с инстансом — закрываем задачу, иначе пользователь навсегда в 'generating'
+        cur.execute(
+            "UPDATE expert_generation_jobs SET status = 'failed', locked_until = NULL, updated_at = NOW() "
+            "WHERE status = 'processing' AND attempts >= %s AND locked_until < NOW() RETURNING telegram_id, chat_id",
+            (GENERATION_MAX_ATTEMPTS,)
+        )
+        for stale_telegram_id, stale_chat_id in cur.fetchall():
+            cur.execute("UPDATE expert_users SET status = 'completed', updated_at = NOW() WHERE telegram_id = %s", (stale_telegram_id,))
+            send_message(stale_chat_id, "❌ Не удалось получить ответ от нейросети. Попробуйте позже — напишите /done")
+        cur.execute("SELECT 1 FROM expert_generation_jobs WHERE status = 'pending' LIMIT 1")
+        more = cur.fetchone() is not None
+        conn.commit()
+    finally:
+        conn.close()
+    if more or retry:
+        kick_worker()
+    return {"processed": 1 if job else 0, "more": more}
+
+
+class SectionStreamer:
+    """Собирает поток токенов в разделы распаковки и отдаёт каждый в on_section, как только он завершён"""
+
+    def __init__(self, on_section):
+        self.on_section = on_section
+        self.buf = ''
+        self.line = ''
+
+    def feed(self, delta):
+        self.line += delta
+        while '\n' in self.line:
+            line, self.line = self.line.split('\n', 1)
+            self._add_line(line)
+
+    def finish(self):
+        if self.line:
+            self._add_line(self.line)
+            self.line = ''
+        self._flush(self.buf)
+        self.buf = ''
+
+    def _add_line(self, line):
+        if _SECTION_HEADING.match(line) and len(self.buf.strip()) >= STREAM_MIN_SECTION:
+            self._flush(self.buf)
+            self.buf = ''
+        self.buf += line + '\n'
+        while len(self.buf) > MESSAGE_LIMIT:
+            split_pos = self.buf.rfind('\n', 0, MESSAGE_LIMIT)
+            if split_pos <= 0:
+                split_pos = MESSAGE_LIMIT
+            self._flush(self.buf[:split_pos])
+            self.buf = self.buf[split_pos:].lstrip('\n')
+
+    def _flush(self, text):
+        text = clean_markdown(text)
+        if text:
+            self.on_section(text)
+
+
+def stream_unpacking(answers_text, on_section):
+    """Потоковый вариант generate_unpacking: читает SSE-ответ VseGPT и отдаёт разделы по мере готовности.
+    Возвращает полный текст или None (часть разделов к этому моменту могла уже уйти пользователю)"""
+    url = "https://api.vsegpt.ru/v1/chat/completions"
+    payload = {
+        "model": "deepseek/deepseek-chat-3.1-alt-fast",
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"Вот ответы эксперта на 17 вопросов распаковки:\n\n{answers_text}\n\nСоздай полную профессиональную распаковку по всем 5 разделам структуры."}
+        ],
+        "max_tokens": 50000,
+        "temperature": 0.7,
+        "stream": True
+    }
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode('utf-8'),
+        headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {VSEGPT_API_KEY}"
+        }
+    )
+    streamer = SectionStreamer(on_section)
+    parts = []
+    started = time.time()
+    try:
+        with urllib.request.urlopen(req, timeout=STREAM_READ_TIMEOUT) as resp:
+            for raw in resp:
+                if time.time() - started > STREAM_DEADLINE:
+                    print(f"[VSEGPT] Stream deadline exceeded after {len(parts)} chunks")
+                    return None
+                line = raw.decode('utf-8', errors='replace').strip()
+                if not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                chunk = json.loads(data)
+                if 'error' in chunk:
+                    print(f"[VSEGPT] Stream error: {chunk['error']}")
+                    return None
+                choices = chunk.get('choices') or []
+                delta = (choices[0].get('delta') or {}).get('content') if choices else None
+                if delta:
+                    parts.append(delta)
+                    streamer.feed(delta)
+        streamer.finish()
+    except urllib.error.HTTPError as e:
+        body = e.read().decode('utf-8', errors='replace')
+        print(f"[VSEGPT] HTTP error {e.code}: {body[:500]}")
+        return None
+    except Exception as e:
+        print(f"[VSEGPT] Stream error: {type(e).__name__}: {e}")
+        return None
+    content = ''.join(parts)
+    print(f"[VSEGPT] Stream finished in {time.time() - started:.1f}s, content length: {len(content)}")
+    return clean_markdown(content) if content else None
+
+
 def handle_start(conn, chat_id, telegram_id, username, first_name):
     reset_user(conn, telegram_id, username, first_name)
-    video_result = send_welcome_video(chat_id)
+    video_result = send_welcome_video(conn, chat_id)
     if not video_result or not video_result.get("ok"):
         send_message(chat_id, WELCOME_MESSAGE)
     send_message(chat_id, f"📌 Вопрос 1 из 17:\n\n{QUESTIONS[1]}")
@@ -535,7 +900,8 @@ def handle_done(conn, chat_id, telegram_id):
     row2 = cur2.fetchone()
     current_status = row2[0] if row2 else 'new'
 
-    if current_status == 'generating':
+    # статус 'generating' без активной задачи — генерация потерялась до появления очереди, запускаем заново
+    if current_status == 'generating' and has_active_job(conn, telegram_id):
         send_message(chat_id, "⏳ Генерация уже запущена. Пожалуйста, дождитесь результата.")
         return
 
@@ -550,18 +916,12 @@ def handle_done(conn, chat_id, telegram_id):
     )
     conn.commit()
 
-    send_message(chat_id, "⏳ Генерирую вашу персональную распаковку экспертности... Это может занять 2-4 минуты. Я напишу, когда будет готово.")
+    if enqueue_generation(conn, telegram_id, chat_id) is None:
+        send_message(chat_id, "⏳ Генерация уже запущена. Пожалуйста, дождитесь результата.")
+        return
 
-    import threading
-    def fire_async():
-        payload = json.dumps({"_internal": "generate", "chat_id": chat_id, "telegram_id": telegram_id}).encode('utf-8')
-        req = urllib.request.Request(SELF_URL, data=payload, headers={"Content-Type": "application/json"})
-        try:
-            urllib.request.urlopen(req, timeout=3)
-        except:
-            pass
-    t = threading.Thread(target=fire_async)
-    t.start()
+    send_message(chat_id, "⏳ Генерирую вашу персональную распаковку экспертности... Разделы буду присылать по мере готовности — первый придёт через несколько секунд.")
+    kick_worker()
 
 
 def handle_answer(conn, chat_id, telegram_id, text, current_step):
@@ -613,37 +973,11 @@ def handler(event, context):
     except:
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({"ok": True})}
 
-    if body.get('_internal') == 'generate':
-        chat_id = body['chat_id']
-        telegram_id = body['telegram_id']
-        conn = get_db_connection()
-        answers = get_all_answers(conn, telegram_id)
-        conn.close()
-        answers_text = ""
-        for q_num, q_text, answer in answers:
-            answers_text += f"Вопрос {q_num}: {q_text}\nОтвет: {answer}\n\n"
-        print(f"[GENERATE] Starting VseGPT call for {telegram_id}")
-        result = generate_unpacking(answers_text)
-        if result:
-            print(f"[GENERATE] Success for {telegram_id}, length={len(result)}")
-            send_message(chat_id, "✅ Ваша распаковка экспертности готова!\n\n" + "=" * 30)
-            send_long_message(chat_id, result)
-            conn2 = get_db_connection()
-            mark_finished(conn2, telegram_id)
-            conn2.close()
-            send_message(chat_id, "\n🎉 Распаковка завершена! Чтобы пройти заново — напишите /start")
-        else:
-            print(f"[GENERATE] Failed for {telegram_id}")
-            conn2 = get_db_connection()
-            cur = conn2.cursor()
-            cur.execute(
-                "UPDATE expert_users SET status = 'completed', updated_at = NOW() WHERE telegram_id = '%s'"
-                % telegram_id.replace("'", "''")
-            )
-            conn2.commit()
-            conn2.close()
-            send_message(chat_id, "❌ Не удалось получить ответ от нейросети. Попробуйте позже — напишите /done")
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({"ok": True})}
+    if body.get('_internal') == 'process_jobs':
+        if not internal_authorized(event):
+            print("[JOBS] Rejected _internal call without a valid X-Internal-Key")
+            return {'statusCode': 403, 'headers': headers, 'body': json.dumps({"error": "forbidden"})}
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(process_jobs())}
 
     update_id = body.get('update_id')
     if update_id:
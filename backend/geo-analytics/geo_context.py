@@ -0,0 +1,140 @@
+"""Общий для geo-функций контекст запроса: проверка JWT и выбор проекта с кэшами на процесс.
+Файл одинаковый во всех geo-функциях — при правке копируйте во все каталоги."""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+TOKEN_CACHE_SIZE = 1024
+PROJECT_CACHE_SIZE = 1024
+# Проекты удаляются из другой функции (geo-projects), поэтому кэш в остальных живёт недолго
+PROJECT_CACHE_TTL = 60
+
+
+class LRUCache:
+    """Ограниченный потокобезопасный LRU; у каждой записи свой срок жизни (monotonic/unix — задаёт вызывающий)"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard_if(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+
+_tokens = LRUCache(TOKEN_CACHE_SIZE)
+_projects = LRUCache(PROJECT_CACHE_SIZE)
+
+
+def b64url_decode(s: str) -> bytes:
+    pad = '=' * (-len(s) % 4)
+    return base64.urlsafe_b64decode(s + pad)
+
+
+def b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def jwt_decode(token: str, secret: str):
+    try:
+        h, p, s = token.split('.')
+        sig_input = f'{h}.{p}'.encode()
+        expected = hmac.new(secret.encode(), sig_input, hashlib.sha256).digest()
+        if not hmac.compare_digest(b64url(expected), s):
+            return None
+        payload = json.loads(b64url_decode(p))
+        if payload.get('exp', 0) < int(time.time()):
+            return None
+        return payload
+    except Exception:
+        return None
+
+
+def get_tenant(headers: dict):
+    """tenant_id из X-Auth-Token. Проверенные токены кэшируются до их exp — повторный вызов без HMAC и JSON"""
+    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
+    if not token:
+        return None
+    now = time.time()
+    tenant_id = _tokens.get(token, now)
+    if tenant_id:
+        return tenant_id
+    payload = jwt_decode(token, os.environ.get('GEO_JWT_SECRET', 'dev-secret'))
+    tenant_id = payload.get('tid') if payload else None
+    if tenant_id:
+        _tokens.set(token, tenant_id, payload.get('exp', 0))
+    return tenant_id
+
+
+def _row_id(row):
+    """Достаёт id из строки независимо от типа курсора (dict или tuple)."""
+    if row is None:
+        return None
+    try:
+        return str(row['id'])
+    except (TypeError, KeyError, IndexError):
+        return str(row[0])
+
+
+def resolve_project(cur, tenant_id: str, project_id, create: bool = True):
+    """Возвращает валидный project_id (переданный или дефолтный); при create=True гарантирует наличие проекта.
+    Найденные проекты кэшируются на PROJECT_CACHE_TTL; только что созданный — нет (транзакция может откатиться)."""
+    key = (str(tenant_id), str(project_id) if project_id else None)
+    now = time.monotonic()
+    cached = _projects.get(key, now)
+    if cached:
+        return cached
+    rid = None
+    if project_id:
+        cur.execute('SELECT id FROM geo_projects WHERE tenant_id = %s AND id = %s',
+                    (tenant_id, project_id))
+        rid = _row_id(cur.fetchone())
+    if not rid:
+        cur.execute(
+            'SELECT id FROM geo_projects WHERE tenant_id = %s ORDER BY is_default DESC, created_at ASC LIMIT 1',
+            (tenant_id,)
+        )
+        rid = _row_id(cur.fetchone())
+    if rid:
+        _projects.set(key, rid, now + PROJECT_CACHE_TTL)
+        return rid
+    if not create:
+        return None
+    cur.execute(
+        'INSERT INTO geo_projects (tenant_id, name, is_default) VALUES (%s, %s, TRUE) RETURNING id',
+        (tenant_id, 'Основной проект')
+    )
+    return _row_id(cur.fetchone())
+
+
+def invalidate_projects(tenant_id: str):
+    """Сбрасывает кэш проектов tenant'а — вызывается после создания и удаления проекта"""
+    tenant_id = str(tenant_id)
+    _projects.discard_if(lambda key: key[0] == tenant_id)
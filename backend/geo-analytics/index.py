@@ -1,23 +1,38 @@
 """
 Business: Аналитика GEO-платформы — SOV, динамика, лента упоминаний, покрытие запросов.
-Args: event с httpMethod=GET, headers (X-Auth-Token), queryStringParameters (action, days, limit, query_id)
+Args: event с httpMethod=GET, headers (X-Auth-Token, If-None-Match), queryStringParameters
+      (action=overview|sov_trend|mentions|coverage|dashboard|export, days, limit, cursor, format, project_id)
 Returns: HTTP-ответ с агрегированными метриками
 """
+import base64
+import csv
+import gzip
+import io
 import json
 import os
-import hmac
-import hashlib
-import base64
-import time
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+import numpy as np
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from geo_cache import cached_response
+from geo_context import get_tenant, resolve_project
+from storage import presigned_url, upload_fileobj
+
+EXPORT_MAX_DAYS = 366
+EXPORT_FETCH_ROWS = 2000
+EXPORT_FORMATS = ('csv', 'ndjson')
+# Выгрузка отдаётся временной ссылкой, сами файлы geo-exports/ удаляет geo-cron через сутки
+EXPORT_URL_TTL = 3600
+
 
 def cors_headers():
     return {
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Methods': 'GET, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+        'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, If-None-Match',
         'Access-Control-Max-Age': '86400',
         'Content-Type': 'application/json',
     }
@@ -28,38 +43,6 @@ def resp(status, body):
             'body': json.dumps(body, ensure_ascii=False, default=str)}
 
 
-def b64url_decode(s: str) -> bytes:
-    pad = '=' * (-len(s) % 4)
-    return base64.urlsafe_b64decode(s + pad)
-
-
-def b64url(data: bytes) -> str:
-    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
-
-
-def jwt_decode(token: str, secret: str):
-    try:
-        h, p, s = token.split('.')
-        sig_input = f'{h}.{p}'.encode()
-        expected = hmac.new(secret.encode(), sig_input, hashlib.sha256).digest()
-        if not hmac.compare_digest(b64url(expected), s):
-            return None
-        payload = json.loads(b64url_decode(p))
-        if payload.get('exp', 0) < int(time.time()):
-            return None
-        return payload
-    except Exception:
-        return None
-
-
-def get_tenant(headers: dict):
-    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
-    if not token:
-        return None
-    payload = jwt_decode(token, os.environ.get('GEO_JWT_SECRET', 'dev-secret'))
-    return payload.get('tid') if payload else None
-
-
 def get_db():
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
@@ -79,283 +62,331 @@ def handler(event, context):
     qs = event.get('queryStringParameters') or {}
     action = qs.get('action') or 'overview'
     project_id = qs.get('project_id')
+    cursor = qs.get('cursor') or None
+
+    if action == 'export':
+        fmt = qs.get('format') or 'csv'
+        if fmt not in EXPORT_FORMATS:
+            return resp(400, {'error': 'bad_format'})
+        try:
+            export_days = max(1, min(EXPORT_MAX_DAYS, int(qs.get('days', '30'))))
+        except (TypeError, ValueError):
+            export_days = 30
+        return export_mentions(tenant_id, export_days, fmt, project_id)
 
     try:
         days = max(1, min(90, int(qs.get('days', '7'))))
     except (TypeError, ValueError):
         days = 7
 
-    if action == 'overview':
-        return overview(tenant_id, days, project_id)
-    if action == 'sov_trend':
-        return sov_trend(tenant_id, days, project_id)
-    if action == 'mentions':
+    try:
+        limit = max(1, min(100, int(qs.get('limit', '20'))))
+    except (TypeError, ValueError):
+        limit = 20
+
+    builders = {
+        'overview': lambda conn: _report(conn, tenant_id, project_id, overview_data, days),
+        'sov_trend': lambda conn: _report(conn, tenant_id, project_id, sov_trend_data, days),
+        'mentions': lambda conn: _report(conn, tenant_id, project_id, mentions_data, days, limit, cursor),
+        'coverage': lambda conn: _report(conn, tenant_id, project_id, coverage_data, days),
+        'dashboard': lambda conn: dashboard(conn, tenant_id, days, limit, project_id),
+    }
+    if action not in builders:
+        return resp(400, {'error': 'unknown_action'})
+    if cursor:
         try:
-            limit = max(1, min(100, int(qs.get('limit', '20'))))
-        except (TypeError, ValueError):
-            limit = 20
-        return mentions_feed(tenant_id, days, limit, project_id)
-    if action == 'coverage':
-        return coverage(tenant_id, days, project_id)
-    return resp(400, {'error': 'unknown_action'})
-
-
-def resolve_project(cur, tenant_id: str, project_id):
-    """Возвращает валидный project_id (переданный или дефолтный), гарантирует наличие проекта."""
-    if project_id:
-        cur.execute('SELECT id FROM geo_projects WHERE tenant_id = %s AND id = %s',
-                    (tenant_id, project_id))
-        row = cur.fetchone()
-        if row:
-            return str(row['id'])
+            decode_cursor(cursor)
+        except ValueError:
+            return resp(400, {'error': 'bad_cursor'})
+    return cached_response(headers, tenant_id, ('analytics', action, project_id, days, limit, cursor),
+                           builders[action], cors_headers())
+
+
+def _report(conn, tenant_id: str, project_id, build, *args):
+    """Один отчёт на соединении кэша: resolved project_id и построитель build(cur, tenant_id, pid, *args) -> dict."""
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            pid = resolve_project(cur, tenant_id, project_id)
+            data = build(cur, tenant_id, pid, *args)
+    return resp(200, data)
+
+
+def dashboard(conn, tenant_id: str, days: int, limit: int, project_id=None):
+    """Все четыре отчёта страницы аналитики за один вызов: одно соединение, один resolve_project
+    и один снимок данных (REPEATABLE READ), чтобы цифры блоков были согласованы между собой."""
+    conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+    with conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            pid = resolve_project(cur, tenant_id, project_id)
+            feed = mentions_data(cur, tenant_id, pid, days, limit)
+            data = {
+                'project_id': pid,
+                'overview': overview_data(cur, tenant_id, pid, days),
+                'sov_trend': sov_trend_data(cur, tenant_id, pid, days),
+                'mentions': feed['mentions'],
+                'mentions_next_cursor': feed['next_cursor'],
+                'coverage': coverage_data(cur, tenant_id, pid, days)['coverage'],
+            }
+    return resp(200, data)
+
+
+def overview_data(cur, tenant_id: str, pid: str, days: int) -> dict:
+    # Счётчики — одним запросом со скалярными подзапросами вместо пяти round trip'ов
     cur.execute(
-        'SELECT id FROM geo_projects WHERE tenant_id = %s ORDER BY is_default DESC, created_at ASC LIMIT 1',
-        (tenant_id,)
+        """
+        SELECT
+          (SELECT COUNT(*) FILTER (WHERE is_active) FROM geo_tracked_queries
+            WHERE tenant_id = %(t)s AND project_id = %(p)s) AS q_active,
+          (SELECT COUNT(*) FROM geo_tracked_queries
+            WHERE tenant_id = %(t)s AND project_id = %(p)s) AS q_total,
+          (SELECT COUNT(*) FILTER (WHERE is_own) FROM geo_brands
+            WHERE tenant_id = %(t)s AND project_id = %(p)s) AS b_own,
+          (SELECT COUNT(*) FROM geo_brands
+            WHERE tenant_id = %(t)s AND project_id = %(p)s) AS b_total,
+          (SELECT COUNT(*) FROM geo_mentions m
+            JOIN geo_brands br ON br.id = m.brand_id
+            WHERE m.tenant_id = %(t)s AND br.project_id = %(p)s
+              AND m.created_at >= NOW() - (%(d)s || ' days')::interval) AS mentions,
+          (SELECT COUNT(*) FROM geo_llm_responses r
+            JOIN geo_tracked_queries tq ON tq.id = r.query_id
+            WHERE r.tenant_id = %(t)s AND tq.project_id = %(p)s
+              AND r.polled_at >= NOW() - (%(d)s || ' days')::interval) AS responses,
+          (SELECT COUNT(DISTINCT q.id)
+            FROM geo_tracked_queries q
+            JOIN geo_llm_responses r ON r.query_id = q.id AND r.tenant_id = q.tenant_id
+            JOIN geo_mentions m ON m.response_id = r.id AND m.tenant_id = q.tenant_id
+            JOIN geo_brands b ON b.id = m.brand_id AND b.tenant_id = q.tenant_id
+            WHERE q.tenant_id = %(t)s AND q.project_id = %(p)s AND b.is_own = TRUE
+              AND r.polled_at >= NOW() - (%(d)s || ' days')::interval) AS covered
+        """,
+        {'t': tenant_id, 'p': pid, 'd': days}
     )
-    row = cur.fetchone()
-    if row:
-        return str(row['id'])
+    c = cur.fetchone()
+
     cur.execute(
-        'INSERT INTO geo_projects (tenant_id, name, is_default) VALUES (%s, %s, TRUE) RETURNING id',
-        (tenant_id, 'Основной проект')
+        """
+        SELECT b.id, b.name, b.is_own, COUNT(m.id) AS mentions,
+               AVG(m.sentiment_score)::float AS avg_sentiment
+        FROM geo_brands b
+        LEFT JOIN geo_mentions m
+          ON m.brand_id = b.id AND m.tenant_id = b.tenant_id
+          AND m.created_at >= NOW() - (%s || ' days')::interval
+        WHERE b.tenant_id = %s AND b.project_id = %s
+        GROUP BY b.id, b.name, b.is_own
+        ORDER BY mentions DESC
+        """,
+        (days, tenant_id, pid)
     )
-    return str(cur.fetchone()['id'])
+    brands_rows = cur.fetchall()
+
+    total_mentions = sum(r['mentions'] for r in brands_rows) or 0
+    sov = []
+    own_sov = 0.0
+    for r in brands_rows:
+        share = (r['mentions'] / total_mentions * 100) if total_mentions else 0.0
+        if r['is_own']:
+            own_sov = share
+        sov.append({
+            'brand_id': str(r['id']),
+            'name': r['name'],
+            'is_own': r['is_own'],
+            'mentions': r['mentions'],
+            'sov': round(share, 1),
+            'avg_sentiment': round(r['avg_sentiment'] or 0.0, 2),
+        })
 
+    return {
+        'period_days': days,
+        'queries': {'active': c['q_active'] or 0, 'total': c['q_total'] or 0},
+        'brands': {'own': c['b_own'] or 0, 'total': c['b_total'] or 0},
+        'responses': c['responses'],
+        'mentions': c['mentions'],
+        'own_sov': round(own_sov, 1),
+        'covered_queries': c['covered'] or 0,
+        'sov': sov,
+    }
 
-def overview(tenant_id: str, days: int, project_id=None):
-    conn = get_db()
-    try:
-        with conn:
-          with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            pid = resolve_project(cur, tenant_id, project_id)
-            cur.execute(
-                'SELECT COUNT(*) FILTER (WHERE is_active) AS active, COUNT(*) AS total '
-                'FROM geo_tracked_queries WHERE tenant_id = %s AND project_id = %s', (tenant_id, pid)
-            )
-            q = cur.fetchone()
-
-            cur.execute(
-                'SELECT COUNT(*) FILTER (WHERE is_own) AS own, COUNT(*) AS total '
-                'FROM geo_brands WHERE tenant_id = %s AND project_id = %s', (tenant_id, pid)
-            )
-            b = cur.fetchone()
-
-            cur.execute(
-                "SELECT COUNT(*) AS cnt FROM geo_mentions m "
-                "JOIN geo_brands br ON br.id = m.brand_id "
-                "WHERE m.tenant_id = %s AND br.project_id = %s "
-                "AND m.created_at >= NOW() - (%s || ' days')::interval",
-                (tenant_id, pid, days)
-            )
-            mentions_cnt = cur.fetchone()['cnt']
-
-            cur.execute(
-                "SELECT COUNT(*) AS cnt FROM geo_llm_responses r "
-                "JOIN geo_tracked_queries tq ON tq.id = r.query_id "
-                "WHERE r.tenant_id = %s AND tq.project_id = %s "
-                "AND r.polled_at >= NOW() - (%s || ' days')::interval",
-                (tenant_id, pid, days)
-            )
-            responses_cnt = cur.fetchone()['cnt']
-
-            cur.execute(
-                """
-                SELECT b.id, b.name, b.is_own, COUNT(m.id) AS mentions,
-                       AVG(m.sentiment_score)::float AS avg_sentiment
-                FROM geo_brands b
-                LEFT JOIN geo_mentions m
-                  ON m.brand_id = b.id AND m.tenant_id = b.tenant_id
-                  AND m.created_at >= NOW() - (%s || ' days')::interval
-                WHERE b.tenant_id = %s AND b.project_id = %s
-                GROUP BY b.id, b.name, b.is_own
-                ORDER BY mentions DESC
-                """,
-                (days, tenant_id, pid)
-            )
-            brands_rows = cur.fetchall()
-
-            total_mentions = sum(r['mentions'] for r in brands_rows) or 0
-            sov = []
-            own_sov = 0.0
-            for r in brands_rows:
-                share = (r['mentions'] / total_mentions * 100) if total_mentions else 0.0
-                if r['is_own']:
-                    own_sov = share
-                sov.append({
-                    'brand_id': str(r['id']),
-                    'name': r['name'],
-                    'is_own': r['is_own'],
-                    'mentions': r['mentions'],
-                    'sov': round(share, 1),
-                    'avg_sentiment': round(r['avg_sentiment'] or 0.0, 2),
-                })
-
-            cur.execute(
-                """
-                SELECT COUNT(DISTINCT q.id) AS covered
-                FROM geo_tracked_queries q
-                JOIN geo_llm_responses r ON r.query_id = q.id AND r.tenant_id = q.tenant_id
-                JOIN geo_mentions m ON m.response_id = r.id AND m.tenant_id = q.tenant_id
-                JOIN geo_brands b ON b.id = m.brand_id AND b.tenant_id = q.tenant_id
-                WHERE q.tenant_id = %s AND q.project_id = %s AND b.is_own = TRUE
-                  AND r.polled_at >= NOW() - (%s || ' days')::interval
-                """,
-                (tenant_id, pid, days)
-            )
-            covered = cur.fetchone()['covered'] or 0
-
-        return resp(200, {
-            'period_days': days,
-            'queries': {'active': q['active'] or 0, 'total': q['total'] or 0},
-            'brands': {'own': b['own'] or 0, 'total': b['total'] or 0},
-            'responses': responses_cnt,
-            'mentions': mentions_cnt,
-            'own_sov': round(own_sov, 1),
-            'covered_queries': covered,
-            'sov': sov,
-        })
-    finally:
-        conn.close()
 
+def sov_trend_data(cur, tenant_id: str, pid: str, days: int) -> dict:
+    """Доля голоса брендов по дням в колоночном виде: оси days и brands (по id — одноимённые бренды
+    не склеиваются), матрицы counts/share [бренд][день]. Разворот и доли считаются на NumPy."""
+    cur.execute(
+        """
+        WITH w AS (SELECT (CURRENT_DATE - (%s - 1))::date AS start),
+        daily AS (
+          SELECT date_trunc('day', m.created_at)::date AS day, m.brand_id, COUNT(*) AS cnt
+          FROM geo_mentions m
+          JOIN geo_brands b ON b.id = m.brand_id AND b.tenant_id = m.tenant_id
+          WHERE m.tenant_id = %s AND b.project_id = %s
+            AND m.created_at >= (SELECT start FROM w)
+          GROUP BY 1, 2
+        )
+        SELECT w.start, d.day - w.start AS day_idx, d.brand_id, b.name, b.is_own, d.cnt
+        FROM w
+        LEFT JOIN daily d ON TRUE
+        LEFT JOIN geo_brands b ON b.id = d.brand_id
+        ORDER BY d.brand_id, d.day
+        """,
+        (days, tenant_id, pid)
+    )
+    rows = cur.fetchall()
+    start = rows[0]['start']
+    rows = [r for r in rows if r['brand_id'] is not None and 0 <= r['day_idx'] < days]
+
+    brands = {}
+    for r in rows:
+        bid = str(r['brand_id'])
+        if bid not in brands:
+            brands[bid] = {'id': bid, 'name': r['name'], 'is_own': r['is_own']}
+    brand_idx = {bid: i for i, bid in enumerate(brands)}
+
+    counts = np.zeros((len(brands), days), dtype=np.int64)
+    if rows:
+        counts[
+            np.fromiter((brand_idx[str(r['brand_id'])] for r in rows), dtype=np.intp, count=len(rows)),
+            np.fromiter((r['day_idx'] for r in rows), dtype=np.intp, count=len(rows)),
+        ] = np.fromiter((r['cnt'] for r in rows), dtype=np.int64, count=len(rows))
+    total = counts.sum(axis=0)
+    share = np.divide(counts * 100.0, total, out=np.zeros(counts.shape), where=total > 0).round(1)
 
-def sov_trend(tenant_id: str, days: int, project_id=None):
-    conn = get_db()
-    try:
-        with conn:
-          with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            pid = resolve_project(cur, tenant_id, project_id)
-            cur.execute(
-                """
-                WITH days_series AS (
-                  SELECT generate_series(
-                    (CURRENT_DATE - (%s - 1) * INTERVAL '1 day')::date,
-                    CURRENT_DATE,
-                    INTERVAL '1 day'
-                  )::date AS day
-                ),
-                daily AS (
-                  SELECT date_trunc('day', m.created_at)::date AS day,
-                         b.id AS brand_id, b.name, b.is_own,
-                         COUNT(*) AS cnt
-                  FROM geo_mentions m
-                  JOIN geo_brands b ON b.id = m.brand_id AND b.tenant_id = m.tenant_id
-                  WHERE m.tenant_id = %s AND b.project_id = %s
-                    AND m.created_at >= CURRENT_DATE - (%s - 1) * INTERVAL '1 day'
-                  GROUP BY 1, 2, 3, 4
-                )
-                SELECT ds.day, d.brand_id, d.name, d.is_own, COALESCE(d.cnt, 0) AS cnt
-                FROM days_series ds
-                LEFT JOIN daily d ON d.day = ds.day
-                ORDER BY ds.day, d.brand_id NULLS LAST
-                """,
-                (days, tenant_id, pid, days)
-            )
-            rows = cur.fetchall()
-
-        days_map = {}
-        brands_set = {}
-        for r in rows:
-            day = r['day'].isoformat()
-            if day not in days_map:
-                days_map[day] = {}
-            if r['brand_id']:
-                bid = str(r['brand_id'])
-                days_map[day][bid] = r['cnt']
-                brands_set[bid] = {'id': bid, 'name': r['name'], 'is_own': r['is_own']}
-
-        brands_list = list(brands_set.values())
-        trend = []
-        for day in sorted(days_map.keys()):
-            total = sum(days_map[day].values()) or 0
-            point = {'day': day, 'total': total}
-            for b in brands_list:
-                cnt = days_map[day].get(b['id'], 0)
-                point[b['name']] = round((cnt / total * 100) if total else 0, 1)
-            trend.append(point)
-
-        return resp(200, {'trend': trend, 'brands': brands_list})
-    finally:
-        conn.close()
+    return {
+        'days': [(start + timedelta(days=i)).isoformat() for i in range(days)],
+        'total': total.tolist(),
+        'brands': list(brands.values()),
+        'counts': counts.tolist(),
+        'share': share.tolist(),
+    }
+
+
+MENTIONS_SQL = """
+    SELECT m.id, m.sentiment, m.sentiment_score, m.snippet, m.position, m.created_at,
+           b.name AS brand_name, b.is_own,
+           r.provider, r.model,
+           q.text AS query_text, q.id AS query_id
+    FROM geo_mentions m
+    JOIN geo_brands b ON b.id = m.brand_id AND b.tenant_id = m.tenant_id
+    JOIN geo_llm_responses r ON r.id = m.response_id AND r.tenant_id = m.tenant_id
+    JOIN geo_tracked_queries q ON q.id = r.query_id AND q.tenant_id = m.tenant_id
+    WHERE m.tenant_id = %s AND b.project_id = %s
+      AND m.created_at >= NOW() - (%s || ' days')::interval
+"""
+
+MENTION_FIELDS = ('id', 'created_at', 'brand_name', 'is_own', 'sentiment', 'sentiment_score',
+                  'position', 'provider', 'model', 'query_id', 'query_text', 'snippet')
 
 
-def mentions_feed(tenant_id: str, days: int, limit: int, project_id=None):
+def _mention_row(r) -> dict:
+    return {
+        'id': str(r['id']),
+        'brand_name': r['brand_name'],
+        'is_own': r['is_own'],
+        'sentiment': r['sentiment'],
+        'sentiment_score': r['sentiment_score'],
+        'snippet': r['snippet'],
+        'position': r['position'],
+        'provider': r['provider'],
+        'model': r['model'],
+        'query_text': r['query_text'],
+        'query_id': str(r['query_id']),
+        'created_at': r['created_at'].isoformat(),
+    }
+
+
+def encode_cursor(created_at, mention_id) -> str:
+    raw = f'{created_at.isoformat()}|{mention_id}'.encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor: str):
+    """(created_at, id) из курсора ленты; ValueError, если курсор подделан или повреждён."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, mention_id = raw.split('|', 1)
+        return datetime.fromisoformat(created_at), str(uuid.UUID(mention_id))
+    except Exception as e:
+        raise ValueError('bad_cursor') from e
+
+
+def mentions_data(cur, tenant_id: str, pid: str, days: int, limit: int, cursor=None) -> dict:
+    """Страница ленты упоминаний (новые сверху). Keyset-пагинация по (created_at, id):
+    next_cursor передаётся обратно как cursor и не зависит от глубины листания."""
+    sql, args = MENTIONS_SQL, [tenant_id, pid, days]
+    if cursor:
+        sql += '  AND (m.created_at, m.id) < (%s, %s)\n'
+        args.extend(decode_cursor(cursor))
+    cur.execute(sql + '    ORDER BY m.created_at DESC, m.id DESC LIMIT %s', args + [limit + 1])
+    rows = cur.fetchall()
+    next_cursor = encode_cursor(rows[limit - 1]['created_at'], rows[limit - 1]['id']) if len(rows) > limit else None
+    return {'mentions': [_mention_row(r) for r in rows[:limit]], 'next_cursor': next_cursor}
+
+
+def export_mentions(tenant_id: str, days: int, fmt: str, project_id=None):
+    """Полная выгрузка упоминаний за период в CSV или NDJSON (gzip) в S3.
+    Строки читаются серверным (named) курсором пачками по EXPORT_FETCH_ROWS и сразу пишутся
+    во временный файл — память не зависит от объёма выгрузки. Возвращает presigned-ссылку на EXPORT_URL_TTL секунд."""
     conn = get_db()
     try:
-        with conn:
-          with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            pid = resolve_project(cur, tenant_id, project_id)
-            cur.execute(
-                """
-                SELECT m.id, m.sentiment, m.sentiment_score, m.snippet, m.position, m.created_at,
-                       b.name AS brand_name, b.is_own,
-                       r.provider, r.model,
-                       q.text AS query_text, q.id AS query_id
-                FROM geo_mentions m
-                JOIN geo_brands b ON b.id = m.brand_id AND b.tenant_id = m.tenant_id
-                JOIN geo_llm_responses r ON r.id = m.response_id AND r.tenant_id = m.tenant_id
-                JOIN geo_tracked_queries q ON q.id = r.query_id AND q.tenant_id = m.tenant_id
-                WHERE m.tenant_id = %s AND b.project_id = %s
-                  AND m.created_at >= NOW() - (%s || ' days')::interval
-                ORDER BY m.created_at DESC
-                LIMIT %s
-                """,
-                (tenant_id, pid, days, limit)
-            )
-            rows = cur.fetchall()
-        return resp(200, {'mentions': [{
-            'id': str(r['id']),
-            'brand_name': r['brand_name'],
-            'is_own': r['is_own'],
-            'sentiment': r['sentiment'],
-            'sentiment_score': r['sentiment_score'],
-            'snippet': r['snippet'],
-            'position': r['position'],
-            'provider': r['provider'],
-            'model': r['model'],
-            'query_text': r['query_text'],
-            'query_id': str(r['query_id']),
-            'created_at': r['created_at'].isoformat(),
-        } for r in rows]})
+        with tempfile.TemporaryFile() as raw:
+            rows = 0
+            encoding = 'utf-8-sig' if fmt == 'csv' else 'utf-8'
+            with conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    pid = resolve_project(cur, tenant_id, project_id)
+                with io.TextIOWrapper(gzip.GzipFile(fileobj=raw, mode='wb'), encoding=encoding, newline='') as out:
+                    writer = None
+                    if fmt == 'csv':
+                        writer = csv.writer(out)
+                        writer.writerow(MENTION_FIELDS)
+                    with conn.cursor(name='geo_mentions_export', cursor_factory=RealDictCursor) as cur:
+                        cur.itersize = EXPORT_FETCH_ROWS
+                        cur.execute(MENTIONS_SQL + '    ORDER BY m.created_at, m.id', (tenant_id, pid, days))
+                        for r in cur:
+                            item = _mention_row(r)
+                            if writer:
+                                writer.writerow([item[f] for f in MENTION_FIELDS])
+                            else:
+                                out.write(json.dumps(item, ensure_ascii=False) + '\n')
+                            rows += 1
+            # Транзакция уже закрыта — загрузка в S3 не держит соединение с БД
+            raw.seek(0)
+            key = f'geo-exports/{tenant_id}/mentions-{pid}-{uuid.uuid4().hex}.{fmt}.gz'
+            upload_fileobj(raw, key, 'application/gzip')
+        print(f'[export] tenant {tenant_id}: {rows} mentions -> {key}')
+        return resp(200, {'url': presigned_url(key, EXPORT_URL_TTL), 'expires_in': EXPORT_URL_TTL,
+                          'format': fmt, 'rows': rows, 'days': days})
     finally:
         conn.close()
 
 
-def coverage(tenant_id: str, days: int, project_id=None):
-    conn = get_db()
-    try:
-        with conn:
-          with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            pid = resolve_project(cur, tenant_id, project_id)
-            cur.execute(
-                """
-                SELECT q.id, q.text, q.language,
-                       COUNT(DISTINCT r.id) AS responses,
-                       COUNT(DISTINCT m.id) FILTER (WHERE b.is_own) AS own_mentions,
-                       COUNT(DISTINCT m.id) FILTER (WHERE NOT b.is_own) AS competitor_mentions,
-                       MAX(r.polled_at) AS last_polled
-                FROM geo_tracked_queries q
-                LEFT JOIN geo_llm_responses r
-                  ON r.query_id = q.id AND r.tenant_id = q.tenant_id
-                  AND r.polled_at >= NOW() - (%s || ' days')::interval
-                LEFT JOIN geo_mentions m
-                  ON m.response_id = r.id AND m.tenant_id = q.tenant_id
-                LEFT JOIN geo_brands b
-                  ON b.id = m.brand_id AND b.tenant_id = q.tenant_id
-                WHERE q.tenant_id = %s AND q.project_id = %s
-                GROUP BY q.id, q.text, q.language
-                ORDER BY own_mentions DESC, responses DESC
-                """,
-                (days, tenant_id, pid)
-            )
-            rows = cur.fetchall()
-        return resp(200, {'coverage': [{
-            'query_id': str(r['id']),
-            'text': r['text'],
-            'language': r['language'],
-            'responses': r['responses'],
-            'own_mentions': r['own_mentions'],
-            'competitor_mentions': r['competitor_mentions'],
-            'last_polled': r['last_polled'].isoformat() if r['last_polled'] else None,
-        } for r in rows]})
-    finally:
-        conn.close()
\ No newline at end of file
+def coverage_data(cur, tenant_id: str, pid: str, days: int) -> dict:
+    cur.execute(
+        """
+        SELECT q.id, q.text, q.language,
+               COUNT(DISTINCT r.id) AS responses,
+               COUNT(DISTINCT m.id) FILTER (WHERE b.is_own) AS own_mentions,
+               COUNT(DISTINCT m.id) FILTER (WHERE NOT b.is_own) AS competitor_mentions,
+               MAX(r.polled_at) AS last_polled
+        FROM geo_tracked_queries q
+        LEFT JOIN geo_llm_responses r
+          ON r.query_id = q.id AND r.tenant_id = q.tenant_id
+          AND r.polled_at >= NOW() - (%s || ' days')::interval
+        LEFT JOIN geo_mentions m
+          ON m.response_id = r.id AND m.tenant_id = q.tenant_id
+        LEFT JOIN geo_brands b
+          ON b.id = m.brand_id AND b.tenant_id = q.tenant_id
+        WHERE q.tenant_id = %s AND q.project_id = %s
+        GROUP BY q.id, q.text, q.language
+        ORDER BY own_mentions DESC, responses DESC
+        """,
+        (days, tenant_id, pid)
+    )
+    rows = cur.fetchall()
+    return {'coverage': [{
+        'query_id': str(r['id']),
+        'text': r['text'],
+        'language': r['language'],
+        'responses': r['responses'],
+        'own_mentions': r['own_mentions'],
+        'competitor_mentions': r['competitor_mentions'],
+        'last_polled': r['last_polled'].isoformat() if r['last_polled'] else None,
+    } for r in rows]}
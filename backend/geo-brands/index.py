@@ -5,13 +5,12 @@ Returns: HTTP-ответ со списком брендов или резуль
 """
 import json
 import os
-import hmac
-import hashlib
-import base64
-import time
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from geo_cache import mark_changed
+from geo_context import get_tenant, resolve_project
+
 
 def cors_headers():
     return {
@@ -28,69 +27,10 @@ def resp(status, body):
             'body': json.dumps(body, ensure_ascii=False, default=str)}
 
 
-def b64url_decode(s: str) -> bytes:
-    pad = '=' * (-len(s) % 4)
-    return base64.urlsafe_b64decode(s + pad)
-
-
-def b64url(data: bytes) -> str:
-    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
-
-
-def jwt_decode(token: str, secret: str):
-    try:
-        h, p, s = token.split('.')
-        sig_input = f'{h}.{p}'.encode()
-        expected = hmac.new(secret.encode(), sig_input, hashlib.sha256).digest()
-        if not hmac.compare_digest(b64url(expected), s):
-            return None
-        payload = json.loads(b64url_decode(p))
-        if payload.get('exp', 0) < int(time.time()):
-            return None
-        return payload
-    except Exception:
-        return None
-
-
-def get_tenant(headers: dict):
-    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
-    if not token:
-        return None
-    payload = jwt_decode(token, os.environ.get('GEO_JWT_SECRET', 'dev-secret'))
-    if not payload:
-        return None
-    return payload.get('tid')
-
-
 def get_db():
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 
-def resolve_project(cur, tenant_id: str, project_id):
-    """
-    Возвращает валидный project_id: либо переданный (если принадлежит tenant),
-    либо дефолтный проект tenant'а. Гарантирует наличие хотя бы одного проекта.
-    """
-    if project_id:
-        cur.execute('SELECT id FROM geo_projects WHERE tenant_id = %s AND id = %s',
-                    (tenant_id, project_id))
-        row = cur.fetchone()
-        if row:
-            return str(row['id'])
-    cur.execute(
-        'SELECT id FROM geo_projects WHERE tenant_id = %s ORDER BY is_default DESC, created_at ASC LIMIT 1',
-        (tenant_id,)
-    )
-    row = cur.fetchone()
-    if row:
-        return str(row['id'])
-    cur.execute(
-        'INSERT INTO geo_projects (tenant_id, name, is_default) VALUES (%s, %s, TRUE) RETURNING id',
-        (tenant_id, 'Основной проект')
-    )
-    return str(cur.fetchone()['id'])
-
-
 def handler(event, context):
     method = event.get('httpMethod', 'GET')
     if method == 'OPTIONS':
@@ -113,12 +53,17 @@ def handler(event, context):
     if method == 'GET':
         return list_brands(tenant_id, project_id)
     if method == 'POST':
-        return create_brand(tenant_id, body, project_id)
-    if method == 'PUT':
-        return update_brand(tenant_id, qs.get('id', ''), body)
-    if method == 'DELETE':
-        return delete_brand(tenant_id, qs.get('id', ''))
-    return resp(405, {'error': 'method_not_allowed'})
+        result = create_brand(tenant_id, body, project_id)
+    elif method == 'PUT':
+        result = update_brand(tenant_id, qs.get('id', ''), body)
+    elif method == 'DELETE':
+        result = delete_brand(tenant_id, qs.get('id', ''))
+    else:
+        return resp(405, {'error': 'method_not_allowed'})
+    # Бренды входят во все отчёты аналитики — сбрасываем закэшированные ответы
+    if result['statusCode'] == 200:
+        mark_changed(tenant_id)
+    return result
 
 
 def list_brands(tenant_id: str, project_id=None):
@@ -6,15 +6,14 @@ Returns: HTTP-ответ со списком черновиков, одним ч
 import json
 import os
 import re
-import hmac
-import hashlib
-import base64
-import time
 import urllib.request
 import urllib.error
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from geo_cache import bump_data_version
+from geo_context import get_tenant, resolve_project
+
 
 VSEGPT_BASE = 'https://api.vsegpt.ru/v1/chat/completions'
 DEFAULT_MODEL = 'openai/gpt-4o-mini'
@@ -35,38 +34,6 @@ def resp(status, body):
             'body': json.dumps(body, ensure_ascii=False, default=str)}
 
 
-def b64url_decode(s: str) -> bytes:
-    pad = '=' * (-len(s) % 4)
-    return base64.urlsafe_b64decode(s + pad)
-
-
-def b64url(data: bytes) -> str:
-    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
-
-
-def jwt_decode(token: str, secret: str):
-    try:
-        h, p, s = token.split('.')
-        sig_input = f'{h}.{p}'.encode()
-        expected = hmac.new(secret.encode(), sig_input, hashlib.sha256).digest()
-        if not hmac.compare_digest(b64url(expected), s):
-            return None
-        payload = json.loads(b64url_decode(p))
-        if payload.get('exp', 0) < int(time.time()):
-            return None
-        return payload
-    except Exception:
-        return None
-
-
-def get_tenant(headers: dict):
-    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
-    if not token:
-        return None
-    payload = jwt_decode(token, os.environ.get('GEO_JWT_SECRET', 'dev-secret'))
-    return payload.get('tid') if payload else None
-
-
 def get_db():
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
@@ -137,28 +104,6 @@ def handler(event, context):
     return resp(405, {'error': 'method_not_allowed'})
 
 
-def resolve_project(cur, tenant_id: str, project_id):
-    """Возвращает валидный project_id (переданный или дефолтный), гарантирует наличие проекта."""
-    if project_id:
-        cur.execute('SELECT id FROM geo_projects WHERE tenant_id = %s AND id = %s',
-                    (tenant_id, project_id))
-        row = cur.fetchone()
-        if row:
-            return str(row['id'])
-    cur.execute(
-        'SELECT id FROM geo_projects WHERE tenant_id = %s ORDER BY is_default DESC, created_at ASC LIMIT 1',
-        (tenant_id,)
-    )
-    row = cur.fetchone()
-    if row:
-        return str(row['id'])
-    cur.execute(
-        'INSERT INTO geo_projects (tenant_id, name, is_default) VALUES (%s, %s, TRUE) RETURNING id',
-        (tenant_id, 'Основной проект')
-    )
-    return str(cur.fetchone()['id'])
-
-
 def list_drafts(tenant_id: str, project_id=None):
     conn = get_db()
     try:
@@ -266,6 +211,7 @@ def _sync_draft_to_publication(conn, tenant_id: str, draft_id: str,
                 'project_id=COALESCE(project_id, %s), updated_at=NOW() WHERE id=%s',
                 (title, url, platform, project_id, existing['id'])
             )
+            bump_data_version(cur, tenant_id)
             return str(existing['id'])
         cur.execute(
             """
@@ -276,7 +222,9 @@ def _sync_draft_to_publication(conn, tenant_id: str, draft_id: str,
             """,
             (tenant_id, project_id, draft_id, query_id, title, url, platform)
         )
-        return str(cur.fetchone()['id'])
+        pub_id = str(cur.fetchone()['id'])
+        bump_data_version(cur, tenant_id)
+        return pub_id
 
 
 def create_draft(tenant_id: str, body: dict, project_id=None):
@@ -1,8 +1,8 @@
 """
 Business: CRON-обработчик расписания GEO-платформы. Опрашивает все активные tenant
 по расписанию (poll_interval_hours), запускает проверку публикаций (pub_check_interval_hours).
-Args: event с httpMethod=POST, headers (X-Cron-Key), body: {kind: 'poll'|'pub_check'|'all'}
-Returns: {tenants_processed, polls_run, pub_checks_run, runs}
+Args: event с httpMethod=POST, headers (X-Cron-Key), body: {kind: 'poll'|'pub_check'|'all'|'export'}
+Returns: {tenants_processed, polls_run, pub_checks_run, runs[, export]}
 """
 import json
 import os
@@ -15,6 +15,8 @@ import urllib.error
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from geo_cache import bump_data_version
+
 
 VSEGPT_BASE = 'https://api.vsegpt.ru/v1/chat/completions'
 YANDEX_GPT_BASE = 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion'
@@ -23,6 +25,9 @@ PROVIDERS = {
     'yandex_gpt': 'yandexgpt/latest',
 }
 MAX_QUERIES_PER_RUN = 3
+# Разовые выгрузки упоминаний из geo-analytics: ссылка на них живёт час, файлы — сутки
+MENTION_EXPORTS_PREFIX = 'geo-exports/'
+MENTION_EXPORTS_TTL = 24 * 3600
 POSITIVE = {'лучший', 'рекоменд', 'надёжн', 'качествен', 'удобн', 'выгодн',
             'best', 'recommended', 'great', 'excellent', 'top'}
 NEGATIVE = {'плохой', 'не рекоменд', 'слабый', 'проблем', 'дорог', 'устарел',
@@ -185,6 +190,9 @@ def handler(event, context):
         run_polls(summary)
     if kind in ('pub_check', 'all'):
         run_pub_checks(summary)
+    # Выгрузка в Parquet тяжелее опросов и не входит в 'all' — её дёргают отдельным вызовом
+    if kind == 'export':
+        run_exports(summary)
 
     return resp(200, summary)
 
@@ -219,6 +227,7 @@ def run_polls(summary):
                             'UPDATE geo_tenants SET last_auto_poll_at = NOW() WHERE id = %s',
                             (tenant_id,)
                         )
+                        bump_data_version(cur2, tenant_id)
             except Exception as e:
                 print(f'[cron-poll] tenant {tenant_id}: {e}')
                 log_finish(conn, run_id, 'error', {}, error=str(e)[:500])
@@ -311,6 +320,7 @@ def run_pub_checks(summary):
                             'UPDATE geo_tenants SET last_auto_pub_check_at = NOW() WHERE id = %s',
                             (tenant_id,)
                         )
+                        bump_data_version(cur2, tenant_id)
             except Exception as e:
                 print(f'[cron-pub] tenant {tenant_id}: {e}')
                 log_finish(conn, run_id, 'error', {}, error=str(e)[:500])
@@ -389,6 +399,26 @@ def check_tenant_pubs(conn, tenant_id):
     return {'checked': checked, 'found': found}
 
 
+def run_exports(summary):
+    from parquet_export import export_pending
+    from storage import delete_older_than
+
+    conn = get_db()
+    try:
+        summary['export'] = export_pending(conn)
+        print(f"[cron-export] {summary['export']}")
+    except Exception as e:
+        print(f'[cron-export] {e}')
+        summary['export'] = {'error': str(e)[:300]}
+    finally:
+        conn.close()
+    try:
+        summary['export_cleanup'] = delete_older_than(MENTION_EXPORTS_PREFIX, MENTION_EXPORTS_TTL)
+    except Exception as e:
+        print(f'[cron-export] cleanup: {e}')
+        summary['export_cleanup'] = {'error': str(e)[:300]}
+
+
 def log_start(conn, tenant_id, kind):
     with conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
@@ -0,0 +1,161 @@
+"""Инкрементальная выгрузка истории GEO в Parquet: tenant × набор × сутки (UTC) в отдельный файл S3.
+Аналитика работает с файлами, а не с рабочей БД; что уже выгружено — в geo_export_manifest"""
+
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from storage import upload_fileobj
+
+EXPORT_BATCH_ROWS = 5000
+EXPORT_DAYS_PER_RUN = 31
+EXPORT_DEADLINE = 20
+# Сутки выгружаются только через столько секунд после полуночи UTC: опросы и проверки, начатые до неё,
+# успевают записать строки с polled_at/checked_at прошлого дня — иначе они не попадут в файл никогда
+EXPORT_GRACE_SECONDS = 3600
+EXPORT_PREFIX = 'geo-analytics-export'
+
+_TS = pa.timestamp('us', tz='UTC')
+
+# table, колонка времени, SELECT-выражения и схема Arrow в том же порядке
+DATASETS = {
+    'responses': {
+        'table': 'geo_llm_responses',
+        'ts': 'polled_at',
+        'select': 'id::text, query_id::text, provider, model, raw_text, citations::text, meta::text, polled_at',
+        'schema': pa.schema([
+            ('id', pa.string()), ('query_id', pa.string()), ('provider', pa.string()),
+            ('model', pa.string()), ('raw_text', pa.string()), ('citations', pa.string()),
+            ('meta', pa.string()), ('polled_at', _TS),
+        ]),
+    },
+    'mentions': {
+        'table': 'geo_mentions',
+        'ts': 'created_at',
+        'select': 'id::text, response_id::text, brand_id::text, sentiment, sentiment_score, position, snippet, created_at',
+        'schema': pa.schema([
+            ('id', pa.string()), ('response_id', pa.string()), ('brand_id', pa.string()),
+            ('sentiment', pa.string()), ('sentiment_score', pa.float32()), ('position', pa.int32()),
+            ('snippet', pa.string()), ('created_at', _TS),
+        ]),
+    },
+    'checks': {
+        'table': 'geo_publication_checks_v2',
+        'ts': 'checked_at',
+        'select': 'id::text, publication_id::text, provider, found, snippet, raw_response, checked_at',
+        'schema': pa.schema([
+            ('id', pa.string()), ('publication_id', pa.string()), ('provider', pa.string()),
+            ('found', pa.bool_()), ('snippet', pa.string()), ('raw_response', pa.string()),
+            ('checked_at', _TS),
+        ]),
+    },
+}
+
+
+def _pending_days(conn, tenant_id, dataset, spec, last_day):
+    """Закрытые сутки после последней выгруженной (или с первых данных) по last_day включительно"""
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                'SELECT MAX(day) FROM geo_export_manifest WHERE tenant_id = %s AND dataset = %s',
+                (tenant_id, dataset)
+            )
+            last = cur.fetchone()[0]
+            if last:
+                first = last + timedelta(days=1)
+            else:
+                cur.execute(
+                    f"SELECT MIN({spec['ts']}) FROM {spec['table']} WHERE tenant_id = %s",
+                    (tenant_id,)
+                )
+                oldest = cur.fetchone()[0]
+                if oldest is None:
+                    return []
+                first = oldest.astimezone(timezone.utc).date()
+    days = []
+    while first <= last_day and len(days) < EXPORT_DAYS_PER_RUN:
+        days.append(first)
+        first += timedelta(days=1)
+    return days
+
+
+def _write_day(conn, tenant_id, dataset, spec, day, path):
+    """Пишет сутки в Parquet по пачкам серверного курсора — в памяти не больше EXPORT_BATCH_ROWS строк"""
+    start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    schema = spec['schema']
+    rows = 0
+    writer = None
+    try:
+        with conn:
+            with conn.cursor(name=f'geo_export_{dataset}') as cur:
+                cur.itersize = EXPORT_BATCH_ROWS
+                cur.execute(
+                    f"SELECT {spec['select']} FROM {spec['table']} "
+                    f"WHERE tenant_id = %s AND {spec['ts']} >= %s AND {spec['ts']} < %s "
+                    f"ORDER BY {spec['ts']}, id",
+                    (tenant_id, start, start + timedelta(days=1))
+                )
+                while True:
+                    batch = cur.fetchmany(EXPORT_BATCH_ROWS)
+                    if not batch:
+                        break
+                    columns = [pa.array(col, type=field.type) for col, field in zip(zip(*batch), schema)]
+                    if writer is None:
+                        writer = pq.ParquetWriter(path, schema, compression='zstd')
+                    writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+                    rows += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def export_tenant_day(conn, tenant_id, dataset, day):
+    """Выгружает один (tenant, набор, день) и записывает его в манифест. Возвращает число строк"""
+    spec = DATASETS[dataset]
+    key = None
+    size = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'part-0.parquet')
+        rows = _write_day(conn, tenant_id, dataset, spec, day, path)
+        if rows:
+            size = os.path.getsize(path)
+            key = f'{EXPORT_PREFIX}/{dataset}/tenant_id={tenant_id}/day={day.isoformat()}/part-0.parquet'
+            with open(path, 'rb') as f:
+                upload_fileobj(f, key, 'application/vnd.apache.parquet')
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                'INSERT INTO geo_export_manifest (tenant_id, dataset, day, s3_key, rows, bytes) '
+                'VALUES (%s, %s, %s, %s, %s, %s) '
+                'ON CONFLICT (tenant_id, dataset, day) DO UPDATE SET s3_key = EXCLUDED.s3_key, '
+                'rows = EXCLUDED.rows, bytes = EXCLUDED.bytes, exported_at = NOW()',
+                (tenant_id, dataset, day, key, rows, size)
+            )
+    return rows
+
+
+def export_pending(conn, deadline=EXPORT_DEADLINE):
+    """Догоняет выгрузку по всем tenant'ам в пределах deadline секунд; следующий запуск продолжит с манифеста"""
+    stop_at = time.monotonic() + deadline
+    last_day = (datetime.now(timezone.utc) - timedelta(seconds=EXPORT_GRACE_SECONDS)).date() - timedelta(days=1)
+    stats = {'files': 0, 'days': 0, 'rows': 0, 'complete': True}
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute('SELECT id::text FROM geo_tenants ORDER BY id')
+            tenants = [r[0] for r in cur.fetchall()]
+    for tenant_id in tenants:
+        for dataset, spec in DATASETS.items():
+            for day in _pending_days(conn, tenant_id, dataset, spec, last_day):
+                if time.monotonic() > stop_at:
+                    stats['complete'] = False
+                    return stats
+                rows = export_tenant_day(conn, tenant_id, dataset, day)
+                stats['days'] += 1
+                stats['rows'] += rows
+                stats['files'] += 1 if rows else 0
+    return stats
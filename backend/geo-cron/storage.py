@@ -0,0 +1,119 @@
+"""Общий модуль работы с S3-хранилищем poehali.dev: один клиент на процесс, multipart-загрузка и фоновые загрузки"""
+
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+S3_ENDPOINT = 'https://bucket.poehali.dev'
+S3_BUCKET = 'files'
+
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+UPLOAD_WORKERS = 4
+
+_client = None
+_client_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+_transfer_config = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=MULTIPART_CHUNKSIZE,
+    max_concurrency=UPLOAD_WORKERS,
+    use_threads=True,
+)
+
+
+def get_s3():
+    """Возвращает S3-клиент, созданный один раз на процесс (пул соединений переиспользуется между вызовами)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = boto3.client(
+                    's3',
+                    endpoint_url=S3_ENDPOINT,
+                    aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+                    aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+                    config=Config(
+                        max_pool_connections=UPLOAD_WORKERS * 2,
+                        retries={'max_attempts': 3, 'mode': 'standard'},
+                        tcp_keepalive=True,
+                    ),
+                )
+    return _client
+
+
+def cdn_url(key):
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+
+
+def key_from_cdn_url(url):
+    """Обратное к cdn_url: ключ объекта в бакете"""
+    return url.split('/bucket/', 1)[1] if '/bucket/' in url else url
+
+
+def presigned_url(key, expires_in=3600):
+    """Временная ссылка на скачивание — для файлов, которым не место под постоянным CDN URL"""
+    return get_s3().generate_presigned_url(
+        'get_object', Params={'Bucket': S3_BUCKET, 'Key': key}, ExpiresIn=expires_in
+    )
+
+
+def delete_older_than(prefix, max_age):
+    """Удаляет объекты под prefix старше max_age секунд (пачками по 1000). Возвращает число удалённых"""
+    s3 = get_s3()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+    deleted = 0
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=S3_BUCKET, Prefix=prefix):
+        old = [{'Key': obj['Key']} for obj in page.get('Contents', []) if obj['LastModified'] < cutoff]
+        for pos in range(0, len(old), 1000):
+            s3.delete_objects(Bucket=S3_BUCKET, Delete={'Objects': old[pos:pos + 1000], 'Quiet': True})
+        deleted += len(old)
+    return deleted
+
+
+def download_bytes(key, max_bytes=None):
+    """Читает объект из S3; при max_bytes — только первые max_bytes байт через Range"""
+    kwargs = {'Bucket': S3_BUCKET, 'Key': key}
+    if max_bytes:
+        kwargs['Range'] = f'bytes=0-{max_bytes - 1}'
+    return get_s3().get_object(**kwargs)['Body'].read()
+
+
+def upload_fileobj(fileobj, key, content_type='application/octet-stream'):
+    """Потоковая загрузка файлового объекта. Тела больше MULTIPART_THRESHOLD уходят multipart-частями параллельно"""
+    get_s3().upload_fileobj(
+        fileobj, S3_BUCKET, key,
+        ExtraArgs={'ContentType': content_type},
+        Config=_transfer_config,
+    )
+    return cdn_url(key)
+
+
+def upload_bytes(data, key, content_type='application/octet-stream'):
+    """Загружает bytes в S3 и возвращает CDN URL"""
+    if len(data) < MULTIPART_THRESHOLD:
+        get_s3().put_object(Bucket=S3_BUCKET, Key=key, Body=data, ContentType=content_type)
+        return cdn_url(key)
+    return upload_fileobj(io.BytesIO(data), key, content_type)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='s3-upload')
+    return _executor
+
+
+def upload_bytes_async(data, key, content_type='application/octet-stream'):
+    """Запускает загрузку в фоновом потоке. Возвращает Future, .result() которого — CDN URL"""
+    return _get_executor().submit(upload_bytes, data, key, content_type)
@@ -7,15 +7,15 @@ Returns: {polled: int, responses: int, mentions: int}
 import json
 import os
 import re
-import hmac
-import hashlib
-import base64
 import time
 import urllib.request
 import urllib.error
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from geo_cache import bump_data_version
+from geo_context import get_tenant, resolve_project
+
 
 VSEGPT_BASE = 'https://api.vsegpt.ru/v1/chat/completions'
 YANDEX_GPT_BASE = 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion'
@@ -65,38 +65,6 @@ def resp(status, body):
             'body': json.dumps(body, ensure_ascii=False, default=str)}
 
 
-def b64url_decode(s: str) -> bytes:
-    pad = '=' * (-len(s) % 4)
-    return base64.urlsafe_b64decode(s + pad)
-
-
-def b64url(data: bytes) -> str:
-    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
-
-
-def jwt_decode(token: str, secret: str):
-    try:
-        h, p, s = token.split('.')
-        sig_input = f'{h}.{p}'.encode()
-        expected = hmac.new(secret.encode(), sig_input, hashlib.sha256).digest()
-        if not hmac.compare_digest(b64url(expected), s):
-            return None
-        payload = json.loads(b64url_decode(p))
-        if payload.get('exp', 0) < int(time.time()):
-            return None
-        return payload
-    except Exception:
-        return None
-
-
-def get_tenant(headers: dict):
-    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
-    if not token:
-        return None
-    payload = jwt_decode(token, os.environ.get('GEO_JWT_SECRET', 'dev-secret'))
-    return payload.get('tid') if payload else None
-
-
 def get_db():
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
@@ -365,21 +333,6 @@ def handler(event, context):
 MAX_TOTAL_SECONDS = 25
 
 
-def _resolve_project(cur, tenant_id: str, project_id):
-    if project_id:
-        cur.execute('SELECT id FROM geo_projects WHERE tenant_id = %s AND id = %s',
-                    (tenant_id, project_id))
-        row = cur.fetchone()
-        if row:
-            return str(row['id'])
-    cur.execute(
-        'SELECT id FROM geo_projects WHERE tenant_id = %s ORDER BY is_default DESC, created_at ASC LIMIT 1',
-        (tenant_id,)
-    )
-    row = cur.fetchone()
-    return str(row['id']) if row else None
-
-
 def poll_for_tenant(tenant_id: str, query_id, offset: int = 0, batch_size: int = 5, project_id=None):
     conn = get_db()
     polled, total_resp, total_ment = 0, 0, 0
@@ -397,9 +350,9 @@ def poll_for_tenant(tenant_id: str, query_id, offset: int = 0, batch_size: int =
                 all_queries = cur.fetchall()
                 total_queries = len(all_queries)
                 queries = all_queries
-                pid = str(all_queries[0]['project_id']) if all_queries and all_queries[0].get('project_id') else _resolve_project(cur, tenant_id, project_id)
+                pid = str(all_queries[0]['project_id']) if all_queries and all_queries[0].get('project_id') else resolve_project(cur, tenant_id, project_id, create=False)
             else:
-                pid = _resolve_project(cur, tenant_id, project_id)
+                pid = resolve_project(cur, tenant_id, project_id, create=False)
                 cur.execute(
                     'SELECT COUNT(*) AS c FROM geo_tracked_queries '
                     'WHERE tenant_id = %s AND project_id = %s AND is_active = TRUE',
@@ -496,6 +449,7 @@ def poll_for_tenant(tenant_id: str, query_id, offset: int = 0, batch_size: int =
                                      m['score'], m['position'], m['snippet'])
                                 )
                                 total_ment += 1
+                            bump_data_version(cur, tenant_id)
                 except Exception as db_err:
                     print(f'[poll] db save error {qid}: {db_err}')
                     errors.append({'query_id': qid, 'provider': provider, 'error': f'db: {str(db_err)[:160]}'})
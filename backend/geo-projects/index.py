@@ -6,13 +6,12 @@ Returns: HTTP-ответ со списком проектов или резул
 """
 import json
 import os
-import hmac
-import hashlib
-import base64
-import time
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from geo_cache import bump_data_version
+from geo_context import get_tenant, invalidate_projects
+
 
 def cors_headers():
     return {
@@ -29,38 +28,6 @@ def resp(status, body):
             'body': json.dumps(body, ensure_ascii=False, default=str)}
 
 
-def b64url_decode(s: str) -> bytes:
-    pad = '=' * (-len(s) % 4)
-    return base64.urlsafe_b64decode(s + pad)
-
-
-def b64url(data: bytes) -> str:
-    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
-
-
-def jwt_decode(token: str, secret: str):
-    try:
-        h, p, s = token.split('.')
-        sig_input = f'{h}.{p}'.encode()
-        expected = hmac.new(secret.encode(), sig_input, hashlib.sha256).digest()
-        if not hmac.compare_digest(b64url(expected), s):
-            return None
-        payload = json.loads(b64url_decode(p))
-        if payload.get('exp', 0) < int(time.time()):
-            return None
-        return payload
-    except Exception:
-        return None
-
-
-def get_tenant(headers: dict):
-    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
-    if not token:
-        return None
-    payload = jwt_decode(token, os.environ.get('GEO_JWT_SECRET', 'dev-secret'))
-    return payload.get('tid') if payload else None
-
-
 def get_db():
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
@@ -153,6 +120,7 @@ def create_project(tenant_id: str, body: dict):
                     (tenant_id, name, description)
                 )
                 row = cur.fetchone()
+        invalidate_projects(tenant_id)
         return resp(200, {'project': {
             'id': str(row['id']), 'name': name, 'description': description,
             'is_default': False, 'own_brand': None, 'brands_count': 0, 'queries_count': 0,
@@ -236,6 +204,8 @@ def delete_project(tenant_id: str, pid: str):
                             '(SELECT id FROM geo_brands WHERE project_id = %s)', (pid,))
                 cur.execute('DELETE FROM geo_brands WHERE project_id = %s', (pid,))
                 cur.execute('DELETE FROM geo_projects WHERE tenant_id = %s AND id = %s', (tenant_id, pid))
+                bump_data_version(cur, tenant_id)
+        invalidate_projects(tenant_id)
         return resp(200, {'ok': True})
     finally:
         conn.close()
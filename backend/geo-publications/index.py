@@ -1,19 +1,24 @@
 """
 Business: CRUD публикаций (URL опубликованных материалов) и проверка попадания в LLM-ответы.
-Args: event с httpMethod (GET/POST/PUT/DELETE), action=check, headers (X-Auth-Token), body, queryStringParameters
+Args: event с httpMethod (GET/POST/PUT/DELETE), action=check|check_batch, headers (X-Auth-Token), body, queryStringParameters
 Returns: HTTP-ответ со списком публикаций, операцией или результатом проверки индексации
 """
 import json
 import os
-import hmac
+import re
 import hashlib
-import base64
+import threading
 import time
 import urllib.parse
 import urllib.request
 import urllib.error
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+
+from geo_cache import cached_response, mark_changed
+from geo_context import get_tenant, resolve_project
 
 
 VSEGPT_BASE = 'https://api.vsegpt.ru/v1/chat/completions'
@@ -26,6 +31,23 @@ SEARCH_LLM_PROVIDERS = {
     'gpt4o_search': 'openai/gpt-4o-search-preview',
 }
 
+# Все проверки публикации идут параллельно; ответ возвращается не позже CHECK_DEADLINE секунд
+CHECK_DEADLINE = 45
+# Страница без ETag/Last-Modified перепроверяется HEAD-запросом, пока полное скачивание не старше этого срока
+URL_CACHE_HEAD_TTL = 6 * 3600
+
+# Пакетная проверка выдачи: одна выдача на поисковый запрос для всех публикаций тенанта
+SERP_URLS = {
+    'yandex_search': 'https://yandex.ru/search/?text={q}&lr=213',
+    'duckduckgo': 'https://html.duckduckgo.com/html/?q={q}',
+}
+MAX_BATCH_QUERIES = 40
+SERP_WORKERS = 2  # на поисковик — меньше параллельных запросов, реже капча
+# Ограничение на поисковик, а не на общий пул: иначе все потоки пула могут уйти в один поисковик
+_serp_slots = {engine: threading.BoundedSemaphore(SERP_WORKERS) for engine in SERP_URLS}
+# Конец URL в выдаче: кавычка, ?, #, &, пробел, тег или конец текста (после необязательного «/»)
+_URL_END = r'/?(?=["\'?#&<>\s]|$)'
+
 USER_AGENT = (
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
     '(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'
@@ -47,38 +69,6 @@ def resp(status, body):
             'body': json.dumps(body, ensure_ascii=False, default=str)}
 
 
-def b64url_decode(s: str) -> bytes:
-    pad = '=' * (-len(s) % 4)
-    return base64.urlsafe_b64decode(s + pad)
-
-
-def b64url(data: bytes) -> str:
-    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
-
-
-def jwt_decode(token: str, secret: str):
-    try:
-        h, p, s = token.split('.')
-        sig_input = f'{h}.{p}'.encode()
-        expected = hmac.new(secret.encode(), sig_input, hashlib.sha256).digest()
-        if not hmac.compare_digest(b64url(expected), s):
-            return None
-        payload = json.loads(b64url_decode(p))
-        if payload.get('exp', 0) < int(time.time()):
-            return None
-        return payload
-    except Exception:
-        return None
-
-
-def get_tenant(headers: dict):
-    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
-    if not token:
-        return None
-    payload = jwt_decode(token, os.environ.get('GEO_JWT_SECRET', 'dev-secret'))
-    return payload.get('tid') if payload else None
-
-
 def get_db():
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
@@ -176,84 +166,67 @@ def handler(event, context):
     if method == 'GET':
         if qs.get('id') and action == 'checks':
             return list_checks(tenant_id, qs['id'])
-        return list_publications(tenant_id, project_id)
+        return cached_response(headers, tenant_id, ('publications', 'list', project_id),
+                               lambda conn: list_publications(conn, tenant_id, project_id), cors_headers())
+
     if method == 'POST':
         if action == 'check':
-            return check_publication(tenant_id, qs.get('id', ''))
-        return create_publication(tenant_id, body, project_id)
-    if method == 'PUT':
-        return update_publication(tenant_id, qs.get('id', ''), body)
-    if method == 'DELETE':
-        return delete_publication(tenant_id, qs.get('id', ''))
-    return resp(405, {'error': 'method_not_allowed'})
-
-
-def resolve_project(cur, tenant_id: str, project_id):
-    """Возвращает валидный project_id (переданный или дефолтный), гарантирует наличие проекта."""
-    if project_id:
-        cur.execute('SELECT id FROM geo_projects WHERE tenant_id = %s AND id = %s',
-                    (tenant_id, project_id))
-        row = cur.fetchone()
-        if row:
-            return str(row['id'])
-    cur.execute(
-        'SELECT id FROM geo_projects WHERE tenant_id = %s ORDER BY is_default DESC, created_at ASC LIMIT 1',
-        (tenant_id,)
-    )
-    row = cur.fetchone()
-    if row:
-        return str(row['id'])
-    cur.execute(
-        'INSERT INTO geo_projects (tenant_id, name, is_default) VALUES (%s, %s, TRUE) RETURNING id',
-        (tenant_id, 'Основной проект')
-    )
-    return str(cur.fetchone()['id'])
-
-
-def list_publications(tenant_id: str, project_id=None):
-    conn = get_db()
-    try:
-        with conn:
-          with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            proj_id = resolve_project(cur, tenant_id, project_id)
-            cur.execute(
-                """
-                SELECT p.id, p.title, p.url, p.extra_urls, p.platform, p.status, p.published_at,
-                       p.last_check_at, p.last_check_found, p.notes,
-                       p.draft_id, p.query_id, q.text AS query_text,
-                       p.created_at, p.updated_at
-                FROM geo_publications_v2 p
-                LEFT JOIN geo_tracked_queries q ON q.id = p.query_id AND q.tenant_id = p.tenant_id
-                WHERE p.tenant_id = %s AND p.project_id = %s
-                ORDER BY p.created_at DESC
-                """,
-                (tenant_id, proj_id)
-            )
-            rows = cur.fetchall()
-
-            cur.execute(
-                """
-                SELECT DISTINCT ON (publication_id, provider)
-                       publication_id, provider, found, checked_at
-                FROM geo_publication_checks_v2
-                WHERE tenant_id = %s
-                ORDER BY publication_id, provider, checked_at DESC
-                """,
-                (tenant_id,)
-            )
-            latest = cur.fetchall()
-        per_pub = {}
-        for c in latest:
-            pid = str(c['publication_id'])
-            per_pub.setdefault(pid, {})[c['provider']] = {
-                'found': bool(c['found']),
-                'checked_at': c['checked_at'].isoformat() if c['checked_at'] else None,
-            }
-        return resp(200, {'publications': [
-            {**serialize(r), 'providers': per_pub.get(str(r['id']), {})} for r in rows
-        ]})
-    finally:
-        conn.close()
+            result = check_publication(tenant_id, qs.get('id', ''))
+        elif action == 'check_batch':
+            result = check_publications_batch(tenant_id, project_id)
+        else:
+            result = create_publication(tenant_id, body, project_id)
+    elif method == 'PUT':
+        result = update_publication(tenant_id, qs.get('id', ''), body)
+    elif method == 'DELETE':
+        result = delete_publication(tenant_id, qs.get('id', ''))
+    else:
+        return resp(405, {'error': 'method_not_allowed'})
+    if result['statusCode'] == 200:
+        mark_changed(tenant_id)
+    return result
+
+
+def list_publications(conn, tenant_id: str, project_id=None):
+    with conn:
+      with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        proj_id = resolve_project(cur, tenant_id, project_id)
+        cur.execute(
+            """
+            SELECT p.id, p.title, p.url, p.extra_urls, p.platform, p.status, p.published_at,
+                   p.last_check_at, p.last_check_found, p.notes,
+                   p.draft_id, p.query_id, q.text AS query_text,
+                   p.created_at, p.updated_at
+            FROM geo_publications_v2 p
+            LEFT JOIN geo_tracked_queries q ON q.id = p.query_id AND q.tenant_id = p.tenant_id
+            WHERE p.tenant_id = %s AND p.project_id = %s
+            ORDER BY p.created_at DESC
+            """,
+            (tenant_id, proj_id)
+        )
+        rows = cur.fetchall()
+
+        cur.execute(
+            """
+            SELECT DISTINCT ON (publication_id, provider)
+                   publication_id, provider, found, checked_at
+            FROM geo_publication_checks_v2
+            WHERE tenant_id = %s
+            ORDER BY publication_id, provider, checked_at DESC
+            """,
+            (tenant_id,)
+        )
+        latest = cur.fetchall()
+    per_pub = {}
+    for c in latest:
+        pid = str(c['publication_id'])
+        per_pub.setdefault(pid, {})[c['provider']] = {
+            'found': bool(c['found']),
+            'checked_at': c['checked_at'].isoformat() if c['checked_at'] else None,
+        }
+    return resp(200, {'publications': [
+        {**serialize(r), 'providers': per_pub.get(str(r['id']), {})} for r in rows
+    ]})
 
 
 def serialize(r):
@@ -454,46 +427,172 @@ def http_fetch(url: str, timeout: int = 10) -> tuple[int, str]:
         return 0, ''
 
 
-def check_url_alive(urls: list[str]) -> dict:
+def load_url_cache(conn, urls: list[str]) -> dict:
+    if not urls:
+        return {}
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            'SELECT url, status, ok, etag, last_modified, content_hash, size, fetched_at '
+            'FROM geo_url_probe_cache WHERE url = ANY(%s)',
+            (urls,)
+        )
+        return {r['url']: dict(r) for r in cur.fetchall()}
+
+
+def save_url_cache(cur, entries: list[dict]):
+    if not entries:
+        return
+    execute_values(
+        cur,
+        'INSERT INTO geo_url_probe_cache (url, status, ok, etag, last_modified, content_hash, size, fetched_at) VALUES %s '
+        'ON CONFLICT (url) DO UPDATE SET status = EXCLUDED.status, ok = EXCLUDED.ok, etag = EXCLUDED.etag, '
+        'last_modified = EXCLUDED.last_modified, content_hash = EXCLUDED.content_hash, size = EXCLUDED.size, '
+        'fetched_at = COALESCE(EXCLUDED.fetched_at, geo_url_probe_cache.fetched_at), checked_at = NOW()',
+        [(e['url'], e['status'], e['ok'], e.get('etag'), e.get('last_modified'), e.get('content_hash'),
+          e.get('size'), e.get('fetched_at')) for e in entries]
+    )
+
+
+def content_length(headers) -> int | None:
+    """Content-Length ответа или None, если заголовка нет или он не число"""
+    value = (headers.get('Content-Length') or '').strip()
+    return int(value) if value.isdigit() else None
+
+
+def probe_url(url: str, cached: dict | None = None, timeout: int = 8) -> dict:
+    """Проверка живости одного URL с учётом кэша. Живая страница с ETag/Last-Modified перепроверяется
+    условным GET (ответ 304 без тела), без валидаторов — HEAD со сверкой Content-Length, если сервер
+    сообщил размер при прошлом GET. Размер неизвестен — каждый раз полный GET.
+    Тело (до 200 КБ) скачивается только если страница изменилась. Никогда не падает."""
+    headers = {'User-Agent': USER_AGENT, 'Accept-Language': 'ru,en;q=0.9'}
+    method = 'GET'
+    if cached and cached.get('ok'):
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        fetched_at = cached.get('fetched_at')
+        if ('If-None-Match' not in headers and 'If-Modified-Since' not in headers and fetched_at
+                and cached.get('size') is not None
+                and (datetime.now(timezone.utc) - fetched_at).total_seconds() < URL_CACHE_HEAD_TTL):
+            method = 'HEAD'
+    unchanged = dict(cached or {}, url=url, fetched_at=None)
+    try:
+        req = urllib.request.Request(url, headers=headers, method=method)
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            code = r.getcode() or 200
+            length = content_length(r.headers)
+            if method == 'HEAD':
+                if 200 <= code < 400 and length is not None and length == cached['size']:
+                    return dict(unchanged, status=code, transfer='head')
+                # страница изменилась — нужен полный GET
+                return probe_url(url, dict(cached, ok=False), timeout)
+            data = r.read(200_000)  # первые 200 КБ
+            return {
+                'url': url, 'status': code, 'ok': (200 <= code < 400) and len(data) > 500,
+                # валидаторы и размер — только те, что прислал сервер: длина усечённого тела с ними несравнима
+                'etag': r.headers.get('ETag') or None, 'last_modified': r.headers.get('Last-Modified') or None,
+                'content_hash': hashlib.sha256(data).hexdigest(),
+                'size': length,
+                'fetched_at': datetime.now(timezone.utc), 'transfer': 'full',
+            }
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached:
+            return dict(unchanged, status=cached.get('status') or 200, transfer='not_modified')
+        return {'url': url, 'status': e.code, 'ok': False, 'fetched_at': datetime.now(timezone.utc), 'transfer': 'full'}
+    except Exception:
+        return {'url': url, 'status': 0, 'ok': False, 'fetched_at': datetime.now(timezone.utc), 'transfer': 'full'}
+
+
+def check_url_alive(urls: list[str], cache: dict | None = None) -> dict:
     """Проверить, что хотя бы один URL отдаёт 200 и содержит осмысленный контент."""
-    alive_urls = []
-    checked = []
-    for u in urls[:5]:
-        code, html = http_fetch(u, timeout=8)
-        ok = (200 <= code < 400) and len(html) > 500
-        checked.append({'url': u, 'status': code, 'ok': ok, 'size': len(html)})
-        if ok:
-            alive_urls.append(u)
+    cache = cache or {}
+    urls = urls[:5]
+    with ThreadPoolExecutor(max_workers=max(len(urls), 1)) as pool:
+        entries = list(pool.map(lambda u: probe_url(u, cache.get(u)), urls))
+    checked = [{'url': e['url'], 'status': e['status'], 'ok': e['ok'], 'size': e.get('size') or 0,
+                'transfer': e['transfer']} for e in entries]
+    alive_urls = [e['url'] for e in entries if e['ok']]
     return {
         'found': bool(alive_urls),
         'urls': alive_urls,
         'details': checked,
+        'entries': entries,
     }
 
 
-def yandex_search(query: str, target_domains: list[str], timeout: int = 8) -> dict:
-    """
-    Проверить через Яндекс. Используется публичный HTML-поиск (без API-ключа).
-    Возвращает found + найденные ссылки на наш домен.
-    """
+def fetch_serp(engine: str, query: str, timeout: int = 8) -> tuple[str, str]:
+    """Скачать выдачу поисковика. Возвращает (html в нижнем регистре, ошибка). Никогда не падает."""
     try:
-        q = urllib.parse.quote_plus(query)
-        url = f'https://yandex.ru/search/?text={q}&lr=213'
-        code, html = http_fetch(url, timeout=timeout)
+        url = SERP_URLS[engine].format(q=urllib.parse.quote_plus(query))
+        with _serp_slots[engine]:
+            code, html = http_fetch(url, timeout=timeout)
         if code != 200 or not html:
-            return {'found': False, 'error': f'HTTP {code}', 'matches': []}
+            return '', f'HTTP {code}'
         html_lc = html.lower()
         # Проверяем антиспам капчу Яндекса
-        if 'showcaptcha' in html_lc or 'are you a robot' in html_lc:
-            return {'found': False, 'error': 'captcha', 'matches': []}
-        matches = [d for d in target_domains if d and d in html_lc]
-        return {
-            'found': bool(matches),
-            'matches': matches,
-            'snippet': f'Найдено упоминаний домена: {", ".join(matches)}' if matches else '',
-        }
+        if engine == 'yandex_search' and ('showcaptcha' in html_lc or 'are you a robot' in html_lc):
+            return '', 'captcha'
+        return html_lc, ''
     except Exception as e:
-        return {'found': False, 'error': str(e)[:200], 'matches': []}
+        return '', str(e)[:200]
+
+
+def _needle_pattern(needle: str) -> str:
+    if '/' in needle:
+        # URL заканчивается на разделителе: site.com/a не совпадает с site.com/ab
+        return re.escape(needle) + _URL_END
+    # домен — целиком: не mysite.com и не site.com.evil.ru для site.com
+    return r'(?<![\w-])' + re.escape(needle) + r'(?![\w-]|\.\w)'
+
+
+def compile_matcher(needles):
+    """Один регэксп на все домены и URL: выдача просматривается за один проход"""
+    needles = sorted({n.lower() for n in needles if n}, key=len, reverse=True)
+    if not needles:
+        return None
+    return re.compile('|'.join(_needle_pattern(n) for n in needles)), set(needles)
+
+
+def find_matches(matcher, html_lc: str) -> set:
+    """Найденные в тексте домены/URL. Каждое совпадение сверяется с иглами на точное равенство:
+    site.com не засчитывается по mysite.com, а site.com/a — по site.com/ab.
+    Совпавший URL засчитывает и свой домен"""
+    if not matcher or not html_lc:
+        return set()
+    pattern, needles = matcher
+    found = set()
+    for hit in set(pattern.findall(html_lc)):
+        hit = hit.rstrip('/')
+        if hit not in needles:
+            continue
+        found.add(hit)
+        if '/' in hit:
+            domain = extract_domain(hit)
+            if domain in needles:
+                found.add(domain)
+    return found
+
+
+def _serp_domains_result(engine: str, query: str, target_domains: list[str], timeout: int) -> dict:
+    html_lc, err = fetch_serp(engine, query, timeout)
+    if err:
+        return {'found': False, 'error': err, 'matches': []}
+    hits = find_matches(compile_matcher(target_domains), html_lc)
+    matches = [d for d in target_domains if d and d.lower() in hits]
+    return {
+        'found': bool(matches),
+        'matches': matches,
+        'snippet': f'Найдено упоминаний домена: {", ".join(matches)}' if matches else '',
+    }
+
+
+def yandex_search(query: str, target_domains: list[str], timeout: int = 8) -> dict:
+    """
+    Проверить через Яндекс. Используется публичный HTML-поиск (без API-ключа).
+    Возвращает found + найденные ссылки на наш домен.
+    """
+    return _serp_domains_result('yandex_search', query, target_domains, timeout)
 
 
 def duckduckgo_search(query: str, target_domains: list[str], timeout: int = 8) -> dict:
@@ -501,21 +600,116 @@ def duckduckgo_search(query: str, target_domains: list[str], timeout: int = 8) -
     Проверить через DuckDuckGo HTML-поиск (без API-ключа, без капчи).
     Google почти всегда требует API-ключ или возвращает капчу — DDG надёжнее как fallback.
     """
+    return _serp_domains_result('duckduckgo', query, target_domains, timeout)
+
+
+def check_publications_batch(tenant_id: str, project_id=None):
+    """
+    Пакетная проверка выдачи Яндекса и DuckDuckGo для всех живых публикаций проекта.
+    Публикации группируются по поисковому запросу (отслеживаемый запрос или заголовок): каждая выдача
+    скачивается один раз и сверяется сразу со всеми доменами и URL тенанта.
+      - публикация своей группы найдена, если в выдаче есть её домен или URL;
+      - публикация из другой группы засчитывается, только если в выдаче её точный URL.
+    """
+    conn = get_db()
     try:
-        q = urllib.parse.quote_plus(query)
-        url = f'https://html.duckduckgo.com/html/?q={q}'
-        code, html = http_fetch(url, timeout=timeout)
-        if code != 200 or not html:
-            return {'found': False, 'error': f'HTTP {code}', 'matches': []}
-        html_lc = html.lower()
-        matches = [d for d in target_domains if d and d in html_lc]
-        return {
-            'found': bool(matches),
-            'matches': matches,
-            'snippet': f'Найдено упоминаний домена: {", ".join(matches)}' if matches else '',
-        }
-    except Exception as e:
-        return {'found': False, 'error': str(e)[:200], 'matches': []}
+        with conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                proj_id = resolve_project(cur, tenant_id, project_id)
+                cur.execute(
+                    """
+                    SELECT p.id, p.url, p.extra_urls, p.title, q.text AS query_text
+                    FROM geo_publications_v2 p
+                    LEFT JOIN geo_tracked_queries q ON q.id = p.query_id AND q.tenant_id = p.tenant_id
+                    WHERE p.tenant_id = %s AND p.project_id = %s AND p.status = 'live'
+                    """,
+                    (tenant_id, proj_id)
+                )
+                rows = cur.fetchall()
+
+        pubs = []
+        groups = {}
+        for row in rows:
+            extra = row.get('extra_urls') or []
+            if isinstance(extra, str):
+                try:
+                    extra = json.loads(extra)
+                except Exception:
+                    extra = []
+            urls = [u for u in [row['url']] + list(extra) if u]
+            pub = {
+                'id': str(row['id']),
+                'urls': [u.lower().rstrip('/') for u in urls],
+                'domains': list({d for d in (extract_domain(u) for u in urls) if d}),
+            }
+            pubs.append(pub)
+            query = ' '.join((row['query_text'] or row['title'] or '').split())
+            if query:
+                groups.setdefault(query.lower(), (query, []))[1].append(pub['id'])
+
+        matcher = compile_matcher([n for p in pubs for n in p['urls'] + p['domains']])
+        queries = list(groups.values())[:MAX_BATCH_QUERIES]
+        tasks = [(engine, query) for query, _ in queries for engine in SERP_URLS]
+        with ThreadPoolExecutor(max_workers=SERP_WORKERS * len(SERP_URLS)) as pool:
+            serps = list(pool.map(lambda t: fetch_serp(*t), tasks))
+
+        # (pub_id, engine) -> {'found', 'matches', 'queries', 'errors', 'own'}
+        outcome = {}
+        group_of = {pid: query for query, ids in queries for pid in ids}
+        for (engine, query), (html_lc, err) in zip(tasks, serps):
+            hits = find_matches(matcher, html_lc)
+            for pub in pubs:
+                own = group_of.get(pub['id']) == query
+                if not own and not err and not any(u in hits for u in pub['urls']):
+                    continue
+                o = outcome.setdefault((pub['id'], engine), {'found': False, 'matches': [], 'queries': [], 'errors': [], 'own': False})
+                o['own'] = o['own'] or own
+                if err:
+                    if own:
+                        o['errors'].append(err)
+                    continue
+                matched = [n for n in (pub['urls'] if not own else pub['urls'] + pub['domains']) if n in hits]
+                if matched:
+                    o['found'] = True
+                    o['matches'].extend(m for m in matched if m not in o['matches'])
+                    o['queries'].append(query)
+
+        check_rows = []
+        results = {}
+        label = {'yandex_search': 'Яндекс', 'duckduckgo': 'DuckDuckGo'}
+        for (pid, engine), o in outcome.items():
+            if o['found']:
+                snippet = f'Найдено по запросу «{o["queries"][0]}»: {", ".join(o["matches"][:5])}'
+            elif o['errors']:
+                snippet = f'{label[engine]}: {o["errors"][0]} (попробуйте позже)'
+            elif o['own']:
+                snippet = f'Не найдено в выдаче {label[engine]} по запросу «{group_of[pid]}»'
+            else:
+                continue
+            results.setdefault(pid, {})[engine] = {'found': o['found'], 'snippet': snippet, 'matches': o['matches'][:5]}
+            check_rows.append((tenant_id, pid, engine, o['found'], snippet[:1024],
+                               json.dumps({k: o[k] for k in ('matches', 'queries', 'errors')}, ensure_ascii=False)[:5000]))
+
+        if check_rows:
+            with conn:
+                with conn.cursor() as cur:
+                    execute_values(
+                        cur,
+                        'INSERT INTO geo_publication_checks_v2 '
+                        '(tenant_id, publication_id, provider, found, snippet, raw_response) VALUES %s',
+                        check_rows
+                    )
+
+        return resp(200, {
+            'publications': len(pubs),
+            'queries': len(queries),
+            'skipped_queries': len(groups) - len(queries),
+            'requests': len(tasks),
+            'found': sum(1 for r in results.values() if any(v['found'] for v in r.values())),
+            'results': results,
+        })
+    finally:
+        conn.close()
 
 
 def call_search_llm(provider_key: str, query: str, timeout: int = 40) -> dict:
@@ -565,20 +759,197 @@ def call_search_llm(provider_key: str, query: str, timeout: int = 40) -> dict:
 
 def find_urls_in_text(text: str) -> list[str]:
     """Извлечь все URL из произвольного текста."""
-    import re
     return re.findall(r'https?://[^\s\)"\'>\]]+', text or '')
 
 
+def probe_url_alive(all_urls: list[str], url_cache: dict) -> dict:
+    """1) Проверка живости URL — главное доказательство, что публикация в открытом интернете"""
+    alive = check_url_alive(all_urls, url_cache)
+    snippet = (
+        f'Страница отвечает кодом 200 и содержит контент'
+        if alive['found']
+        else 'Ни один из указанных URL не отвечает (страница удалена или закрыта от ботов)'
+    )
+    return {
+        'provider': 'url_alive',
+        'found': alive['found'],
+        'snippet': snippet,
+        'details': alive['details'],
+        '_raw': json.dumps(alive['details'], ensure_ascii=False),
+        '_url_cache': alive['entries'],
+    }
+
+
+def probe_yandex_search(search_query: str, domains: list[str]) -> dict:
+    """2) Яндекс — публичный HTML-поиск"""
+    ya = yandex_search(search_query, domains)
+    snippet = ya.get('snippet') or (
+        'Не найдено в результатах Яндекса. '
+        'Возможно, ещё не проиндексировано (нужно 1–4 недели после публикации).'
+    )
+    if ya.get('error'):
+        snippet = f'Яндекс: {ya["error"]} (попробуйте позже)'
+    return {
+        'provider': 'yandex_search',
+        'found': ya['found'],
+        'snippet': snippet,
+        'matches': ya.get('matches', []),
+        '_raw': json.dumps(ya, ensure_ascii=False),
+    }
+
+
+def probe_duckduckgo(search_query: str, domains: list[str]) -> dict:
+    """3) DuckDuckGo (≈ Bing/Google)"""
+    ddg = duckduckgo_search(search_query, domains)
+    snippet = ddg.get('snippet') or 'Не найдено в DuckDuckGo (Bing/Google).'
+    if ddg.get('error'):
+        snippet = f'DuckDuckGo: {ddg["error"]} (попробуйте позже)'
+    return {
+        'provider': 'duckduckgo',
+        'found': ddg['found'],
+        'snippet': snippet,
+        'matches': ddg.get('matches', []),
+        '_raw': json.dumps(ddg, ensure_ascii=False),
+    }
+
+
+def probe_yandex_gpt(query: str, all_urls: list[str], domains: list[str]) -> dict:
+    """4) YandexGPT — отдельная нейросеть (без веб-поиска, но проверим знает ли она)"""
+    try:
+        yag = call_yandex_gpt(query)
+    except Exception as e:
+        msg = str(e)[:200]
+        print(f'[pub-check] yandex_gpt: {msg}')
+        return {'provider': 'yandex_gpt', 'found': False, 'error': msg, '_snippet': msg, '_raw': msg}
+    text_lc = (yag.get('text') or '').lower()
+    cited_urls_y = find_urls_in_text(yag.get('text') or '')
+    matched_yag = ''
+    for u in all_urls:
+        if u.lower().rstrip('/') in text_lc:
+            matched_yag = u
+            break
+    matched_dom_y = ''
+    if not matched_yag:
+        for dom in domains:
+            if dom in text_lc:
+                matched_dom_y = dom
+                break
+    found_y = bool(matched_yag or matched_dom_y)
+    if matched_yag:
+        snip_y = f'YandexGPT процитировал ваш URL: {matched_yag}'
+    elif matched_dom_y:
+        snip_y = f'YandexGPT упомянул ваш домен {matched_dom_y}'
+    else:
+        snip_y = 'YandexGPT не упомянул вашу публикацию в ответе по теме'
+    return {
+        'provider': 'yandex_gpt',
+        'found': found_y,
+        'snippet': snip_y,
+        'citations': cited_urls_y[:5],
+        '_raw': yag.get('text') or '',
+    }
+
+
+def probe_search_llm(provider: str, query: str, all_urls: list[str], domains: list[str]) -> dict:
+    """5) Search-enabled LLM (Perplexity Sonar, GPT-4o Search) — нейровыдача"""
+    try:
+        r = call_search_llm(provider, query)
+    except Exception as e:
+        msg = str(e)[:200]
+        print(f'[pub-check] {provider}: {msg}')
+        low = msg.lower()
+        user_msg = msg
+        if any(w in low for w in ('insufficient', 'balance', 'payment', '402', 'недостаточно')):
+            user_msg = 'У провайдера моделей нет средств — пополните vsegpt.ru'
+        elif '404' in low or 'not found' in low or 'model' in low:
+            user_msg = f'Search-модель «{provider}» недоступна у провайдера'
+        return {'provider': provider, 'found': False, 'error': user_msg, '_snippet': user_msg, '_raw': msg}
+
+    text_lc = (r['text'] or '').lower()
+    citations = r.get('citations') or []
+    # Собираем URL'ы и из цитат, и из текста ответа
+    cited_urls = [str(c) for c in citations] + find_urls_in_text(r['text'] or '')
+    cited_lc = [u.lower() for u in cited_urls]
+
+    matched_url = ''
+    matched_domain = ''
+    for u in all_urls:
+        u_lc = u.lower().rstrip('/')
+        for c in cited_lc:
+            if u_lc in c or c.rstrip('/') == u_lc:
+                matched_url = u
+                break
+        if matched_url:
+            break
+    if not matched_url:
+        for dom in domains:
+            if any(dom in c for c in cited_lc) or dom in text_lc:
+                matched_domain = dom
+                break
+
+    found = bool(matched_url or matched_domain)
+
+    if matched_url:
+        snippet = f'Нейросеть процитировала именно вашу ссылку: {matched_url}'
+    elif matched_domain:
+        snippet = f'Нейросеть сослалась на ваш домен {matched_domain} (не точный URL)'
+    else:
+        snippet = (
+            'Нейросеть нашла источники по теме, но вашей публикации среди них нет. '
+            f'Цитаты, которые она привела: {", ".join(cited_urls[:3]) or "—"}'
+        )
+    return {
+        'provider': provider,
+        'found': found,
+        'snippet': snippet[:500],
+        'citations': cited_urls[:5],
+        '_snippet': snippet,
+        '_raw': r['text'],
+    }
+
+
+def run_probes(probes: list, deadline: float = CHECK_DEADLINE) -> list[dict]:
+    """Запускает проверки параллельно и собирает результаты в порядке готовности.
+    Проверка, не уложившаяся в общий дедлайн, попадает в результат с ошибкой timeout."""
+    started = time.time()
+    pool = ThreadPoolExecutor(max_workers=max(len(probes), 1))
+    futures = {pool.submit(fn, *args): provider for provider, fn, args in probes}
+    results = []
+    collected = set()
+    try:
+        for fut in as_completed(futures, timeout=deadline):
+            collected.add(fut)
+            provider = futures[fut]
+            try:
+                r = fut.result()
+            except Exception as e:
+                print(f'[pub-check] {provider}: {e}')
+                r = {'provider': provider, 'found': False, 'error': str(e)[:200]}
+            r['elapsed_ms'] = int((time.time() - started) * 1000)
+            results.append(r)
+    except FuturesTimeout:
+        for fut, provider in futures.items():
+            if fut not in collected:
+                msg = f'Не уложились в {deadline} с — попробуйте позже'
+                results.append({'provider': provider, 'found': False, 'error': msg,
+                                '_snippet': msg, '_raw': 'timeout', 'elapsed_ms': int(deadline * 1000)})
+    finally:
+        # зависшие запросы дорабатывают в фоне, ответ их не ждёт
+        pool.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
 def check_publication(tenant_id: str, pub_id: str):
     """
     Полная проверка попадания публикации в нейровыдачу.
 
-    Реальные проверки:
+    Реальные проверки (выполняются параллельно, общий дедлайн CHECK_DEADLINE):
       1) url_alive — публикация жива (отдаёт 200, есть контент)
       2) yandex_search — индексирована Яндексом по теме
       3) duckduckgo — индексирована DDG/Bing
-      4) perplexity_sonar — search-enabled LLM с реальным доступом в интернет
-      5) gpt4o_search — search-preview модель
+      4) yandex_gpt — знает ли о публикации YandexGPT
+      5) perplexity_sonar, gpt4o_search — search-enabled LLM с реальным доступом в интернет
+    Результаты идут в ответе в порядке готовности и пишутся в историю одной вставкой.
     """
     if not pub_id:
         return resp(400, {'error': 'id_required'})
@@ -613,193 +984,45 @@ def check_publication(tenant_id: str, pub_id: str):
         # Если есть конкретная query — комбинируем
         search_query = f'{title} {domains[0]}' if title and domains else (title or query_text)
 
-        results = []
-        any_found = False
-
-        def _save(provider: str, found: bool, snippet: str, raw: str):
-            try:
-                with conn:
-                    with conn.cursor() as cur:
-                        cur.execute(
-                            'INSERT INTO geo_publication_checks_v2 '
-                            '(tenant_id, publication_id, provider, found, snippet, raw_response) '
-                            'VALUES (%s, %s, %s, %s, %s, %s)',
-                            (tenant_id, pub_id, provider, found, snippet[:1024], raw[:5000])
-                        )
-            except Exception as save_err:
-                print(f'[pub-check] save {provider}: {save_err}')
-
-        # 1) Проверка живости URL — главное доказательство, что публикация в открытом интернете
-        try:
-            alive = check_url_alive(all_urls)
-            snippet = (
-                f'Страница отвечает кодом 200 и содержит контент'
-                if alive['found']
-                else 'Ни один из указанных URL не отвечает (страница удалена или закрыта от ботов)'
-            )
-            results.append({
-                'provider': 'url_alive',
-                'found': alive['found'],
-                'snippet': snippet,
-                'details': alive['details'],
-            })
-            _save('url_alive', alive['found'], snippet, json.dumps(alive['details'], ensure_ascii=False))
-            if alive['found']:
-                any_found = True
-        except Exception as e:
-            print(f'[pub-check] url_alive: {e}')
-            results.append({'provider': 'url_alive', 'found': False, 'error': str(e)[:200]})
-
-        # 2) Яндекс — публичный HTML-поиск
-        if search_query and domains:
-            ya = yandex_search(search_query, domains)
-            snippet = ya.get('snippet') or (
-                'Не найдено в результатах Яндекса. '
-                'Возможно, ещё не проиндексировано (нужно 1–4 недели после публикации).'
-            )
-            if ya.get('error'):
-                snippet = f'Яндекс: {ya["error"]} (попробуйте позже)'
-            results.append({
-                'provider': 'yandex_search',
-                'found': ya['found'],
-                'snippet': snippet,
-                'matches': ya.get('matches', []),
-            })
-            _save('yandex_search', ya['found'], snippet, json.dumps(ya, ensure_ascii=False))
-            if ya['found']:
-                any_found = True
-
-        # 3) DuckDuckGo (≈ Bing/Google)
+        probes = [('url_alive', probe_url_alive, (all_urls, load_url_cache(conn, all_urls[:5])))]
         if search_query and domains:
-            ddg = duckduckgo_search(search_query, domains)
-            snippet = ddg.get('snippet') or 'Не найдено в DuckDuckGo (Bing/Google).'
-            if ddg.get('error'):
-                snippet = f'DuckDuckGo: {ddg["error"]} (попробуйте позже)'
-            results.append({
-                'provider': 'duckduckgo',
-                'found': ddg['found'],
-                'snippet': snippet,
-                'matches': ddg.get('matches', []),
-            })
-            _save('duckduckgo', ddg['found'], snippet, json.dumps(ddg, ensure_ascii=False))
-            if ddg['found']:
-                any_found = True
-
-        # 4) YandexGPT — отдельная нейросеть (без веб-поиска, но проверим знает ли она)
+            probes.append(('yandex_search', probe_yandex_search, (search_query, domains)))
+            probes.append(('duckduckgo', probe_duckduckgo, (search_query, domains)))
         if query_text or title:
-            try:
-                yag = call_yandex_gpt(query_text or title)
-                text_lc = (yag.get('text') or '').lower()
-                cited_urls_y = find_urls_in_text(yag.get('text') or '')
-                matched_yag = ''
-                for u in all_urls:
-                    if u.lower().rstrip('/') in text_lc:
-                        matched_yag = u
-                        break
-                matched_dom_y = ''
-                if not matched_yag:
-                    for dom in domains:
-                        if dom in text_lc:
-                            matched_dom_y = dom
-                            break
-                found_y = bool(matched_yag or matched_dom_y)
-                if matched_yag:
-                    snip_y = f'YandexGPT процитировал ваш URL: {matched_yag}'
-                elif matched_dom_y:
-                    snip_y = f'YandexGPT упомянул ваш домен {matched_dom_y}'
-                else:
-                    snip_y = 'YandexGPT не упомянул вашу публикацию в ответе по теме'
-                results.append({
-                    'provider': 'yandex_gpt',
-                    'found': found_y,
-                    'snippet': snip_y,
-                    'citations': cited_urls_y[:5],
-                })
-                _save('yandex_gpt', found_y, snip_y, yag.get('text') or '')
-                if found_y:
-                    any_found = True
-            except Exception as e:
-                msg = str(e)[:200]
-                print(f'[pub-check] yandex_gpt: {msg}')
-                results.append({'provider': 'yandex_gpt', 'found': False, 'error': msg})
-                _save('yandex_gpt', False, msg, msg)
-
-        # 5) Search-enabled LLM (Perplexity Sonar, GPT-4o Search) — нейровыдача
+            probes.append(('yandex_gpt', probe_yandex_gpt, (query_text or title, all_urls, domains)))
         for provider in SEARCH_LLM_PROVIDERS.keys():
-            try:
-                r = call_search_llm(provider, query_text or search_query)
-            except Exception as e:
-                msg = str(e)[:200]
-                print(f'[pub-check] {provider}: {msg}')
-                low = msg.lower()
-                user_msg = msg
-                if any(w in low for w in ('insufficient', 'balance', 'payment', '402', 'недостаточно')):
-                    user_msg = 'У провайдера моделей нет средств — пополните vsegpt.ru'
-                elif '404' in low or 'not found' in low or 'model' in low:
-                    user_msg = f'Search-модель «{provider}» недоступна у провайдера'
-                results.append({'provider': provider, 'found': False, 'error': user_msg})
-                _save(provider, False, user_msg, msg)
-                continue
+            probes.append((provider, probe_search_llm, (provider, query_text or search_query, all_urls, domains)))
 
-            text_lc = (r['text'] or '').lower()
-            citations = r.get('citations') or []
-            # Собираем URL'ы и из цитат, и из текста ответа
-            cited_urls = [str(c) for c in citations] + find_urls_in_text(r['text'] or '')
-            cited_lc = [u.lower() for u in cited_urls]
-
-            matched_url = ''
-            matched_domain = ''
-            for u in all_urls:
-                u_lc = u.lower().rstrip('/')
-                for c in cited_lc:
-                    if u_lc in c or c.rstrip('/') == u_lc:
-                        matched_url = u
-                        break
-                if matched_url:
-                    break
-            if not matched_url:
-                for dom in domains:
-                    if any(dom in c for c in cited_lc) or dom in text_lc:
-                        matched_domain = dom
-                        break
-
-            found = bool(matched_url or matched_domain)
-
-            if matched_url:
-                snippet = f'Нейросеть процитировала именно вашу ссылку: {matched_url}'
-            elif matched_domain:
-                snippet = f'Нейросеть сослалась на ваш домен {matched_domain} (не точный URL)'
-            else:
-                snippet = (
-                    'Нейросеть нашла источники по теме, но вашей публикации среди них нет. '
-                    f'Цитаты, которые она привела: {", ".join(cited_urls[:3]) or "—"}'
-                )
+        results = run_probes(probes)
+        any_found = any(r['found'] for r in results)
 
-            results.append({
-                'provider': provider,
-                'found': found,
-                'snippet': snippet[:500],
-                'citations': cited_urls[:5],
-            })
-            _save(provider, found, snippet, r['text'])
-            if found:
-                any_found = True
-
-        # Обновляем сводный статус
+        # История проверок и сводный статус — одной транзакцией
+        rows = [
+            (tenant_id, pub_id, r['provider'], r['found'], (r.get('_snippet') or r.get('snippet') or '')[:1024], r['_raw'][:5000])
+            for r in results if r.get('_raw') is not None
+        ]
         try:
             with conn:
                 with conn.cursor() as cur:
+                    if rows:
+                        execute_values(
+                            cur,
+                            'INSERT INTO geo_publication_checks_v2 '
+                            '(tenant_id, publication_id, provider, found, snippet, raw_response) VALUES %s',
+                            rows
+                        )
                     cur.execute(
                         'UPDATE geo_publications_v2 SET last_check_at = NOW(), last_check_found = %s, updated_at = NOW() '
                         'WHERE tenant_id = %s AND id = %s',
                         (any_found, tenant_id, pub_id)
                     )
+                    save_url_cache(cur, [e for r in results for e in r.get('_url_cache', [])])
         except Exception as e:
-            print(f'[pub-check] update pub: {e}')
+            print(f'[pub-check] save: {e}')
 
         return resp(200, {
             'found': any_found,
-            'results': results,
+            'results': [{k: v for k, v in r.items() if not k.startswith('_')} for r in results],
             'summary': (
                 'Публикация найдена в открытом интернете' if any_found
                 else 'Публикация пока не индексирована в проверенных источниках. '
@@ -807,4 +1030,4 @@ def check_publication(tenant_id: str, pub_id: str):
             ),
         })
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
@@ -0,0 +1,31 @@
+"""Проверки сопоставления доменов и URL с выдачей: python -m unittest test_matcher (из каталога geo-publications)"""
+
+import unittest
+
+from index import compile_matcher, find_matches
+
+
+class FindMatchesTest(unittest.TestCase):
+
+    def test_domain_is_not_found_inside_longer_domain(self):
+        matcher = compile_matcher(['site.com', 'mysite.com'])
+        self.assertEqual(find_matches(matcher, '<a href="https://mysite.com/x">'), {'mysite.com'})
+        self.assertEqual(find_matches(matcher, 'site.com.evil.ru'), set())
+
+    def test_url_is_not_found_by_longer_path(self):
+        matcher = compile_matcher(['https://site.com/a', 'https://site.com/ab', 'site.com'])
+        self.assertEqual(find_matches(matcher, '<a href="https://site.com/ab">'), {'https://site.com/ab', 'site.com'})
+        self.assertEqual(find_matches(matcher, '<a href="https://site.com/a/">'), {'https://site.com/a', 'site.com'})
+
+    def test_url_credits_its_domain(self):
+        matcher = compile_matcher(['https://www.site.com/a', 'site.com'])
+        self.assertEqual(find_matches(matcher, 'https://www.site.com/a?utm=1'), {'https://www.site.com/a', 'site.com'})
+
+    def test_url_needle_alone(self):
+        matcher = compile_matcher(['https://site.com/a'])
+        self.assertEqual(find_matches(matcher, '"https://site.com/ab"'), set())
+        self.assertEqual(find_matches(matcher, '"https://site.com/a#top"'), {'https://site.com/a'})
+
+
+if __name__ == '__main__':
+    unittest.main()
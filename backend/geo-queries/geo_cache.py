@@ -0,0 +1,111 @@
+"""Кэш ответов geo-эндпоинтов чтения: версия данных tenant'а, ETag/304 и stale-while-revalidate.
+Файл одинаковый во всех geo-функциях — при правке копируйте во все каталоги."""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+RESPONSE_CACHE_SIZE = 256
+# Браузеру разрешено столько секунд показывать прежний ответ, перепроверяя его в фоне
+CACHE_SWR_SECONDS = 30
+# Окна «последние N дней» сдвигаются и без новых данных: ETag включает номер интервала
+# такой длины, поэтому дольше этого ответ не живёт ни в памяти, ни у браузера
+CACHE_MAX_AGE = 600
+
+_responses = OrderedDict()
+_lock = threading.Lock()
+
+
+def _connect():
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+
+def data_version(cur, tenant_id: str) -> int:
+    cur.execute('SELECT version FROM geo_data_versions WHERE tenant_id = %s', (tenant_id,))
+    row = cur.fetchone()
+    if row is None:
+        return 0
+    return int(row['version'] if isinstance(row, dict) else row[0])
+
+
+def bump_data_version(cur, tenant_id: str):
+    """Отмечает, что данные tenant'а изменились. Вызывать в транзакции писателя (опрос, проверка, CRUD)."""
+    cur.execute(
+        'INSERT INTO geo_data_versions (tenant_id, version) VALUES (%s, 1) '
+        'ON CONFLICT (tenant_id) DO UPDATE SET version = geo_data_versions.version + 1, updated_at = NOW()',
+        (tenant_id,)
+    )
+
+
+def mark_changed(tenant_id: str):
+    """bump_data_version в отдельной транзакции — для обработчиков, у которых нет общего курсора."""
+    conn = _connect()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                bump_data_version(cur, tenant_id)
+    finally:
+        conn.close()
+
+
+def _with_cache_headers(response: dict, etag: str) -> dict:
+    headers = {
+        **response['headers'],
+        'ETag': etag,
+        'Cache-Control': f'private, max-age=0, stale-while-revalidate={CACHE_SWR_SECONDS}',
+        'Access-Control-Expose-Headers': 'ETag',
+    }
+    return {**response, 'headers': headers}
+
+
+def _not_modified(response_headers: dict, etag: str) -> dict:
+    return _with_cache_headers({'statusCode': 304, 'headers': response_headers,
+                                'isBase64Encoded': False, 'body': ''}, etag)
+
+
+def cached_response(request_headers: dict, tenant_id: str, key: tuple, build, base_headers: dict) -> dict:
+    """Ответ build(conn) (HTTP-ответ функции), закэшированный по (tenant, key) и версии данных tenant'а.
+
+    Версия читается на каждый запрос — на том же соединении, которое потом получает build, поэтому
+    запись из любого процесса видна сразу. ETag зависит только от ключа, версии и интервала CACHE_MAX_AGE:
+    совпавший If-None-Match даёт 304 после одного SELECT версии, без пересчёта даже в холодном процессе."""
+    tenant_id = str(tenant_id)
+    cache_key = (tenant_id,) + tuple(key)
+    if_none_match = request_headers.get('If-None-Match') or request_headers.get('if-none-match') or ''
+    client_etags = {t.strip() for t in if_none_match.split(',') if t.strip()}
+
+    conn = _connect()
+    try:
+        # Версия читается до построения и в отдельной транзакции: запись между ними даст ответ новее ETag,
+        # и следующий запрос его просто перестроит; обратного (ETag новее данных) не бывает
+        with conn:
+            with conn.cursor() as cur:
+                version = data_version(cur, tenant_id)
+        tag = json.dumps([cache_key, version, int(time.time() // CACHE_MAX_AGE)], default=str)
+        etag = '"' + hashlib.sha256(tag.encode()).hexdigest()[:32] + '"'
+        if etag in client_etags:
+            return _not_modified(base_headers, etag)
+
+        with _lock:
+            entry = _responses.get(cache_key)
+            if entry and entry['etag'] == etag:
+                _responses.move_to_end(cache_key)
+        if entry and entry['etag'] == etag:
+            return _with_cache_headers(entry['response'], etag)
+
+        response = build(conn)
+    finally:
+        conn.close()
+    if response.get('statusCode') != 200:
+        return response
+    with _lock:
+        _responses[cache_key] = {'etag': etag, 'response': response}
+        _responses.move_to_end(cache_key)
+        while len(_responses) > RESPONSE_CACHE_SIZE:
+            _responses.popitem(last=False)
+    return _with_cache_headers(response, etag)
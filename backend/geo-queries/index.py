@@ -3,17 +3,18 @@ Business: CRUD отслеживаемых поисковых запросов GE
 Args: event с httpMethod, headers (X-Auth-Token), body или queryStringParameters (action)
 Returns: HTTP-ответ со списком запросов / результатом операции / сгенерированными предложениями
 """
+import csv
+import io
 import json
 import os
-import hmac
-import hashlib
-import base64
-import time
 import urllib.request
 import urllib.error
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from geo_cache import cached_response, mark_changed
+from geo_context import get_tenant, resolve_project
+
 
 VSEGPT_BASE = 'https://api.vsegpt.ru/v1/chat/completions'
 DEFAULT_MODEL = 'openai/gpt-4o-mini'
@@ -38,74 +39,10 @@ def resp(status, body):
             'body': json.dumps(body, ensure_ascii=False, default=str)}
 
 
-def b64url_decode(s: str) -> bytes:
-    pad = '=' * (-len(s) % 4)
-    return base64.urlsafe_b64decode(s + pad)
-
-
-def b64url(data: bytes) -> str:
-    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
-
-
-def jwt_decode(token: str, secret: str):
-    try:
-        h, p, s = token.split('.')
-        sig_input = f'{h}.{p}'.encode()
-        expected = hmac.new(secret.encode(), sig_input, hashlib.sha256).digest()
-        if not hmac.compare_digest(b64url(expected), s):
-            return None
-        payload = json.loads(b64url_decode(p))
-        if payload.get('exp', 0) < int(time.time()):
-            return None
-        return payload
-    except Exception:
-        return None
-
-
-def get_tenant(headers: dict):
-    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
-    if not token:
-        return None
-    payload = jwt_decode(token, os.environ.get('GEO_JWT_SECRET', 'dev-secret'))
-    return payload.get('tid') if payload else None
-
-
 def get_db():
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 
-def _row_id(row):
-    """Достаёт id из строки независимо от типа курсора (dict или tuple)."""
-    if row is None:
-        return None
-    try:
-        return str(row['id'])
-    except (TypeError, KeyError, IndexError):
-        return str(row[0])
-
-
-def resolve_project(cur, tenant_id: str, project_id):
-    """Возвращает валидный project_id (переданный или дефолтный), гарантирует наличие проекта."""
-    if project_id:
-        cur.execute('SELECT id FROM geo_projects WHERE tenant_id = %s AND id = %s',
-                    (tenant_id, project_id))
-        rid = _row_id(cur.fetchone())
-        if rid:
-            return rid
-    cur.execute(
-        'SELECT id FROM geo_projects WHERE tenant_id = %s ORDER BY is_default DESC, created_at ASC LIMIT 1',
-        (tenant_id,)
-    )
-    rid = _row_id(cur.fetchone())
-    if rid:
-        return rid
-    cur.execute(
-        'INSERT INTO geo_projects (tenant_id, name, is_default) VALUES (%s, %s, TRUE) RETURNING id',
-        (tenant_id, 'Основной проект')
-    )
-    return _row_id(cur.fetchone())
-
-
 def handler(event, context):
     method = event.get('httpMethod', 'GET')
     if method == 'OPTIONS':
@@ -127,25 +64,34 @@ def handler(event, context):
     project_id = qs.get('project_id') or body.get('project_id')
 
     if method == 'GET':
+        days = int(qs.get('days', '14'))
         if action == 'competitor_gaps':
-            return competitor_gaps(tenant_id, int(qs.get('days', '14')), project_id)
-        return list_queries(tenant_id, int(qs.get('days', '14')), project_id)
+            build = lambda conn: competitor_gaps(conn, tenant_id, days, project_id)
+        else:
+            action, build = 'list', lambda conn: list_queries(conn, tenant_id, days, project_id)
+        return cached_response(headers, tenant_id, ('queries', action, project_id, days), build, cors_headers())
+    if method == 'POST' and action == 'suggest':
+        return suggest_queries(tenant_id, body, project_id)
+
     if method == 'POST':
-        if action == 'suggest':
-            return suggest_queries(tenant_id, body, project_id)
         if action == 'bulk_create':
-            return bulk_create_queries(tenant_id, body, project_id)
-        return create_query(tenant_id, body, project_id)
-    if method == 'PUT':
-        return update_query(tenant_id, qs.get('id', ''), body)
-    if method == 'DELETE':
-        return delete_query(tenant_id, qs.get('id', ''))
-    return resp(405, {'error': 'method_not_allowed'})
+            result = bulk_create_queries(tenant_id, body, project_id)
+        else:
+            result = create_query(tenant_id, body, project_id)
+    elif method == 'PUT':
+        result = update_query(tenant_id, qs.get('id', ''), body)
+    elif method == 'DELETE':
+        result = delete_query(tenant_id, qs.get('id', ''))
+    else:
+        return resp(405, {'error': 'method_not_allowed'})
+    if result['statusCode'] == 200:
+        mark_changed(tenant_id)
+    return result
 
 
 # ------------------------- LIST с метриками -------------------------
 
-def list_queries(tenant_id: str, days: int = 14, project_id=None):
+def list_queries(conn, tenant_id: str, days: int = 14, project_id=None):
     """
     Отдаёт запросы + per-query метрики за `days` дней:
       - sov: доля голоса бренда по этому запросу
@@ -154,124 +100,120 @@ def list_queries(tenant_id: str, days: int = 14, project_id=None):
       - trend: '+', '-', '=' (сравнение с предыдущим окном такой же длины)
     """
     days = max(1, min(int(days or 14), 90))
-    conn = get_db()
-    try:
-        with conn:
-          with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            pid = resolve_project(cur, tenant_id, project_id)
-            cur.execute(
-                """
-                SELECT q.id, q.text, q.language, q.is_active, q.category, q.intent, q.notes, q.source,
-                       q.created_at,
-                       (SELECT MAX(polled_at) FROM geo_llm_responses r WHERE r.query_id = q.id) AS last_polled,
-                       (SELECT COUNT(*) FROM geo_llm_responses r WHERE r.query_id = q.id) AS responses_count
-                FROM geo_tracked_queries q
-                WHERE q.tenant_id = %s AND q.project_id = %s
-                ORDER BY q.is_active DESC, q.created_at DESC
-                """,
-                (tenant_id, pid)
-            )
-            rows = cur.fetchall()
-
-            # Метрики за текущее окно (только бренды этого проекта)
-            cur.execute(
-                """
-                SELECT r.query_id,
-                       SUM(CASE WHEN b.is_own THEN 1 ELSE 0 END) AS own_m,
-                       SUM(CASE WHEN b.is_own THEN 0 ELSE 1 END) AS comp_m,
-                       COUNT(*) AS total_m
-                FROM geo_mentions m
-                JOIN geo_llm_responses r ON r.id = m.response_id
-                JOIN geo_brands b ON b.id = m.brand_id
-                WHERE m.tenant_id = %s AND b.project_id = %s
-                  AND r.polled_at >= NOW() - (%s || ' days')::interval
-                GROUP BY r.query_id
-                """,
-                (tenant_id, pid, days)
-            )
-            cur_metrics = {str(r['query_id']): r for r in cur.fetchall()}
-
-            # Метрики за предыдущее окно (для тренда)
-            cur.execute(
-                """
-                SELECT r.query_id,
-                       SUM(CASE WHEN b.is_own THEN 1 ELSE 0 END) AS own_m,
-                       COUNT(*) AS total_m
-                FROM geo_mentions m
-                JOIN geo_llm_responses r ON r.id = m.response_id
-                JOIN geo_brands b ON b.id = m.brand_id
-                WHERE m.tenant_id = %s AND b.project_id = %s
-                  AND r.polled_at >= NOW() - (%s || ' days')::interval
-                  AND r.polled_at <  NOW() - (%s || ' days')::interval
-                GROUP BY r.query_id
-                """,
-                (tenant_id, pid, days * 2, days)
-            )
-            prev_metrics = {str(r['query_id']): r for r in cur.fetchall()}
-
-            # Топ-конкурент по каждому запросу
-            cur.execute(
-                """
-                SELECT r.query_id, b.name AS brand_name, COUNT(*) AS cnt
-                FROM geo_mentions m
-                JOIN geo_llm_responses r ON r.id = m.response_id
-                JOIN geo_brands b ON b.id = m.brand_id
-                WHERE m.tenant_id = %s AND b.project_id = %s
-                  AND b.is_own = FALSE
-                  AND r.polled_at >= NOW() - (%s || ' days')::interval
-                GROUP BY r.query_id, b.name
-                ORDER BY r.query_id, cnt DESC
-                """,
-                (tenant_id, pid, days)
-            )
-            top_comp = {}
-            for r in cur.fetchall():
-                qid = str(r['query_id'])
-                if qid not in top_comp:
-                    top_comp[qid] = {'name': r['brand_name'], 'count': int(r['cnt'])}
-
-        out = []
-        for r in rows:
-            qid = str(r['id'])
-            cur_m = cur_metrics.get(qid) or {'own_m': 0, 'comp_m': 0, 'total_m': 0}
-            prev_m = prev_metrics.get(qid) or {'own_m': 0, 'total_m': 0}
-
-            own = int(cur_m['own_m'] or 0)
-            comp = int(cur_m['comp_m'] or 0)
-            total = int(cur_m['total_m'] or 0)
-            sov = round(own / total * 100, 1) if total else 0
-
-            prev_total = int(prev_m['total_m'] or 0)
-            prev_sov = (int(prev_m['own_m'] or 0) / prev_total * 100) if prev_total else 0
-            if prev_total == 0 and total == 0:
-                trend = '='
-            elif abs(sov - prev_sov) < 2:
-                trend = '='
-            else:
-                trend = '+' if sov > prev_sov else '-'
-
-            out.append({
-                'id': qid, 'text': r['text'], 'language': r['language'],
-                'is_active': r['is_active'],
-                'category': r['category'], 'intent': r['intent'], 'notes': r['notes'],
-                'source': r['source'] or 'manual',
-                'created_at': r['created_at'].isoformat(),
-                'last_polled': r['last_polled'].isoformat() if r['last_polled'] else None,
-                'responses_count': int(r['responses_count'] or 0),
-                'metrics': {
-                    'own_mentions': own,
-                    'competitor_mentions': comp,
-                    'total_mentions': total,
-                    'sov': sov,
-                    'trend': trend,
-                    'sov_delta': round(sov - prev_sov, 1),
-                    'top_competitor': top_comp.get(qid),
-                    'window_days': days,
-                },
-            })
-        return resp(200, {'queries': out})
-    finally:
-        conn.close()
+    with conn:
+      with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        pid = resolve_project(cur, tenant_id, project_id)
+        cur.execute(
+            """
+            SELECT q.id, q.text, q.language, q.is_active, q.category, q.intent, q.notes, q.source,
+                   q.created_at,
+                   (SELECT MAX(polled_at) FROM geo_llm_responses r WHERE r.query_id = q.id) AS last_polled,
+                   (SELECT COUNT(*) FROM geo_llm_responses r WHERE r.query_id = q.id) AS responses_count
+            FROM geo_tracked_queries q
+            WHERE q.tenant_id = %s AND q.project_id = %s
+            ORDER BY q.is_active DESC, q.created_at DESC
+            """,
+            (tenant_id, pid)
+        )
+        rows = cur.fetchall()
+
+        # Метрики за текущее окно (только бренды этого проекта)
+        cur.execute(
+            """
+            SELECT r.query_id,
+                   SUM(CASE WHEN b.is_own THEN 1 ELSE 0 END) AS own_m,
+                   SUM(CASE WHEN b.is_own THEN 0 ELSE 1 END) AS comp_m,
+                   COUNT(*) AS total_m
+            FROM geo_mentions m
+            JOIN geo_llm_responses r ON r.id = m.response_id
+            JOIN geo_brands b ON b.id = m.brand_id
+            WHERE m.tenant_id = %s AND b.project_id = %s
+              AND r.polled_at >= NOW() - (%s || ' days')::interval
+            GROUP BY r.query_id
+            """,
+            (tenant_id, pid, days)
+        )
+        cur_metrics = {str(r['query_id']): r for r in cur.fetchall()}
+
+        # Метрики за предыдущее окно (для тренда)
+        cur.execute(
+            """
+            SELECT r.query_id,
+                   SUM(CASE WHEN b.is_own THEN 1 ELSE 0 END) AS own_m,
+                   COUNT(*) AS total_m
+            FROM geo_mentions m
+            JOIN geo_llm_responses r ON r.id = m.response_id
+            JOIN geo_brands b ON b.id = m.brand_id
+            WHERE m.tenant_id = %s AND b.project_id = %s
+              AND r.polled_at >= NOW() - (%s || ' days')::interval
+              AND r.polled_at <  NOW() - (%s || ' days')::interval
+            GROUP BY r.query_id
+            """,
+            (tenant_id, pid, days * 2, days)
+        )
+        prev_metrics = {str(r['query_id']): r for r in cur.fetchall()}
+
+        # Топ-конкурент по каждому запросу
+        cur.execute(
+            """
+            SELECT r.query_id, b.name AS brand_name, COUNT(*) AS cnt
+            FROM geo_mentions m
+            JOIN geo_llm_responses r ON r.id = m.response_id
+            JOIN geo_brands b ON b.id = m.brand_id
+            WHERE m.tenant_id = %s AND b.project_id = %s
+              AND b.is_own = FALSE
+              AND r.polled_at >= NOW() - (%s || ' days')::interval
+            GROUP BY r.query_id, b.name
+            ORDER BY r.query_id, cnt DESC
+            """,
+            (tenant_id, pid, days)
+        )
+        top_comp = {}
+        for r in cur.fetchall():
+            qid = str(r['query_id'])
+            if qid not in top_comp:
+                top_comp[qid] = {'name': r['brand_name'], 'count': int(r['cnt'])}
+
+    out = []
+    for r in rows:
+        qid = str(r['id'])
+        cur_m = cur_metrics.get(qid) or {'own_m': 0, 'comp_m': 0, 'total_m': 0}
+        prev_m = prev_metrics.get(qid) or {'own_m': 0, 'total_m': 0}
+
+        own = int(cur_m['own_m'] or 0)
+        comp = int(cur_m['comp_m'] or 0)
+        total = int(cur_m['total_m'] or 0)
+        sov = round(own / total * 100, 1) if total else 0
+
+        prev_total = int(prev_m['total_m'] or 0)
+        prev_sov = (int(prev_m['own_m'] or 0) / prev_total * 100) if prev_total else 0
+        if prev_total == 0 and total == 0:
+            trend = '='
+        elif abs(sov - prev_sov) < 2:
+            trend = '='
+        else:
+            trend = '+' if sov > prev_sov else '-'
+
+        out.append({
+            'id': qid, 'text': r['text'], 'language': r['language'],
+            'is_active': r['is_active'],
+            'category': r['category'], 'intent': r['intent'], 'notes': r['notes'],
+            'source': r['source'] or 'manual',
+            'created_at': r['created_at'].isoformat(),
+            'last_polled': r['last_polled'].isoformat() if r['last_polled'] else None,
+            'responses_count': int(r['responses_count'] or 0),
+            'metrics': {
+                'own_mentions': own,
+                'competitor_mentions': comp,
+                'total_mentions': total,
+                'sov': sov,
+                'trend': trend,
+                'sov_delta': round(sov - prev_sov, 1),
+                'top_competitor': top_comp.get(qid),
+                'window_days': days,
+            },
+        })
+    return resp(200, {'queries': out})
 
 
 # ------------------------- CRUD -------------------------
@@ -311,10 +253,13 @@ def create_query(tenant_id: str, body: dict, project_id=None):
                 cur.execute(
                     'INSERT INTO geo_tracked_queries '
                     '(tenant_id, project_id, text, language, is_active, category, intent, notes, source) '
-                    'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id, created_at',
+                    'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) '
+                    'ON CONFLICT (tenant_id, project_id, LOWER(text)) DO NOTHING RETURNING id, created_at',
                     (tenant_id, pid, text, language, is_active, category, intent, notes, source)
                 )
                 row = cur.fetchone()
+        if row is None:
+            return resp(409, {'error': 'duplicate', 'message': 'Такой запрос уже есть в проекте'})
         return resp(200, {'query': {
             'id': str(row['id']), 'text': text, 'language': language,
             'is_active': is_active, 'category': category, 'intent': intent,
@@ -359,6 +304,8 @@ def update_query(tenant_id: str, qid: str, body: dict):
                 if cur.rowcount == 0:
                     return resp(404, {'error': 'not_found'})
         return resp(200, {'ok': True})
+    except psycopg2.errors.UniqueViolation:
+        return resp(409, {'error': 'duplicate', 'message': 'Такой запрос уже есть в проекте'})
     finally:
         conn.close()
 
@@ -386,37 +333,73 @@ def delete_query(tenant_id: str, qid: str):
 
 # ------------------------- BULK CREATE -------------------------
 
+MAX_BULK_ITEMS = 10000
+CSV_COLUMNS = ('text', 'language', 'category', 'intent', 'notes', 'source')
+
+
+def _parse_csv_items(raw: str) -> list:
+    """CSV-импорт: либо с заголовком (колонки из CSV_COLUMNS, обязательна text), либо запрос в первой колонке."""
+    sample = raw[:4096]
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    rows = csv.reader(io.StringIO(raw), dialect)
+    first = next(rows, None)
+    if first is None:
+        return []
+    header = [c.strip().lower() for c in first]
+    if 'text' not in header:
+        return [r[0] for r in [first, *rows] if r]
+    idx = {col: header.index(col) for col in CSV_COLUMNS if col in header}
+    items = []
+    for r in rows:
+        item = {col: r[i] for col, i in idx.items() if i < len(r) and r[i].strip()}
+        if item.get('text'):
+            items.append(item)
+    return items
+
+
 def bulk_create_queries(tenant_id: str, body: dict, project_id=None):
     """
     Принимает items: [{text, language?, category?, intent?, notes?, source?}, ...]
     Или просто массив строк: items: ['запрос 1', 'запрос 2', ...]
-    Дубликаты (одинаковый text) пропускает.
+    Или csv: строка CSV (см. _parse_csv_items).
+    Вставка одним INSERT ... SELECT FROM unnest; дубликаты (тот же text без учёта регистра)
+    отсекает уникальный индекс проекта.
     """
     raw_items = body.get('items') or []
+    if body.get('csv'):
+        raw_items = _parse_csv_items(str(body['csv']))
     if not isinstance(raw_items, list) or not raw_items:
         return resp(400, {'error': 'items_required'})
-    if len(raw_items) > 200:
-        return resp(400, {'error': 'too_many_items', 'message': 'Максимум 200 запросов за раз'})
+    if len(raw_items) > MAX_BULK_ITEMS:
+        return resp(400, {'error': 'too_many_items', 'message': f'Максимум {MAX_BULK_ITEMS} запросов за раз'})
 
-    items = []
+    cols = {k: [] for k in ('text', 'language', 'category', 'intent', 'notes', 'source')}
+    seen = set()
+    total = 0
     for it in raw_items:
         if isinstance(it, str):
-            text = it.strip()
-            if text:
-                items.append({'text': text})
-        elif isinstance(it, dict):
-            text = (it.get('text') or '').strip()
-            if text:
-                items.append({
-                    'text': text[:1000],
-                    'language': it.get('language') or 'ru',
-                    'category': _normalize_category(it.get('category')),
-                    'intent': _normalize_intent(it.get('intent')),
-                    'notes': it.get('notes'),
-                    'source': (it.get('source') or 'bulk').strip()[:32],
-                })
-
-    if not items:
+            it = {'text': it}
+        elif not isinstance(it, dict):
+            continue
+        text = (it.get('text') or '').strip()[:1000]
+        if not text:
+            continue
+        total += 1
+        key = text.lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        cols['text'].append(text)
+        cols['language'].append(it.get('language') or 'ru')
+        cols['category'].append(_normalize_category(it.get('category')))
+        cols['intent'].append(_normalize_intent(it.get('intent')))
+        cols['notes'].append(it.get('notes'))
+        cols['source'].append((it.get('source') or 'bulk').strip()[:32])
+
+    if not total:
         return resp(400, {'error': 'no_valid_items'})
 
     conn = get_db()
@@ -424,32 +407,18 @@ def bulk_create_queries(tenant_id: str, body: dict, project_id=None):
         with conn:
             with conn.cursor() as cur:
                 pid = resolve_project(cur, tenant_id, project_id)
-                # Существующие тексты в этом проекте — чтобы не дублировать
                 cur.execute(
-                    'SELECT LOWER(text) FROM geo_tracked_queries WHERE tenant_id = %s AND project_id = %s',
-                    (tenant_id, pid)
+                    'INSERT INTO geo_tracked_queries '
+                    '(tenant_id, project_id, text, language, is_active, category, intent, notes, source) '
+                    'SELECT %s, %s, t.text, t.language, TRUE, t.category, t.intent, t.notes, t.source '
+                    'FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::text[]) '
+                    'AS t(text, language, category, intent, notes, source) '
+                    'ON CONFLICT (tenant_id, project_id, LOWER(text)) DO NOTHING RETURNING id',
+                    (tenant_id, pid, cols['text'], cols['language'], cols['category'],
+                     cols['intent'], cols['notes'], cols['source'])
                 )
-                existing = {row[0] for row in cur.fetchall()}
-
-                created = 0
-                skipped = 0
-                seen_in_batch = set()
-                for it in items:
-                    key = it['text'].lower()
-                    if key in existing or key in seen_in_batch:
-                        skipped += 1
-                        continue
-                    seen_in_batch.add(key)
-                    cur.execute(
-                        'INSERT INTO geo_tracked_queries '
-                        '(tenant_id, project_id, text, language, is_active, category, intent, notes, source) '
-                        'VALUES (%s, %s, %s, %s, TRUE, %s, %s, %s, %s)',
-                        (tenant_id, pid, it['text'], it.get('language', 'ru'),
-                         it.get('category'), it.get('intent'), it.get('notes'),
-                         it.get('source', 'bulk'))
-                    )
-                    created += 1
-        return resp(200, {'created': created, 'skipped': skipped, 'total': len(items)})
+                created = len(cur.fetchall())
+        return resp(200, {'created': created, 'skipped': total - created, 'total': total})
     finally:
         conn.close()
 
@@ -654,89 +623,85 @@ def suggest_queries(tenant_id: str, body: dict, project_id=None):
 
 # ------------------------- COMPETITOR GAPS -------------------------
 
-def competitor_gaps(tenant_id: str, days: int = 14, project_id=None):
+def competitor_gaps(conn, tenant_id: str, days: int = 14, project_id=None):
     """
     Анализ «где конкуренты выигрывают, а нас нет».
     Возвращает топ-запросы, где own_mentions == 0, но competitor_mentions > 0.
     """
     days = max(1, min(int(days or 14), 90))
-    conn = get_db()
-    try:
-        with conn:
-          with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            pid = resolve_project(cur, tenant_id, project_id)
+    with conn:
+      with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        pid = resolve_project(cur, tenant_id, project_id)
+        cur.execute(
+            """
+            SELECT q.id, q.text, q.category, q.intent,
+                   COUNT(DISTINCT r.id) AS responses,
+                   SUM(CASE WHEN b.is_own THEN 1 ELSE 0 END) AS own_m,
+                   SUM(CASE WHEN b.is_own THEN 0 ELSE 1 END) AS comp_m
+            FROM geo_tracked_queries q
+            LEFT JOIN geo_llm_responses r
+              ON r.query_id = q.id AND r.polled_at >= NOW() - (%s || ' days')::interval
+            LEFT JOIN geo_mentions m ON m.response_id = r.id
+            LEFT JOIN geo_brands b ON b.id = m.brand_id
+            WHERE q.tenant_id = %s AND q.project_id = %s
+            GROUP BY q.id
+            HAVING COUNT(DISTINCT r.id) > 0
+            ORDER BY (SUM(CASE WHEN b.is_own THEN 0 ELSE 1 END))::int DESC,
+                     (SUM(CASE WHEN b.is_own THEN 1 ELSE 0 END))::int ASC
+            LIMIT 50
+            """,
+            (days, tenant_id, pid)
+        )
+        rows = cur.fetchall()
+
+        # Для каждого «дырявого» запроса вытаскиваем кто выигрывает
+        gap_qids = [str(r['id']) for r in rows if int(r['own_m'] or 0) == 0 and int(r['comp_m'] or 0) > 0]
+        top_brands_per_query = {}
+        if gap_qids:
             cur.execute(
                 """
-                SELECT q.id, q.text, q.category, q.intent,
-                       COUNT(DISTINCT r.id) AS responses,
-                       SUM(CASE WHEN b.is_own THEN 1 ELSE 0 END) AS own_m,
-                       SUM(CASE WHEN b.is_own THEN 0 ELSE 1 END) AS comp_m
-                FROM geo_tracked_queries q
-                LEFT JOIN geo_llm_responses r
-                  ON r.query_id = q.id AND r.polled_at >= NOW() - (%s || ' days')::interval
-                LEFT JOIN geo_mentions m ON m.response_id = r.id
-                LEFT JOIN geo_brands b ON b.id = m.brand_id
-                WHERE q.tenant_id = %s AND q.project_id = %s
-                GROUP BY q.id
-                HAVING COUNT(DISTINCT r.id) > 0
-                ORDER BY (SUM(CASE WHEN b.is_own THEN 0 ELSE 1 END))::int DESC,
-                         (SUM(CASE WHEN b.is_own THEN 1 ELSE 0 END))::int ASC
-                LIMIT 50
+                SELECT r.query_id, b.name AS brand_name, COUNT(*) AS cnt
+                FROM geo_mentions m
+                JOIN geo_llm_responses r ON r.id = m.response_id
+                JOIN geo_brands b ON b.id = m.brand_id
+                WHERE m.tenant_id = %s AND b.project_id = %s
+                  AND b.is_own = FALSE
+                  AND r.polled_at >= NOW() - (%s || ' days')::interval
+                  AND r.query_id::text = ANY(%s)
+                GROUP BY r.query_id, b.name
+                ORDER BY r.query_id, cnt DESC
                 """,
-                (days, tenant_id, pid)
+                (tenant_id, pid, days, gap_qids)
             )
-            rows = cur.fetchall()
-
-            # Для каждого «дырявого» запроса вытаскиваем кто выигрывает
-            gap_qids = [str(r['id']) for r in rows if int(r['own_m'] or 0) == 0 and int(r['comp_m'] or 0) > 0]
-            top_brands_per_query = {}
-            if gap_qids:
-                cur.execute(
-                    """
-                    SELECT r.query_id, b.name AS brand_name, COUNT(*) AS cnt
-                    FROM geo_mentions m
-                    JOIN geo_llm_responses r ON r.id = m.response_id
-                    JOIN geo_brands b ON b.id = m.brand_id
-                    WHERE m.tenant_id = %s AND b.project_id = %s
-                      AND b.is_own = FALSE
-                      AND r.polled_at >= NOW() - (%s || ' days')::interval
-                      AND r.query_id::text = ANY(%s)
-                    GROUP BY r.query_id, b.name
-                    ORDER BY r.query_id, cnt DESC
-                    """,
-                    (tenant_id, pid, days, gap_qids)
+            for r in cur.fetchall():
+                qid = str(r['query_id'])
+                top_brands_per_query.setdefault(qid, []).append(
+                    {'name': r['brand_name'], 'count': int(r['cnt'])}
                 )
-                for r in cur.fetchall():
-                    qid = str(r['query_id'])
-                    top_brands_per_query.setdefault(qid, []).append(
-                        {'name': r['brand_name'], 'count': int(r['cnt'])}
-                    )
-
-        gaps = []
-        weak = []
-        for r in rows:
-            qid = str(r['id'])
-            own = int(r['own_m'] or 0)
-            comp = int(r['comp_m'] or 0)
-            entry = {
-                'id': qid,
-                'text': r['text'],
-                'category': r['category'],
-                'intent': r['intent'],
-                'responses': int(r['responses']),
-                'own_mentions': own,
-                'competitor_mentions': comp,
-                'top_competitors': top_brands_per_query.get(qid, [])[:3],
-            }
-            if own == 0 and comp > 0:
-                gaps.append(entry)
-            elif comp > own and own > 0:
-                weak.append(entry)
-
-        return resp(200, {
-            'gaps': gaps[:20],            # совсем нас нет
-            'weak_spots': weak[:20],      # есть, но проигрываем
-            'window_days': days,
-        })
-    finally:
-        conn.close()
\ No newline at end of file
+
+    gaps = []
+    weak = []
+    for r in rows:
+        qid = str(r['id'])
+        own = int(r['own_m'] or 0)
+        comp = int(r['comp_m'] or 0)
+        entry = {
+            'id': qid,
+            'text': r['text'],
+            'category': r['category'],
+            'intent': r['intent'],
+            'responses': int(r['responses']),
+            'own_mentions': own,
+            'competitor_mentions': comp,
+            'top_competitors': top_brands_per_query.get(qid, [])[:3],
+        }
+        if own == 0 and comp > 0:
+            gaps.append(entry)
+        elif comp > own and own > 0:
+            weak.append(entry)
+
+    return resp(200, {
+        'gaps': gaps[:20],            # совсем нас нет
+        'weak_spots': weak[:20],      # есть, но проигрываем
+        'window_days': days,
+    })
\ No newline at end of file
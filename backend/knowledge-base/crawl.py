@@ -0,0 +1,105 @@
+"""Массовый импорт страниц в базу знаний: нормализация URL, разбор sitemap.xml и вежливые лимиты на хост"""
+
+import threading
+import time
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+from xml.etree import ElementTree
+
+MAX_BULK_URLS = 500
+MAX_SITEMAP_BYTES = 10 * 1024 * 1024
+MAX_NESTED_SITEMAPS = 20
+SITEMAP_TIMEOUT = 15
+
+HOST_CONCURRENCY = 2
+HOST_MIN_INTERVAL = 0.5
+
+# Только точные имена: у «from», «ref» и им подобных бывает смысловая нагрузка. Префиксом отбрасывается лишь utm_
+TRACKING_PARAMS = {'yclid', 'ysclid', 'gclid', 'fbclid', 'msclkid', '_openstat'}
+TRACKING_PREFIX = 'utm_'
+
+
+def normalize_url(url):
+    """Канонический вид URL для дедупликации: без фрагмента, трекинговых параметров, порта по умолчанию и хвостового «/»"""
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and not ((scheme == 'http' and parts.port == 80) or (scheme == 'https' and parts.port == 443)):
+        host = f'{host}:{parts.port}'
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/')
+    query = urllib.parse.urlencode(sorted(
+        (k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith(TRACKING_PREFIX)
+    ))
+    return urllib.parse.urlunsplit((scheme, host, path, query, ''))
+
+
+def _sitemap_locs(url):
+    """(<loc> страниц, <loc> вложенных sitemap) одного файла. XML разбирается потоково"""
+    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    pages, nested = [], []
+    with urllib.request.urlopen(req, timeout=SITEMAP_TIMEOUT) as resp:
+        parser = ElementTree.XMLPullParser(events=('end',))
+        read = 0
+        while read < MAX_SITEMAP_BYTES and len(pages) < MAX_BULK_URLS:
+            chunk = resp.read(64 * 1024)
+            if not chunk:
+                break
+            read += len(chunk)
+            parser.feed(chunk)
+            for _, elem in parser.read_events():
+                tag = elem.tag.rsplit('}', 1)[-1]
+                if tag == 'loc' and elem.text:
+                    pages.append(elem.text.strip())
+                elif tag == 'sitemap' and pages:
+                    # <sitemap><loc> — ссылка на вложенный файл, а не на страницу
+                    nested.append(pages.pop())
+                elif tag in ('url', 'sitemap'):
+                    elem.clear()
+    return pages, nested
+
+
+def sitemap_urls(url, limit=MAX_BULK_URLS):
+    """URL страниц из sitemap.xml, включая sitemap index (один уровень вложенности)"""
+    pages, nested = _sitemap_locs(url)
+    for sub in nested[:MAX_NESTED_SITEMAPS]:
+        if len(pages) >= limit:
+            break
+        try:
+            sub_pages, _ = _sitemap_locs(sub)
+        except Exception as e:
+            print(f'[SITEMAP] {sub}: {e}')
+            continue
+        pages.extend(sub_pages)
+    return pages[:limit]
+
+
+class HostLimiter:
+    """Не больше HOST_CONCURRENCY одновременных запросов к одному хосту и не чаще раза в HOST_MIN_INTERVAL секунд"""
+
+    def __init__(self, concurrency=HOST_CONCURRENCY, min_interval=HOST_MIN_INTERVAL):
+        self.concurrency = concurrency
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._next_at = {}
+
+    @contextmanager
+    def slot(self, url):
+        host = (urllib.parse.urlsplit(url).hostname or '').lower()
+        with self._lock:
+            sem = self._slots.setdefault(host, threading.Semaphore(self.concurrency))
+        with sem:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_at.get(host, now))
+                self._next_at[host] = start + self.min_interval
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+
+host_limiter = HostLimiter()
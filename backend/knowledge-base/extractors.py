@@ -0,0 +1,531 @@
+"""Потоковое извлечение текста из источников базы знаний (HTML, PDF, DOCX) с ограничением по объёму"""
+
+import base64
+import codecs
+import io
+import re
+import urllib.request
+import zipfile
+import zlib
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+
+FETCH_CHUNK = 64 * 1024
+MAX_FETCH_BYTES = 5 * 1024 * 1024
+FETCH_TIMEOUT = 15
+
+_CHARSET = re.compile(r'charset=([\w-]+)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+# Содержимое этих тегов не попадает в текст
+SKIP_TAGS = {'script', 'style', 'noscript', 'svg', 'template', 'iframe', 'canvas', 'nav', 'footer', 'aside', 'form', 'button', 'select'}
+# Эти теги закрывают текстовый блок
+BLOCK_TAGS = {
+    'p', 'div', 'section', 'article', 'main', 'header', 'li', 'ul', 'ol', 'dl', 'dt', 'dd',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'tr', 'td', 'th', 'blockquote', 'pre', 'br', 'hr',
+}
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+
+class HtmlTextExtractor(HTMLParser):
+    """HTML → текст блоками. Кормится кусками через feed(); full становится True, когда набран max_chars"""
+
+    def __init__(self, max_chars):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.title = ''
+        self.blocks = []
+        self.length = 0
+        self.full = False
+        self._skip_depth = 0
+        self._in_title = False
+        self._buf = []
+        self._buf_len = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag == 'title':
+            self._in_title = True
+        elif tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag == 'title':
+            self._in_title = False
+        elif tag in BLOCK_TAGS:
+            self._flush(heading=tag in HEADING_TAGS)
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip_depth and not self.full:
+            self._buf.append(data)
+            self._buf_len += len(data)
+            if self._buf_len > self.max_chars:
+                self._flush()
+
+    def _flush(self, heading=False):
+        text = _SPACES.sub(' ', ''.join(self._buf)).strip()
+        self._buf = []
+        self._buf_len = 0
+        if not text or self.full:
+            return
+        if heading and not text.endswith(('.', '!', '?', ':')):
+            text += '.'
+        room = self.max_chars - self.length
+        if room <= 0:
+            self.full = True
+            return
+        if len(text) >= room:
+            text = text[:room]
+            self.full = True
+        self.blocks.append(text)
+        self.length += len(text) + 2
+
+    def text(self):
+        self._flush()
+        return '\n\n'.join(self.blocks)
+
+
+def extract_text_from_url(url, max_chars):
+    """Извлекает заголовок и текст страницы, читая ответ кусками.
+    Чтение прекращается, как только набран max_chars символов текста или прочитано MAX_FETCH_BYTES байт."""
+    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    parser = HtmlTextExtractor(max_chars)
+    try:
+        with urllib.request.urlopen(req, timeout=FETCH_TIMEOUT) as resp:
+            match = _CHARSET.search(resp.headers.get('Content-Type', ''))
+            try:
+                decoder = codecs.getincrementaldecoder(match.group(1) if match else 'utf-8')(errors='ignore')
+            except LookupError:
+                decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+            read = 0
+            while read < MAX_FETCH_BYTES and not parser.full:
+                chunk = resp.read(min(FETCH_CHUNK, MAX_FETCH_BYTES - read))
+                if not chunk:
+                    break
+                read += len(chunk)
+                parser.feed(decoder.decode(chunk))
+            parser.feed(decoder.decode(b'', final=True))
+    except Exception as e:
+        return None, str(e)
+
+    try:
+        parser.close()
+    except Exception:
+        pass
+    title = _SPACES.sub(' ', parser.title).strip() or url
+    return {'title': title, 'text': parser.text()}, None
+
+
+# --- PDF ---
+
+PDF_MAX_STREAM_BYTES = 8 * 1024 * 1024
+PDF_INFLATE_CHUNK = 64 * 1024
+PDF_MAX_DICT_BYTES = 8 * 1024
+
+_PDF_STREAM = re.compile(rb'(?<!end)stream\r?\n')
+_PDF_OBJ = re.compile(rb'(\d+)\s+\d+\s+obj\b')
+_PDF_SKIP_DICT = re.compile(rb'/Subtype\s*/Image|/Type\s*/XRef|/Length1|/Length2|/Length3|/Subtype\s*/Type1C|/Subtype\s*/CIDFontType0C|/Subtype\s*/OpenType|/Type\s*/EmbeddedFile')
+_PDF_FILTER = re.compile(rb'/Filter\s*(\[[^\]]*\]|/\w+)')
+_PDF_NAME = re.compile(rb'/(\w+)')
+_PDF_LENGTH = re.compile(rb'/Length\s+(\d+)(?!\s+\d+\s+R)')
+_PDF_FIRST = re.compile(rb'/First\s+(\d+)')
+_PDF_FONT_RES = re.compile(rb'/Font(?![\w+#.-])\s*(?:<<(.*?)>>|(\d+)\s+\d+\s+R)', re.DOTALL)
+_PDF_RESOURCES_REF = re.compile(rb'/Resources\s+(\d+)\s+\d+\s+R')
+_PDF_CONTENTS = re.compile(rb'/Contents\s*(?:\[([^\]]*)\]|(\d+)\s+\d+\s+R)')
+_PDF_TOUNICODE = re.compile(rb'/ToUnicode\s+(\d+)\s+\d+\s+R')
+_PDF_NAMED_REF = re.compile(rb'/([^\s()<>\[\]{}/%]+)\s+(\d+)\s+\d+\s+R')
+_PDF_REF = re.compile(rb'(\d+)\s+\d+\s+R')
+_CMAP_CODESPACE = re.compile(rb'begincodespacerange\s*<([0-9A-Fa-f]+)>')
+_CMAP_BFCHAR = re.compile(rb'beginbfchar(.*?)endbfchar', re.DOTALL)
+_CMAP_BFRANGE = re.compile(rb'beginbfrange(.*?)endbfrange', re.DOTALL)
+_CMAP_HEX = re.compile(rb'<([0-9A-Fa-f]*)>|\[([^\]]*)\]')
+
+_PDF_ESCAPES = {ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t', ord('b'): b'\b', ord('f'): b'\f',
+                ord('('): b'(', ord(')'): b')', ord('\\'): b'\\'}
+_PDF_DELIMS = b'()<>[]{}/%'
+_PDF_WS = b' \t\r\n\x00\x0c'
+
+
+def _pdf_streams(data):
+    """(номер объекта, словарь объекта, сырые байты потока) для каждого потока, кроме картинок, шрифтов и служебных"""
+    for m in _PDF_STREAM.finditer(data):
+        start = m.end()
+        obj = None
+        for obj in _PDF_OBJ.finditer(data, max(0, m.start() - 2048), m.start()):
+            pass
+        head = data[obj.end() if obj else max(0, m.start() - 2048):m.start()]
+        if b'<<' not in head or _PDF_SKIP_DICT.search(head):
+            continue
+        length = _PDF_LENGTH.search(head)
+        end = start + int(length.group(1)) if length else -1
+        if end < 0 or data[end:end + 32].lstrip()[:9] != b'endstream':
+            end = data.find(b'endstream', start)
+        if end < 0:
+            continue
+        yield int(obj.group(1)) if obj else None, head, data[start:end]
+
+
+def _pdf_object_dicts(data):
+    """Словари объектов верхнего уровня: номер → байты от obj до stream/endobj (не больше PDF_MAX_DICT_BYTES)"""
+    objects = {}
+    for m in _PDF_OBJ.finditer(data):
+        body = data[m.end():m.end() + PDF_MAX_DICT_BYTES]
+        for stop in (b'stream', b'endobj'):
+            pos = body.find(stop)
+            if pos >= 0:
+                body = body[:pos]
+        objects[int(m.group(1))] = body
+    return objects
+
+
+def _pdf_objstm(head, content):
+    """Объекты из потока объектов (/Type /ObjStm): номер → байты объекта"""
+    first = _PDF_FIRST.search(head)
+    if not first:
+        return {}
+    first = int(first.group(1))
+    try:
+        nums = [int(x) for x in content[:first].split()]
+    except ValueError:
+        return {}
+    pairs = list(zip(nums[0::2], nums[1::2]))
+    objects = {}
+    for k, (num, offset) in enumerate(pairs):
+        end = pairs[k + 1][1] if k + 1 < len(pairs) else len(content) - first
+        objects[num] = content[first + offset:first + end]
+    return objects
+
+
+def _pdf_inflate(raw):
+    """Распаковывает FlateDecode кусками, не выходя за PDF_MAX_STREAM_BYTES распакованных байт"""
+    inflater = zlib.decompressobj()
+    out = []
+    size = 0
+    try:
+        for pos in range(0, len(raw), PDF_INFLATE_CHUNK):
+            part = inflater.decompress(raw[pos:pos + PDF_INFLATE_CHUNK], PDF_MAX_STREAM_BYTES - size)
+            out.append(part)
+            size += len(part)
+            if size >= PDF_MAX_STREAM_BYTES or inflater.eof:
+                break
+    except zlib.error:
+        pass
+    return b''.join(out)
+
+
+def _pdf_decode_stream(head, raw):
+    """Применяет цепочку /Filter. Потоки с неподдерживаемыми фильтрами (картинки, LZW и т.п.) пропускаются"""
+    filters = _PDF_FILTER.search(head)
+    names = _PDF_NAME.findall(filters.group(1)) if filters else []
+    for name in names:
+        if name in (b'FlateDecode', b'Fl'):
+            raw = _pdf_inflate(raw)
+        elif name in (b'ASCII85Decode', b'A85'):
+            body = raw.strip()
+            body = body[2:] if body.startswith(b'<~') else body
+            body = body[:-2] if body.endswith(b'~>') else body
+            try:
+                raw = base64.a85decode(bytes(b for b in body if b not in _PDF_WS))
+            except ValueError:
+                return b''
+        elif name in (b'ASCIIHexDecode', b'AHx'):
+            body = bytes(b for b in raw.split(b'>')[0] if b not in _PDF_WS)
+            try:
+                raw = bytes.fromhex((body + b'0' * (len(body) % 2)).decode('ascii'))
+            except ValueError:
+                return b''
+        else:
+            return b''
+    return raw
+
+
+def _pdf_literal(buf, i):
+    """Литеральная строка (...) со вложенными скобками и escape-последовательностями. Возвращает (bytes, позиция после)"""
+    out = bytearray()
+    depth = 1
+    n = len(buf)
+    while i < n:
+        c = buf[i]
+        if c == 0x5C and i + 1 < n:
+            nxt = buf[i + 1]
+            if nxt in _PDF_ESCAPES:
+                out += _PDF_ESCAPES[nxt]
+                i += 2
+            elif 0x30 <= nxt <= 0x37:
+                j = i + 1
+                while j < n and j < i + 4 and 0x30 <= buf[j] <= 0x37:
+                    j += 1
+                out.append(int(buf[i + 1:j], 8) & 0xFF)
+                i = j
+            else:
+                i += 2 if nxt in b'\r\n' else 1
+            continue
+        if c == 0x28:
+            depth += 1
+        elif c == 0x29:
+            depth -= 1
+            if depth == 0:
+                return bytes(out), i + 1
+        out.append(c)
+        i += 1
+    return bytes(out), i
+
+
+def _pdf_text_ops(content):
+    """Разбирает поток содержимого и выдаёт строки-операнды текстовых операторов, ' ' и '\\n' как разделители"""
+    i = 0
+    n = len(content)
+    operands = []
+    in_array = False
+    while i < n:
+        c = content[i]
+        if c in _PDF_WS:
+            i += 1
+        elif c == 0x25:  # комментарий
+            j = content.find(b'\n', i)
+            i = n if j < 0 else j + 1
+        elif c == 0x28:
+            s, i = _pdf_literal(content, i + 1)
+            operands.append(s)
+        elif c == 0x2F:
+            j = i + 1
+            while j < n and content[j] not in _PDF_WS and content[j] not in _PDF_DELIMS:
+                j += 1
+            operands.append(('name', content[i + 1:j]))
+            i = j
+        elif c == 0x3C and content[i + 1:i + 2] != b'<':
+            j = content.find(b'>', i)
+            j = n if j < 0 else j
+            hexs = bytes(b for b in content[i + 1:j] if b not in _PDF_WS)
+            if len(hexs) % 2:
+                hexs += b'0'
+            try:
+                operands.append(('hex', bytes.fromhex(hexs.decode('ascii'))))
+            except ValueError:
+                pass
+            i = j + 1
+        elif c == 0x5B:
+            in_array = True
+            i += 1
+        elif c == 0x5D:
+            in_array = False
+            i += 1
+        elif c in _PDF_DELIMS:
+            i += 1
+            if c == 0x3C or c == 0x3E:
+                i += 1 if content[i:i + 1] in (b'<', b'>') else 0
+        else:
+            j = i
+            while j < n and content[j] not in _PDF_WS and content[j] not in _PDF_DELIMS:
+                j += 1
+            token = content[i:j]
+            i = j
+            if in_array:
+                # большой отрицательный кернинг внутри TJ — это пробел между словами
+                try:
+                    if float(token) < -200:
+                        operands.append(' ')
+                except ValueError:
+                    pass
+                continue
+            if token[:1] in b'+-.0123456789':
+                continue  # число — операнд (размер шрифта в Tf и т.п.), а не оператор
+            if token in (b'Tj', b'TJ', b"'", b'"'):
+                if token in (b"'", b'"'):
+                    yield '\n'
+                for op in operands:
+                    if not (isinstance(op, tuple) and op[0] == 'name'):
+                        yield op
+            elif token == b'Tf':
+                names = [op[1] for op in operands if isinstance(op, tuple) and op[0] == 'name']
+                if names:
+                    yield ('font', names[-1])
+            elif token in (b'T*', b'Td', b'TD', b'ET'):
+                yield '\n' if token != b'Td' else ' '
+            operands = []
+
+
+def _pdf_cmap(content):
+    """ToUnicode CMap шрифта: (код → unicode, ширина кода в hex-цифрах — 2 или 4)"""
+    cmap = {}
+
+    def uni(h):
+        try:
+            return bytes.fromhex(h.decode('ascii')).decode('utf-16-be', errors='ignore')
+        except ValueError:
+            return ''
+
+    for block in _CMAP_BFCHAR.findall(content):
+        items = [m.group(1) for m in _CMAP_HEX.finditer(block) if m.group(1) is not None]
+        for src, dst in zip(items[0::2], items[1::2]):
+            cmap[src.upper()] = uni(dst)
+    for block in _CMAP_BFRANGE.findall(content):
+        tokens = list(_CMAP_HEX.finditer(block))
+        for k in range(0, len(tokens) - 2, 3):
+            lo, hi, dst = tokens[k].group(1), tokens[k + 1].group(1), tokens[k + 2]
+            if lo is None or hi is None:
+                continue
+            width = len(lo)
+            lo_i, hi_i = int(lo, 16), int(hi, 16)
+            if hi_i - lo_i > 0xFFFF:
+                continue
+            if dst.group(1) is not None:
+                base = int(dst.group(1) or b'0', 16)
+                for code in range(lo_i, hi_i + 1):
+                    cmap[b'%0*X' % (width, code)] = chr(base + code - lo_i) if base + code - lo_i < 0x110000 else ''
+            else:
+                dsts = [d for d in re.findall(rb'<([0-9A-Fa-f]*)>', dst.group(2))]
+                for code, d in zip(range(lo_i, hi_i + 1), dsts):
+                    cmap[b'%0*X' % (width, code)] = uni(d)
+    space = _CMAP_CODESPACE.search(content)
+    if space:
+        width = len(space.group(1))
+    else:
+        width = max((len(k) for k in cmap), default=2)
+    return cmap, 4 if width > 2 else 2
+
+
+def _pdf_font_maps(objects, cmaps):
+    """Карты шрифтов по имени ресурса (/F1 → (cmap, ширина)): для каждого потока содержимого
+    (по /Contents страниц и по самим Form XObject) и общая по документу — для унаследованных ресурсов"""
+    def named(fonts):
+        out = {}
+        for name, ref in _PDF_NAMED_REF.findall(fonts):
+            to_unicode = _PDF_TOUNICODE.search(objects.get(int(ref), b''))
+            # шрифт без ToUnicode (стандартный Type1 с WinAnsi) декодируется как однобайтовый
+            out[name] = cmaps.get(int(to_unicode.group(1)), ({}, 2)) if to_unicode else ({}, 2)
+        return out
+
+    by_stream = {}
+    shared = {}
+    for num, body in objects.items():
+        resources = _PDF_RESOURCES_REF.search(body)
+        font_res = _PDF_FONT_RES.search(objects.get(int(resources.group(1)), b'') if resources else body)
+        if not font_res:
+            continue
+        fonts = named(font_res.group(1) if font_res.group(1) is not None
+                      else objects.get(int(font_res.group(2)), b''))
+        for name, font in fonts.items():
+            shared.setdefault(name, font)
+        by_stream[num] = fonts
+        contents = _PDF_CONTENTS.search(body)
+        if contents:
+            refs = _PDF_REF.findall(contents.group(1)) if contents.group(1) is not None else [contents.group(2)]
+            for ref in refs:
+                by_stream[int(ref)] = fonts
+    return by_stream, shared
+
+
+def _pdf_decode(op, cmap, width):
+    if isinstance(op, str):
+        return op
+    raw = op[1] if isinstance(op, tuple) else op
+    if raw.startswith(b'\xfe\xff'):
+        return raw[2:].decode('utf-16-be', errors='ignore')
+    if cmap:
+        step = width // 2
+        hexs = raw.hex().upper().encode('ascii')
+        out = []
+        for k in range(0, len(hexs), width):
+            code = hexs[k:k + width]
+            if code in cmap:
+                out.append(cmap[code])
+            elif step == 1:
+                out.append(chr(raw[k // 2]))
+        if out:
+            return ''.join(out)
+    return raw.decode('cp1252', errors='ignore')
+
+
+def extract_pdf_text(data, max_chars):
+    """Текст PDF: FlateDecode-потоки распаковываются по кускам, из потоков содержимого берутся операнды
+    Tj/TJ/'/\", коды глифов переводятся через ToUnicode CMap шрифта, выбранного оператором Tf.
+    Разбор останавливается на max_chars символах."""
+    objects = _pdf_object_dicts(data)
+    cmaps = {}
+    pending = []
+    pending_bytes = 0
+    for num, head, raw in _pdf_streams(data):
+        content = _pdf_decode_stream(head, raw)
+        if not content:
+            continue
+        if b'/ObjStm' in head:
+            objects.update(_pdf_objstm(head, content))
+            continue
+        if b'begincmap' in content:
+            cmaps[num] = _pdf_cmap(content)
+            continue
+        if b'BT' not in content:
+            continue
+        ops = list(_pdf_text_ops(content))
+        pending.append((num, ops))
+        pending_bytes += sum(len(op[1]) if isinstance(op, tuple) else len(op) for op in ops)
+        # ToUnicode-карты и словари шрифтов могут идти после страниц, поэтому операнды декодируются в конце;
+        # объём копим только с запасом относительно max_chars
+        if pending_bytes > max_chars * 4:
+            break
+
+    by_stream, shared = _pdf_font_maps(objects, cmaps)
+    # Шрифт не нашёлся в ресурсах (битые ссылки, нестандартная структура) — общая карта всех ToUnicode
+    merged = {}
+    for cmap, _ in cmaps.values():
+        merged.update(cmap)
+    fallback = (merged, 4 if any(width == 4 for _, width in cmaps.values()) else 2)
+    current = fallback
+    parts = []
+    for num, ops in pending:
+        fonts = by_stream.get(num, shared)
+        for op in ops:
+            if isinstance(op, tuple) and op[0] == 'font':
+                current = fonts.get(op[1]) or shared.get(op[1]) or fallback
+                continue
+            parts.append(_pdf_decode(op, *current))
+    text = ''.join(parts)
+    text = re.sub(r'[^\S\n]+', ' ', text)
+    text = re.sub(r'\s*\n\s*', '\n', text).strip()
+    return text[:max_chars]
+
+
+# --- DOCX ---
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def extract_docx_text(data, max_chars):
+    """Текст DOCX: word/document.xml читается потоково через iterparse, разобранные элементы сразу освобождаются"""
+    parts = []
+    length = 0
+    paragraph = []
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        with z.open('word/document.xml') as xml:
+            for event, elem in ElementTree.iterparse(xml, events=('end',)):
+                tag = elem.tag
+                if tag == _W + 't':
+                    paragraph.append(elem.text or '')
+                elif tag == _W + 'tab':
+                    paragraph.append('\t')
+                elif tag in (_W + 'br', _W + 'cr'):
+                    paragraph.append('\n')
+                elif tag == _W + 'p':
+                    text = ''.join(paragraph).strip()
+                    paragraph = []
+                    if text:
+                        parts.append(text)
+                        length += len(text) + 2
+                    elem.clear()
+                    if length >= max_chars:
+                        break
+                elif tag == _W + 'body':
+                    elem.clear()
+    if paragraph:
+        parts.append(''.join(paragraph).strip())
+    return '\n\n'.join(parts)[:max_chars]
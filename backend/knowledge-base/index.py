@@ -2,11 +2,21 @@
 import json
 import os
 import base64
-import re
+import hashlib
+import hmac
+import time
+import unicodedata
 import urllib.request
-import urllib.error
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
 
+from psycopg2.extras import execute_values
+
+from storage import upload_bytes_async, download_bytes, key_from_cdn_url
+from crawl import normalize_url, sitemap_urls, host_limiter, MAX_BULK_URLS
+from extractors import extract_text_from_url, extract_pdf_text, extract_docx_text
+from retrieval import index_source, copy_chunks, search_chunks, DEFAULT_TOP_K, DEFAULT_MAX_CHARS
+
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
@@ -17,6 +27,29 @@ CORS_HEADERS = {
 }
 
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+# В knowledge_sources.content хранится превью, полный текст (до MAX_INDEX_CHARS) уходит в knowledge_chunks
+MAX_TEXT_CHARS = 50000
+MAX_INDEX_CHARS = 1000000
+MAX_FILE_BYTES = 50 * 1024 * 1024
+
+SELF_URL = 'https://functions.poehali.dev/236ece2b-8750-483b-b84f-5d1e118c869e'
+# Общий секрет служебных вызовов (_internal): воркер очереди будят только сама функция и cron-триггер
+INTERNAL_KEY = os.environ.get('INTERNAL_KEY', '')
+# Очередь загрузки: воркер берёт pending-источники пачками и обрабатывает их параллельно
+INGEST_WORKERS = 8
+INGEST_BATCH = INGEST_WORKERS * 2
+# Худший случай на один источник: ожидание слота хоста, FETCH_TIMEOUT на чтения, извлечение и индексация.
+# Аренда при захвате покрывает всю пачку (строки ждут своей очереди в пуле), при старте строки — продлевается
+INGEST_ROW_SECONDS = 120
+INGEST_LEASE_SECONDS = INGEST_ROW_SECONDS * (INGEST_BATCH // INGEST_WORKERS)
+INGEST_MAX_ATTEMPTS = 3
+INGEST_DEADLINE = 25
+# Список источников опрашивается каждые несколько секунд: воркер будится из GET только при зависшей очереди
+# (pending дольше INGEST_STALL_SECONDS или истёкшая аренда) и не чаще раза в KICK_MIN_INTERVAL на процесс
+INGEST_STALL_SECONDS = 60
+KICK_MIN_INTERVAL = 30
+
+_last_kick = 0.0
 
 
 def get_db():
@@ -25,92 +58,249 @@ def get_db():
     return conn
 
 
-def extract_text_from_url(url):
-    """Извлекает текст с веб-страницы"""
-    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-    try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            html = resp.read().decode('utf-8', errors='ignore')
-    except Exception as e:
-        return None, str(e)
-
-    html = re.sub(r'<script[^>]*>.*?</script>', '', html, flags=re.DOTALL | re.IGNORECASE)
-    html = re.sub(r'<style[^>]*>.*?</style>', '', html, flags=re.DOTALL | re.IGNORECASE)
-    html = re.sub(r'<[^>]+>', ' ', html)
-    html = re.sub(r'\s+', ' ', html).strip()
-
-    title_match = re.search(r'<title[^>]*>(.*?)</title>', html, re.IGNORECASE | re.DOTALL)
-    title = title_match.group(1).strip() if title_match else url
-
-    text = html[:50000]
-    return {'title': title, 'text': text}, None
-
-
-def extract_text_from_file(file_data_b64, file_type):
-    """Извлекает текст из файла (base64)"""
-    try:
-        data = base64.b64decode(file_data_b64)
-    except Exception as e:
-        return None, f'Ошибка декодирования файла: {e}'
-
+def extract_text_from_file(data, file_type):
+    """Извлекает текст из содержимого файла"""
     if file_type in ('txt', 'text/plain'):
         text = data.decode('utf-8', errors='ignore')
-        return {'text': text[:50000]}, None
+        return {'text': text[:MAX_INDEX_CHARS]}, None
 
     if file_type in ('csv', 'text/csv'):
         text = data.decode('utf-8', errors='ignore')
-        return {'text': text[:50000]}, None
+        return {'text': text[:MAX_INDEX_CHARS]}, None
 
     if file_type in ('pdf', 'application/pdf'):
-        text_parts = []
-        raw = data.decode('latin-1')
-        streams = re.findall(r'stream\s(.*?)endstream', raw, re.DOTALL)
-        for stream in streams:
-            clean = re.sub(r'[^\x20-\x7E\xC0-\xFF]', ' ', stream)
-            text_parts.append(clean)
-        text = ' '.join(text_parts)
-        text = re.sub(r'\s+', ' ', text).strip()
+        try:
+            text = extract_pdf_text(data, MAX_INDEX_CHARS)
+        except Exception as e:
+            return None, f'Ошибка чтения PDF: {e}'
         if len(text) < 50:
-            return {'text': f'[PDF документ, {len(data)} байт — текст не удалось извлечь полностью. Загрузите TXT версию для лучшего результата.]'}, None
-        return {'text': text[:50000]}, None
+            return {'text': f'[PDF документ, {len(data)} байт — текст не удалось извлечь (возможно, это скан). Загрузите TXT версию для лучшего результата.]'}, None
+        return {'text': text}, None
 
     if file_type in ('docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'):
-        import zipfile
-        import io
         try:
-            z = zipfile.ZipFile(io.BytesIO(data))
-            xml = z.read('word/document.xml').decode('utf-8', errors='ignore')
-            text = re.sub(r'<[^>]+>', ' ', xml)
-            text = re.sub(r'\s+', ' ', text).strip()
-            return {'text': text[:50000]}, None
+            return {'text': extract_docx_text(data, MAX_INDEX_CHARS)}, None
         except Exception as e:
             return None, f'Ошибка чтения DOCX: {e}'
 
     return None, f'Неподдерживаемый формат: {file_type}'
 
 
-def upload_to_s3(file_data_b64, filename):
-    """Загружает файл в S3 и возвращает CDN URL"""
-    import boto3
-    data = base64.b64decode(file_data_b64)
-    s3 = boto3.client(
-        's3',
-        endpoint_url='https://bucket.poehali.dev',
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-    )
-    key = f'knowledge/{filename}'
+def content_fingerprint(text):
+    """SHA-256 нормализованного текста (NFKC, нижний регистр, схлопнутые пробелы) — ключ дедупликации источников бота"""
+    normalized = ' '.join(unicodedata.normalize('NFKC', text).lower().split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def upload_to_s3(data, file_hash, ext):
+    """Запускает загрузку файла в S3 в фоне и возвращает Future с CDN URL.
+    Ключ адресуется содержимым, поэтому одинаковые файлы разных ботов лежат одним объектом"""
+    key = f'knowledge/sha256/{file_hash}.{ext}'
     content_type = 'application/octet-stream'
-    if filename.endswith('.pdf'):
+    if ext == 'pdf':
         content_type = 'application/pdf'
-    elif filename.endswith('.txt'):
+    elif ext == 'txt':
         content_type = 'text/plain'
-    elif filename.endswith('.docx'):
+    elif ext == 'docx':
         content_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
 
-    s3.put_object(Bucket='files', Key=key, Body=data, ContentType=content_type)
-    cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
-    return cdn_url
+    return upload_bytes_async(data, key, content_type)
+
+
+def internal_authorized(event):
+    """Служебный вызов (_internal) разрешён только с X-Internal-Key, совпадающим с INTERNAL_KEY.
+    Если секрет не задан, служебные вызовы отклоняются"""
+    if not INTERNAL_KEY:
+        return False
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    return hmac.compare_digest(headers.get('x-internal-key') or '', INTERNAL_KEY)
+
+
+def kick_worker():
+    """Будит воркер очереди отдельным вызовом функции. Ответа не ждём: вызов продолжает работу и после разрыва соединения"""
+    payload = json.dumps({'_internal': 'process_queue'}).encode('utf-8')
+    req = urllib.request.Request(
+        SELF_URL, data=payload, headers={'Content-Type': 'application/json', 'X-Internal-Key': INTERNAL_KEY}
+    )
+    try:
+        urllib.request.urlopen(req, timeout=1)
+    except Exception:
+        pass
+
+
+def kick_if_stalled():
+    """kick_worker для GET-опроса: запись сама будит воркер, здесь — только подстраховка с ограничением частоты"""
+    global _last_kick
+    now = time.monotonic()
+    if now - _last_kick < KICK_MIN_INTERVAL:
+        return
+    _last_kick = now
+    kick_worker()
+
+
+def renew_lease(cur, src_id):
+    """Продлевает аренду, когда строка пачки реально взята в работу"""
+    cur.execute(
+        f"UPDATE {SCHEMA}.knowledge_sources SET locked_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second' "
+        f"WHERE id = %s AND status = 'processing'",
+        (INGEST_ROW_SECONDS, src_id)
+    )
+
+
+def claim_sources(cur, limit):
+    """Берёт в работу pending-источники и источники с истёкшей арендой (упавший воркер)"""
+    cur.execute(
+        f"UPDATE {SCHEMA}.knowledge_sources SET status = 'processing', attempts = attempts + 1, "
+        f"locked_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second', updated_at = CURRENT_TIMESTAMP "
+        f"WHERE id IN (SELECT id FROM {SCHEMA}.knowledge_sources "
+        f"WHERE (status = 'pending' OR (status = 'processing' AND locked_until < CURRENT_TIMESTAMP)) "
+        f"AND attempts < %s ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED) "
+        f"RETURNING id, bot_id, source_type, url, file_url, file_type, title, file_hash",
+        (INGEST_LEASE_SECONDS, INGEST_MAX_ATTEMPTS, limit)
+    )
+    return cur.fetchall()
+
+
+def _mark_error(cur, src_id, message):
+    # status = 'processing' — источник могли удалить, пока он качался
+    cur.execute(
+        f"UPDATE {SCHEMA}.knowledge_sources SET status = 'error', error_message = %s, locked_until = NULL, "
+        f"updated_at = CURRENT_TIMESTAMP WHERE id = %s AND status = 'processing'",
+        (message[:1000], src_id)
+    )
+
+
+def _find_duplicate(cur, bot_id, content_hash, src_id):
+    cur.execute(
+        f"SELECT id FROM {SCHEMA}.knowledge_sources WHERE bot_id = %s AND content_hash = %s AND id <> %s LIMIT 1",
+        (bot_id, content_hash, src_id)
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def ingest_source(row):
+    """Скачивает и извлекает текст одного источника, индексирует чанки и переводит его в ready/error"""
+    src_id, bot_id, source_type, url, file_url, file_type, title, file_hash = row
+    started = time.time()
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        renew_lease(cur, src_id)
+        donor = None
+        if file_hash:
+            # тот же файл уже разобран у другого бота — берём его текст и чанки без скачивания и векторизации
+            cur.execute(
+                f"SELECT id, content, text_length, content_hash FROM {SCHEMA}.knowledge_sources "
+                f"WHERE file_hash = %s AND status = 'ready' AND content_hash IS NOT NULL AND id <> %s LIMIT 1",
+                (file_hash, src_id)
+            )
+            donor = cur.fetchone()
+
+        if donor:
+            result, err = {'text': donor[1] or '', 'length': donor[2]}, None
+            content_hash = donor[3]
+        else:
+            if source_type == 'url':
+                with host_limiter.slot(url):
+                    result, err = extract_text_from_url(url, MAX_INDEX_CHARS)
+            else:
+                try:
+                    data = download_bytes(key_from_cdn_url(file_url), MAX_FILE_BYTES)
+                    result, err = extract_text_from_file(data, file_type)
+                except Exception as e:
+                    result, err = None, f'Ошибка чтения файла: {e}'
+            if err:
+                _mark_error(cur, src_id, err)
+                return
+            content_hash = content_fingerprint(result['text'])
+
+        duplicate = _find_duplicate(cur, bot_id, content_hash, src_id)
+        if duplicate:
+            # страница с тем же текстом уже есть (зеркало, ?page=1, http/https) — второй раз не индексируем
+            _mark_error(cur, src_id, f'Дубликат источника #{duplicate}')
+            return
+
+        text_length = result.get('length') or len(result['text'])
+        conn.autocommit = False
+        try:
+            cur.execute(
+                f"UPDATE {SCHEMA}.knowledge_sources SET status = 'ready', title = COALESCE(%s, title), content = %s, "
+                f"text_length = %s, content_hash = %s, error_message = NULL, locked_until = NULL, updated_at = CURRENT_TIMESTAMP "
+                f"WHERE id = %s AND status = 'processing' RETURNING id",
+                (result['title'][:500] if result.get('title') else None, result['text'][:MAX_TEXT_CHARS], text_length, content_hash, src_id)
+            )
+            if cur.fetchone():
+                if donor:
+                    chunks = copy_chunks(cur, SCHEMA, donor[0], src_id, bot_id)
+                else:
+                    chunks = index_source(cur, SCHEMA, src_id, bot_id, result['text'])
+                cur.execute(f"UPDATE {SCHEMA}.knowledge_sources SET chunks_count = %s WHERE id = %s", (chunks, src_id))
+            conn.commit()
+        except psycopg2.errors.UniqueViolation:
+            # параллельный воркер успел сохранить тот же текст для этого бота
+            conn.rollback()
+            conn.autocommit = True
+            _mark_error(cur, src_id, f'Дубликат источника #{_find_duplicate(cur, bot_id, content_hash, src_id)}')
+            return
+        print(f'[INGEST] source={src_id} type={source_type} chars={text_length} '
+              f'{"copied from " + str(donor[0]) if donor else "indexed"} in {time.time() - started:.1f}s')
+    finally:
+        cur.close()
+        conn.close()
+
+
+def process_queue():
+    """Воркер очереди: обрабатывает источники пачками в INGEST_WORKERS потоков до INGEST_DEADLINE секунд.
+    Если после дедлайна в очереди что-то осталось — будит следующий вызов."""
+    started = time.time()
+    processed = 0
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as pool:
+            while time.time() - started < INGEST_DEADLINE:
+                rows = claim_sources(cur, INGEST_BATCH)
+                if not rows:
+                    break
+                for _ in pool.map(_ingest_safe, rows):
+                    processed += 1
+        cur.execute(
+            f"UPDATE {SCHEMA}.knowledge_sources SET status = 'error', error_message = 'Не удалось обработать источник', locked_until = NULL "
+            f"WHERE status IN ('pending', 'processing') AND attempts >= %s AND (locked_until IS NULL OR locked_until < CURRENT_TIMESTAMP)",
+            (INGEST_MAX_ATTEMPTS,)
+        )
+        cur.execute(f"SELECT 1 FROM {SCHEMA}.knowledge_sources WHERE status = 'pending' LIMIT 1")
+        more = cur.fetchone() is not None
+    finally:
+        cur.close()
+        conn.close()
+    if more:
+        kick_worker()
+    return {'processed': processed, 'more': more}
+
+
+def find_existing_source(cur, bot_id, condition, args):
+    """Ответ для повторного добавления: уже существующий (не удалённый и не упавший) источник бота или None"""
+    cur.execute(
+        f"SELECT id, title, status, file_url, text_length, chunks_count FROM {SCHEMA}.knowledge_sources "
+        f"WHERE bot_id = %s AND status <> 'error' AND {condition} ORDER BY id LIMIT 1",
+        (bot_id,) + args
+    )
+    r = cur.fetchone()
+    if not r:
+        return None
+    return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({
+        'id': r[0], 'title': r[1], 'status': r[2], 'file_url': r[3],
+        'text_length': r[4], 'chunks': r[5], 'duplicate_of': r[0]
+    })}
+
+
+def _ingest_safe(row):
+    try:
+        ingest_source(row)
+    except Exception as e:
+        print(f'[INGEST] source={row[0]} failed: {e}')
 
 
 def handler(event, context):
@@ -130,23 +320,42 @@ def handler(event, context):
                 return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'bot_id обязателен'})}
 
             cur.execute(
-                f"SELECT id, bot_id, source_type, title, url, file_url, file_type, status, error_message, created_at "
+                f"SELECT id, bot_id, source_type, title, url, file_url, file_type, status, error_message, created_at, "
+                f"text_length, chunks_count, "
+                f"(status = 'pending' AND created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second') "
+                f"OR (status = 'processing' AND locked_until < CURRENT_TIMESTAMP) "
                 f"FROM {SCHEMA}.knowledge_sources WHERE bot_id = %s ORDER BY created_at DESC",
-                (int(bot_id),)
+                (INGEST_STALL_SECONDS, int(bot_id))
             )
             rows = cur.fetchall()
             sources = []
+            progress = {'pending': 0, 'processing': 0, 'ready': 0, 'error': 0}
+            stalled = False
             for r in rows:
                 sources.append({
                     'id': r[0], 'bot_id': r[1], 'source_type': r[2], 'title': r[3],
                     'url': r[4], 'file_url': r[5], 'file_type': r[6],
                     'status': r[7], 'error_message': r[8],
-                    'created_at': r[9].isoformat() if r[9] else None
+                    'created_at': r[9].isoformat() if r[9] else None,
+                    'text_length': r[10], 'chunks': r[11]
                 })
-            return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({'sources': sources})}
+                if r[7] in progress:
+                    progress[r[7]] += 1
+                stalled = stalled or bool(r[12])
+            progress['total'] = len(rows)
+            if stalled:
+                kick_if_stalled()
+            return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({'sources': sources, 'progress': progress})}
 
         if method == 'POST':
             body = json.loads(event.get('body', '{}'))
+
+            if body.get('_internal') == 'process_queue':
+                if not internal_authorized(event):
+                    print('[QUEUE] Rejected _internal call without a valid X-Internal-Key')
+                    return {'statusCode': 403, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'forbidden'})}
+                return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps(process_queue())}
+
             action = body.get('action', 'add')
             bot_id = body.get('bot_id')
 
@@ -158,27 +367,64 @@ def handler(event, context):
                 if not url or not url.startswith('http'):
                     return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Некорректный URL'})}
 
-                result, err = extract_text_from_url(url)
-                if err:
-                    cur.execute(
-                        f"INSERT INTO {SCHEMA}.knowledge_sources (bot_id, source_type, title, url, status, error_message) "
-                        f"VALUES (%s, 'url', %s, %s, 'error', %s) RETURNING id",
-                        (int(bot_id), url, url, err)
-                    )
-                    src_id = cur.fetchone()[0]
-                    return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({
-                        'id': src_id, 'status': 'error', 'error': err
-                    })}
+                norm = normalize_url(url)
+                existing = find_existing_source(cur, int(bot_id), "source_type = 'url' AND url = ANY(%s)", ([url, norm],))
+                if existing:
+                    return existing
 
                 cur.execute(
-                    f"INSERT INTO {SCHEMA}.knowledge_sources (bot_id, source_type, title, url, content, status) "
-                    f"VALUES (%s, 'url', %s, %s, %s, 'ready') RETURNING id",
-                    (int(bot_id), result['title'][:500], url, result['text'])
+                    f"INSERT INTO {SCHEMA}.knowledge_sources (bot_id, source_type, title, url, status) "
+                    f"VALUES (%s, 'url', %s, %s, 'pending') RETURNING id",
+                    (int(bot_id), url[:500], url)
                 )
                 src_id = cur.fetchone()[0]
+                kick_worker()
+                return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({
+                    'id': src_id, 'status': 'pending', 'title': url[:500]
+                })}
+
+            elif action == 'add_urls':
+                urls = [u for u in (body.get('urls') or []) if isinstance(u, str) and u.strip().startswith('http')]
+                sitemap_url = (body.get('sitemap_url') or '').strip()
+                if sitemap_url:
+                    if not sitemap_url.startswith('http'):
+                        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Некорректный URL sitemap'})}
+                    try:
+                        urls.extend(sitemap_urls(sitemap_url))
+                    except Exception as e:
+                        return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': f'Не удалось прочитать sitemap: {e}'})}
+                if not urls:
+                    return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Список URL пуст'})}
+
+                cur.execute(
+                    f"SELECT url FROM {SCHEMA}.knowledge_sources WHERE bot_id = %s AND source_type = 'url' AND status <> 'error'",
+                    (int(bot_id),)
+                )
+                seen = {normalize_url(r[0]) for r in cur.fetchall() if r[0]}
+                new_urls = []
+                skipped = 0
+                for u in urls:
+                    # нормализованный URL — только ключ дедупликации; сохраняется и скачивается адрес пользователя
+                    u = u.strip()
+                    norm = normalize_url(u)
+                    if norm in seen:
+                        skipped += 1
+                        continue
+                    seen.add(norm)
+                    new_urls.append(u)
+                new_urls = new_urls[:MAX_BULK_URLS]
+
+                ids = []
+                if new_urls:
+                    ids = [r[0] for r in execute_values(
+                        cur,
+                        f"INSERT INTO {SCHEMA}.knowledge_sources (bot_id, source_type, title, url, status) VALUES %s RETURNING id",
+                        [(int(bot_id), 'url', u[:500], u, 'pending') for u in new_urls],
+                        fetch=True,
+                    )]
+                    kick_worker()
                 return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({
-                    'id': src_id, 'status': 'ready', 'title': result['title'][:500],
-                    'text_length': len(result['text'])
+                    'status': 'pending', 'ids': ids, 'queued': len(ids), 'skipped_duplicates': skipped
                 })}
 
             elif action == 'add_file':
@@ -189,31 +435,32 @@ def handler(event, context):
                 if not file_data:
                     return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Файл не передан'})}
 
-                file_url = upload_to_s3(file_data, f"{bot_id}_{file_name}")
-
+                data = base64.b64decode(file_data)
+                file_hash = hashlib.sha256(data).hexdigest()
                 ext = file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else file_type
-                result, err = extract_text_from_file(file_data, ext)
-
-                if err:
-                    cur.execute(
-                        f"INSERT INTO {SCHEMA}.knowledge_sources (bot_id, source_type, title, file_url, file_type, status, error_message) "
-                        f"VALUES (%s, 'file', %s, %s, %s, 'error', %s) RETURNING id",
-                        (int(bot_id), file_name, file_url, ext, err)
-                    )
-                    src_id = cur.fetchone()[0]
-                    return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({
-                        'id': src_id, 'status': 'error', 'error': err
-                    })}
+
+                existing = find_existing_source(cur, int(bot_id), "file_hash = %s", (file_hash,))
+                if existing:
+                    return existing
+
+                # Тот же файл уже лежит в S3 (у этого или другого бота) — повторно не загружаем
+                cur.execute(
+                    f"SELECT file_url FROM {SCHEMA}.knowledge_sources WHERE file_hash = %s AND file_url IS NOT NULL LIMIT 1",
+                    (file_hash,)
+                )
+                reused = cur.fetchone()
+                # Файл сохраняется в S3 сразу — извлечение текста делает воркер очереди
+                file_url = reused[0] if reused else upload_to_s3(data, file_hash, ext).result()
 
                 cur.execute(
-                    f"INSERT INTO {SCHEMA}.knowledge_sources (bot_id, source_type, title, file_url, file_type, content, status) "
-                    f"VALUES (%s, 'file', %s, %s, %s, %s, 'ready') RETURNING id",
-                    (int(bot_id), file_name, file_url, ext, result['text'])
+                    f"INSERT INTO {SCHEMA}.knowledge_sources (bot_id, source_type, title, file_url, file_type, file_hash, status) "
+                    f"VALUES (%s, 'file', %s, %s, %s, %s, 'pending') RETURNING id",
+                    (int(bot_id), file_name, file_url, ext, file_hash)
                 )
                 src_id = cur.fetchone()[0]
+                kick_worker()
                 return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({
-                    'id': src_id, 'status': 'ready', 'title': file_name,
-                    'text_length': len(result['text']), 'file_url': file_url
+                    'id': src_id, 'status': 'pending', 'title': file_name, 'file_url': file_url
                 })}
 
             elif action == 'add_text':
@@ -223,24 +470,47 @@ def handler(event, context):
                 if not text:
                     return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Текст не передан'})}
 
+                content_hash = content_fingerprint(text[:MAX_INDEX_CHARS])
                 cur.execute(
-                    f"INSERT INTO {SCHEMA}.knowledge_sources (bot_id, source_type, title, content, status) "
-                    f"VALUES (%s, 'text', %s, %s, 'ready') RETURNING id",
-                    (int(bot_id), title[:500], text[:50000])
+                    f"INSERT INTO {SCHEMA}.knowledge_sources (bot_id, source_type, title, content, status, text_length, content_hash) "
+                    f"VALUES (%s, 'text', %s, %s, 'ready', %s, %s) "
+                    f"ON CONFLICT (bot_id, content_hash) WHERE content_hash IS NOT NULL DO NOTHING RETURNING id",
+                    (int(bot_id), title[:500], text[:MAX_TEXT_CHARS], len(text), content_hash)
                 )
-                src_id = cur.fetchone()[0]
+                inserted = cur.fetchone()
+                if not inserted:
+                    return find_existing_source(cur, int(bot_id), "content_hash = %s", (content_hash,))
+                src_id = inserted[0]
+                chunks = index_source(cur, SCHEMA, src_id, int(bot_id), text[:MAX_INDEX_CHARS])
+                cur.execute(f"UPDATE {SCHEMA}.knowledge_sources SET chunks_count = %s WHERE id = %s", (chunks, src_id))
                 return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({
                     'id': src_id, 'status': 'ready', 'title': title[:500],
-                    'text_length': len(text)
+                    'text_length': len(text), 'chunks': chunks
                 })}
 
+            elif action == 'search':
+                question = (body.get('query') or '').strip()
+                if not question:
+                    return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'query обязателен'})}
+                k = min(max(int(body.get('k', DEFAULT_TOP_K)), 1), 20)
+                max_chars = min(max(int(body.get('max_chars', DEFAULT_MAX_CHARS)), 200), 20000)
+                mode = 'vector' if body.get('mode') == 'vector' else 'fts'
+                chunks = search_chunks(cur, SCHEMA, int(bot_id), question, k=k, max_chars=max_chars, mode=mode)
+                return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({'chunks': chunks})}
+
             return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': f'Неизвестное действие: {action}'})}
 
         if method == 'DELETE':
             source_id = params.get('id')
             if not source_id:
                 return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'id обязателен'})}
-            cur.execute(f"UPDATE {SCHEMA}.knowledge_sources SET status = 'error', error_message = 'Удалено пользователем' WHERE id = %s", (int(source_id),))
+            # Хэш текста сбрасывается, чтобы тот же текст можно было добавить заново
+            cur.execute(
+                f"UPDATE {SCHEMA}.knowledge_sources SET status = 'error', error_message = 'Удалено пользователем', "
+                f"content_hash = NULL WHERE id = %s",
+                (int(source_id),)
+            )
+            cur.execute(f"DELETE FROM {SCHEMA}.knowledge_chunks WHERE source_id = %s", (int(source_id),))
             return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': json.dumps({'ok': True})}
 
         return {'statusCode': 405, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Метод не поддержан'})}
@@ -0,0 +1,149 @@
+"""Разбивка источников базы знаний на перекрывающиеся чанки, полнотекстовый и векторный поиск по ним"""
+
+import re
+
+from psycopg2.extras import execute_values
+
+from vectors import embed_batch, to_bytes, nearest
+
+CHUNK_SIZE = 1200
+CHUNK_OVERLAP = 200
+INSERT_BATCH = 200
+DEFAULT_TOP_K = 3
+DEFAULT_MAX_CHARS = 3000
+
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+|\n{2,}')
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _pieces(text):
+    """Предложения/абзацы; слишком длинные куски режутся по CHUNK_SIZE"""
+    for piece in _SENTENCE_END.split(text):
+        piece = piece.strip()
+        while len(piece) > CHUNK_SIZE:
+            cut = piece.rfind(' ', 0, CHUNK_SIZE)
+            if cut < CHUNK_SIZE // 2:
+                cut = CHUNK_SIZE
+            yield piece[:cut].strip()
+            piece = piece[cut:].strip()
+        if piece:
+            yield piece
+
+
+def split_chunks(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Генератор чанков ~size символов по границам предложений с перекрытием ~overlap символов"""
+    buf = []
+    buf_len = 0
+    for piece in _pieces(text):
+        if buf and buf_len + len(piece) + 1 > size:
+            yield ' '.join(buf)
+            tail = []
+            tail_len = 0
+            for prev in reversed(buf):
+                if tail_len + len(prev) > overlap:
+                    break
+                tail.insert(0, prev)
+                tail_len += len(prev) + 1
+            buf, buf_len = tail, tail_len
+        buf.append(piece)
+        buf_len += len(piece) + 1
+    if buf:
+        yield ' '.join(buf)
+
+
+def index_source(cur, schema, source_id, bot_id, text):
+    """Пересобирает чанки источника. Вставка идёт пачками по мере разбивки текста. Возвращает число чанков"""
+    cur.execute(f"DELETE FROM {schema}.knowledge_chunks WHERE source_id = %s", (source_id,))
+    batch = []
+    total = 0
+    for i, chunk in enumerate(split_chunks(text)):
+        batch.append((source_id, bot_id, i, chunk))
+        if len(batch) >= INSERT_BATCH:
+            _insert_chunks(cur, schema, batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        _insert_chunks(cur, schema, batch)
+        total += len(batch)
+    return total
+
+
+def copy_chunks(cur, schema, from_source_id, source_id, bot_id):
+    """Копирует готовые чанки с векторами из другого источника с тем же содержимым. Возвращает число чанков"""
+    cur.execute(f"DELETE FROM {schema}.knowledge_chunks WHERE source_id = %s", (source_id,))
+    cur.execute(
+        f"INSERT INTO {schema}.knowledge_chunks (source_id, bot_id, chunk_index, content, embedding) "
+        f"SELECT %s, %s, chunk_index, content, embedding FROM {schema}.knowledge_chunks WHERE source_id = %s",
+        (source_id, bot_id, from_source_id)
+    )
+    return cur.rowcount
+
+
+def _insert_chunks(cur, schema, rows):
+    """Вставляет пачку чанков вместе с их векторами (векторизация тоже идёт пачкой)"""
+    vectors = embed_batch([r[3] for r in rows])
+    execute_values(
+        cur,
+        f"INSERT INTO {schema}.knowledge_chunks (source_id, bot_id, chunk_index, content, embedding) VALUES %s",
+        [r + (to_bytes(vec),) for r, vec in zip(rows, vectors)],
+        template='(%s, %s, %s, %s, %s::bytea)',
+        page_size=INSERT_BATCH,
+    )
+
+
+def _search(cur, schema, bot_id, tsquery_sql, query_arg, k):
+    cur.execute(
+        f"SELECT c.id, c.source_id, s.title, c.chunk_index, c.content, ts_rank_cd(c.tsv, q) AS rank "
+        f"FROM {schema}.knowledge_chunks c "
+        f"JOIN {schema}.knowledge_sources s ON s.id = c.source_id, {tsquery_sql} q "
+        f"WHERE c.bot_id = %s AND s.status = 'ready' AND c.tsv @@ q "
+        f"ORDER BY rank DESC LIMIT %s",
+        (query_arg, bot_id, k)
+    )
+    return cur.fetchall()
+
+
+def _search_vector(cur, schema, bot_id, question, k):
+    hits = nearest(cur, schema, bot_id, question, k)
+    if not hits:
+        return []
+    scores = dict(hits)
+    cur.execute(
+        f"SELECT c.id, c.source_id, s.title, c.chunk_index, c.content "
+        f"FROM {schema}.knowledge_chunks c JOIN {schema}.knowledge_sources s ON s.id = c.source_id "
+        f"WHERE c.id = ANY(%s)",
+        (list(scores),)
+    )
+    rows = [r + (scores[r[0]],) for r in cur.fetchall()]
+    rows.sort(key=lambda r: r[5], reverse=True)
+    return rows
+
+
+def search_chunks(cur, schema, bot_id, question, k=DEFAULT_TOP_K, max_chars=DEFAULT_MAX_CHARS, mode='fts'):
+    """Top-k чанков бота по вопросу.
+    mode='fts' — полнотекстовый: сначала все слова вопроса (AND), если пусто — любое из слов (OR).
+    mode='vector' — ближайшие соседи по локальным векторам (vectors.py).
+    Суммарный объём ограничен max_chars, чтобы в LLM уходили только релевантные 2–3 КБ."""
+    if mode == 'vector':
+        rows = _search_vector(cur, schema, bot_id, question, k)
+    else:
+        rows = _search(cur, schema, bot_id, "websearch_to_tsquery('russian', %s)", question, k)
+        if not rows:
+            words = _WORD.findall(question.lower())
+            if words:
+                rows = _search(cur, schema, bot_id, "to_tsquery('russian', %s)", ' | '.join(words), k)
+
+    chunks = []
+    used = 0
+    for r in rows:
+        content = r[4]
+        if used + len(content) > max_chars:
+            if chunks:
+                break
+            content = content[:max_chars]
+        used += len(content)
+        chunks.append({
+            'id': r[0], 'source_id': r[1], 'source_title': r[2], 'chunk_index': r[3],
+            'content': content, 'rank': round(float(r[5]), 4)
+        })
+    return chunks
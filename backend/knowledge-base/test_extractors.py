@@ -0,0 +1,50 @@
+"""Проверки извлечения текста из PDF: python -m unittest test_extractors (из каталога knowledge-base)"""
+
+import os
+import unittest
+
+from extractors import extract_pdf_text
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _stream(num, content):
+    return b'%d 0 obj\n<< /Length %d >>\nstream\n%s\nendstream\nendobj\n' % (num, len(content), content)
+
+
+def _two_font_pdf():
+    """Однобайтовый шрифт и Type0 с двухбайтовыми кодами; оба используют коды 01..03 под разные буквы"""
+    simple_cmap = (b'begincmap\n1 begincodespacerange <00> <FF> endcodespacerange\n'
+                   b'3 beginbfchar <01> <0414> <02> <0416> <03> <0020> endbfchar\nendcmap')
+    cid_cmap = (b'begincmap\n1 begincodespacerange <0000> <FFFF> endcodespacerange\n'
+                b'1 beginbfrange <0001> <0003> <0430> endbfrange\nendcmap')
+    content = b'BT /F1 12 Tf <010203> Tj /F2 12 Tf <000100020003> Tj ET'
+    return b''.join([
+        b'%PDF-1.4\n',
+        b'1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n',
+        b'2 0 obj\n<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n',
+        b'3 0 obj\n<< /Type /Page /Parent 2 0 R /Resources << /Font << /F1 4 0 R /F2 6 0 R >> >> '
+        b'/Contents 8 0 R >>\nendobj\n',
+        b'4 0 obj\n<< /Type /Font /Subtype /Type1 /BaseFont /Test /ToUnicode 5 0 R >>\nendobj\n',
+        _stream(5, simple_cmap),
+        b'6 0 obj\n<< /Type /Font /Subtype /Type0 /BaseFont /TestCID /Encoding /Identity-H '
+        b'/ToUnicode 7 0 R >>\nendobj\n',
+        _stream(7, cid_cmap),
+        _stream(8, content),
+        b'%%EOF\n',
+    ])
+
+
+class ExtractPdfTextTest(unittest.TestCase):
+
+    def test_each_font_uses_its_own_cmap(self):
+        with open(os.path.join(FIXTURES, 'multifont.pdf'), 'rb') as f:
+            text = extract_pdf_text(f.read(), 1000)
+        self.assertEqual(text, 'Жирный заголовок серифом\nПривет мир, это тест')
+
+    def test_code_width_follows_font(self):
+        self.assertEqual(extract_pdf_text(_two_font_pdf(), 1000), 'ДЖ абв')
+
+
+if __name__ == '__main__':
+    unittest.main()
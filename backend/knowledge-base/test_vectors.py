@@ -0,0 +1,43 @@
+"""Проверки векторного поиска: python -m unittest test_vectors (из каталога knowledge-base)"""
+
+import unittest
+
+from vectors import build_index, embed_batch, search, to_bytes
+
+FAQ = [
+    'Доставка по Москве стоит 300 рублей, бесплатно при заказе от 5000 рублей. Курьер привозит заказ за 1–2 дня.',
+    'Офис работает с 9 до 18 по будням, в субботу с 10 до 15. Воскресенье — выходной.',
+    'Оплатить заказ можно картой на сайте, переводом по СБП или наличными курьеру при получении.',
+    'Вернуть товар можно в течение 14 дней, если сохранены упаковка и чек. Деньги возвращаются за 3 дня.',
+    'Гарантия на всю технику — 12 месяцев. Ремонт по гарантии делает сервисный центр производителя.',
+]
+
+
+class SearchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        ids = list(range(101, 101 + len(FAQ)))
+        cls.index = build_index(ids, [to_bytes(v) for v in embed_batch(FAQ)])
+
+    def assertTop(self, question, chunk_id):
+        hits = search(self.index, question, 3)
+        self.assertTrue(hits, question)
+        self.assertEqual(hits[0][0], chunk_id, (question, hits))
+
+    def test_question_ranks_its_chunk_first(self):
+        self.assertTop('сколько стоит доставка', 101)
+        self.assertTop('часы работы офиса', 102)
+        self.assertTop('как оплатить картой', 103)
+        self.assertTop('можно ли вернуть товар', 104)
+        self.assertTop('какая гарантия на технику', 105)
+
+    def test_unknown_words_return_nothing(self):
+        self.assertEqual(search(self.index, 'квантовая хромодинамика', 3), [])
+
+    def test_empty_index(self):
+        self.assertEqual(search(build_index([], []), 'доставка', 3), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+"""Локальный векторный поиск по чанкам базы знаний: разреженные TF-IDF векторы и поиск на NumPy без внешних сервисов"""
+
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+EMBED_BATCH = 200
+STEM_LEN = 6
+# Матрицы ботов в памяти процесса: ~12 байт на пару (чанк, признак), поэтому держим только недавно искавших
+INDEX_CACHE_SIZE = 16
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+_VOWELS = set('аеиоуыэюяaeiouy')
+# Окончания для грубого стемминга, длинные проверяются первыми: «работает», «работы» → «работ»
+_ENDINGS = sorted((
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий',
+    'ой', 'ей', 'ую', 'юю', 'ом', 'ем', 'ах', 'ях', 'ов', 'ев', 'ам', 'ям',
+    'ается', 'яется', 'ются', 'ется', 'ться', 'ает', 'яет', 'ают', 'яют', 'ешь', 'ишь',
+    'ть', 'ет', 'ит', 'ут', 'ют', 'ат', 'ят', 'ся',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+    'ing', 'ed', 'es', 's',
+), key=len, reverse=True)
+
+# bot_id -> {'version': (count, max_id), 'ids', 'vocab', 'idf', 'starts', 'rows', 'weights'}, LRU на INDEX_CACHE_SIZE ботов
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _stem(word):
+    for end in _ENDINGS:
+        if word.endswith(end) and len(word) - len(end) >= 3:
+            word = word[:-len(end)]
+            break
+    if len(word) > 3 and word[-1] in _VOWELS:
+        word = word[:-1]
+    return word[:STEM_LEN]
+
+
+def _features(text):
+    """Признаки текста: основы слов (грубый стемминг для русского и английского) и их биграммы"""
+    words = [_stem(w) for w in _WORD.findall(text.lower().replace('ё', 'е')) if len(w) > 1]
+    feats = words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+    return feats
+
+
+def _term_counts(text):
+    """{crc32 признака: сублинейный tf}. Признак идентифицируется полным 32-битным хэшем — без свёртки
+    в малое число измерений, поэтому df и IDF считаются по каждому признаку отдельно"""
+    counts = Counter(zlib.crc32(f.encode('utf-8')) for f in _features(text))
+    return {h: 1.0 + np.log(c) for h, c in counts.items()}
+
+
+def embed_batch(texts):
+    """Векторизует пачку текстов: для каждого — (хэши признаков uint32, tf float32), хэши по возрастанию.
+    IDF не сохраняется в векторе: он зависит от корпуса бота и применяется при загрузке индекса"""
+    vectors = []
+    for text in texts:
+        counts = _term_counts(text)
+        feats = np.fromiter(counts.keys(), dtype=np.uint32, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        order = np.argsort(feats)
+        vectors.append((feats[order], tf[order]))
+    return vectors
+
+
+def to_bytes(vector):
+    """Разреженный вектор в bytea: n хэшей uint32, затем n весов float32"""
+    feats, tf = vector
+    return feats.astype('<u4').tobytes() + tf.astype('<f4').tobytes()
+
+
+def from_bytes(blob):
+    blob = bytes(blob)
+    n = len(blob) // 8
+    return np.frombuffer(blob, dtype='<u4', count=n), np.frombuffer(blob, dtype='<f4', count=n, offset=4 * n)
+
+
+def embed_missing(cur, schema, bot_id):
+    """Досчитывает векторы для чанков бота без embedding (проиндексированных до векторного поиска или сброшенных миграцией)"""
+    while True:
+        cur.execute(
+            f"SELECT id, content FROM {schema}.knowledge_chunks WHERE bot_id = %s AND embedding IS NULL ORDER BY id LIMIT %s",
+            (bot_id, EMBED_BATCH)
+        )
+        rows = cur.fetchall()
+        if not rows:
+            return
+        vectors = embed_batch([r[1] for r in rows])
+        execute_values(
+            cur,
+            f"UPDATE {schema}.knowledge_chunks AS c SET embedding = v.embedding FROM (VALUES %s) AS v(id, embedding) WHERE c.id = v.id",
+            [(r[0], to_bytes(vec)) for r, vec in zip(rows, vectors)],
+            template='(%s, %s::bytea)',
+            page_size=EMBED_BATCH,
+        )
+
+
+def build_index(ids, blobs):
+    """Инвертированный индекс: словарь признаков, IDF по числу чанков с признаком и постинги
+    (чанк, вес TF-IDF с L2-нормировкой чанка), сгруппированные по признаку"""
+    vectors = [from_bytes(b) for b in blobs]
+    sizes = np.fromiter((len(v[0]) for v in vectors), dtype=np.int64, count=len(vectors))
+    rows = np.repeat(np.arange(len(vectors), dtype=np.int32), sizes)
+    feats = np.concatenate([v[0] for v in vectors]) if vectors else np.zeros(0, dtype=np.uint32)
+    tf = np.concatenate([v[1] for v in vectors]) if vectors else np.zeros(0, dtype=np.float32)
+
+    vocab, cols, df = np.unique(feats, return_inverse=True, return_counts=True)
+    idf = (np.log((len(vectors) + 1) / (df + 1)) + 1).astype(np.float32)
+    weights = tf * idf[cols]
+    norms = np.sqrt(np.bincount(rows, weights=weights.astype(np.float64) ** 2, minlength=len(vectors)))
+    norms[norms == 0] = 1.0
+    weights = (weights / norms[rows]).astype(np.float32)
+
+    order = np.argsort(cols, kind='stable')
+    return {
+        'ids': np.asarray(ids, dtype=np.int64),
+        'vocab': vocab,
+        'idf': idf,
+        'starts': np.concatenate(([0], np.cumsum(df))),
+        'rows': rows[order],
+        'weights': weights[order],
+    }
+
+
+def search(index, question, k):
+    """id и косинусная близость (TF-IDF) k ближайших чанков. Считаются только постинги признаков вопроса"""
+    if not len(index['ids']):
+        return []
+    counts = _term_counts(question)
+    if not counts:
+        return []
+    feats = np.fromiter(counts.keys(), dtype=np.uint32, count=len(counts))
+    tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    pos = np.minimum(np.searchsorted(index['vocab'], feats), max(len(index['vocab']) - 1, 0))
+    known = index['vocab'][pos] == feats if len(index['vocab']) else np.zeros(len(feats), dtype=bool)
+    if not known.any():
+        return []
+    cols = pos[known]
+    query = tf[known] * index['idf'][cols]
+    query /= np.linalg.norm(query)
+
+    scores = np.zeros(len(index['ids']), dtype=np.float32)
+    for col, q in zip(cols, query):
+        lo, hi = index['starts'][col], index['starts'][col + 1]
+        # в постингах одного признака каждый чанк встречается один раз — сложение без np.add.at
+        scores[index['rows'][lo:hi]] += q * index['weights'][lo:hi]
+    k = min(k, len(scores))
+    top = np.argpartition(scores, -k)[-k:]
+    top = top[np.argsort(-scores[top])]
+    return [(int(index['ids'][i]), float(scores[i])) for i in top if scores[i] > 0]
+
+
+def _load_index(cur, schema, bot_id):
+    """Индекс бота кэшируется в процессе и перестраивается, только если изменился набор чанков"""
+    cur.execute(
+        f"SELECT COUNT(*), COALESCE(MAX(id), 0), COUNT(*) FILTER (WHERE embedding IS NULL) "
+        f"FROM {schema}.knowledge_chunks WHERE bot_id = %s",
+        (bot_id,)
+    )
+    count, max_id, missing = cur.fetchone()
+    if missing:
+        embed_missing(cur, schema, bot_id)
+    version = (count, max_id)
+    with _indexes_lock:
+        cached = _indexes.get(bot_id)
+        if cached and cached['version'] == version:
+            _indexes.move_to_end(bot_id)
+            return cached
+
+    cur.execute(
+        f"SELECT c.id, c.embedding FROM {schema}.knowledge_chunks c "
+        f"JOIN {schema}.knowledge_sources s ON s.id = c.source_id "
+        f"WHERE c.bot_id = %s AND s.status = 'ready' AND c.embedding IS NOT NULL ORDER BY c.id",
+        (bot_id,)
+    )
+    rows = cur.fetchall()
+    index = build_index([r[0] for r in rows], [r[1] for r in rows])
+    index['version'] = version
+    with _indexes_lock:
+        _indexes[bot_id] = index
+        _indexes.move_to_end(bot_id)
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def nearest(cur, schema, bot_id, question, k):
+    """id и косинусная близость k ближайших чанков по TF-IDF корпуса бота"""
+    return search(_load_index(cur, schema, bot_id), question, k)
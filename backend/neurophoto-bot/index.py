@@ -3,21 +3,26 @@
 import json
 import os
 import base64
+import re
+import hashlib
 import time
 import urllib.request
 import urllib.error
 
 import psycopg2
-import boto3
 from PIL import Image
 import io
 
+from storage import upload_bytes, upload_bytes_async
+
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
 BOT_TOKEN = os.environ.get('NEUROPHOTO_BOT_TOKEN', '')
 GEMINI_KEY = os.environ.get('GEMINI_API_KEY', '')
 VSEGPT_KEY = os.environ.get('VSEGPT_API_KEY', '')
 OPENROUTER_KEY = os.environ.get('OPENROUTER_API_KEY', '')
 YOOKASSA_PAYMENT_URL = 'https://functions.poehali.dev/b41b8133-a3ad-4896-bda6-2b5ffa2bdeb3'
+# Кэш результатов генерации включается явно: TTL в секундах, 0 — выключен
+RESULT_CACHE_TTL = int(os.environ.get('NEUROPHOTO_RESULT_CACHE_TTL', '0') or 0)
 
 ADMIN_USER_IDS = {285675692}
 
@@ -171,6 +176,22 @@ MODELS = {
 
 DEFAULT_MODEL = 'nano-banana-2'
 
+# Резерв у другого провайдера: когда недоступен сам VseGPT, переключение между его моделями не помогает.
+# В меню не показывается; Gemini принимает не больше одного фото
+FALLBACK_MODELS = {
+    'gemini-flash-image': {
+        'name': '💎 Gemini 2.5 Flash Image',
+        'api_id': 'gemini-2.5-flash-image',
+        'provider': 'gemini',
+        'modes': ('text2img', 'img2img'),
+    },
+}
+
+
+def model_entry(model_key):
+    """Описание модели из MODELS или из резервных FALLBACK_MODELS"""
+    return MODELS.get(model_key) or FALLBACK_MODELS.get(model_key)
+
 MODEL_PRICING = {
     'nano-banana': {'cost_rub': 34.0, 'label': '34 ₽'},
     'nano-banana-2': {'cost_rub': 23.0, 'label': '23 ₽'},
@@ -615,18 +636,23 @@ def download_url(url):
         return None
 
 
+def _s3_content_type(filename):
+    return 'image/jpeg' if filename.endswith('.jpg') else 'image/png'
+
+
 def upload_s3(img_bytes, filename):
-    s3 = boto3.client('s3',
-        endpoint_url='https://bucket.poehali.dev',
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-    )
-    key = f'neurophoto/{filename}'
-    s3.put_object(Bucket='files', Key=key, Body=img_bytes, ContentType='image/png')
-    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+    return upload_bytes(img_bytes, f'neurophoto/{filename}', _s3_content_type(filename))
+
+
+def upload_s3_async(img_bytes, filename):
+    return upload_bytes_async(img_bytes, f'neurophoto/{filename}', _s3_content_type(filename))
+
+
+# Gemini отвечает быстро или не отвечает вовсе: дольше ждать его не стоит даже при большом остатке бюджета
+GEMINI_TIMEOUT = 24
 
 
-def gemini_generate(prompt, photo_bytes=None):
+def gemini_generate(prompt, photo_bytes=None, timeout=GEMINI_TIMEOUT):
     parts = []
     if photo_bytes:
         parts.append({
@@ -649,7 +675,7 @@ def gemini_generate(prompt, photo_bytes=None):
     req = urllib.request.Request(url, data=payload, headers={'Content-Type': 'application/json'})
 
     try:
-        with urllib.request.urlopen(req, timeout=24) as resp:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
             result = json.loads(resp.read().decode('utf-8'))
     except urllib.error.HTTPError as e:
         err_body = e.read().decode('utf-8') if e.fp else ''
@@ -695,7 +721,12 @@ def compress_photo(photo_bytes, max_size=512):
         return photo_bytes
 
 
-def vsegpt_generate(model_key, prompt, photo_bytes=None, extra_photos=None, cdn_urls=None, aspect_ratio=None):
+VSEGPT_RETRY_PAUSE = 2
+# Повтор после ошибки соединения имеет смысл, только если на него остаётся хотя бы столько секунд
+VSEGPT_MIN_ATTEMPT = 5
+
+
+def vsegpt_generate(model_key, prompt, photo_bytes=None, extra_photos=None, cdn_urls=None, aspect_ratio=None, timeout=120):
     if not VSEGPT_KEY:
         return None, 'VSEGPT_API_KEY не настроен'
 
@@ -730,7 +761,12 @@ def vsegpt_generate(model_key, prompt, photo_bytes=None, extra_photos=None, cdn_
     max_retries = 2
     result = None
     last_err = None
+    # timeout — на весь вызов вместе с повторами, а не на каждую попытку
+    deadline = time.time() + timeout
     for attempt in range(max_retries + 1):
+        left = deadline - time.time()
+        if left < 1:
+            return None, f'Таймаут: нейросеть не ответила за {int(timeout)} секунд. Попробуйте ещё раз или выберите другую модель.'
         req = urllib.request.Request(
             'https://api.vsegpt.ru/v1/images/generations',
             data=payload,
@@ -741,7 +777,7 @@ def vsegpt_generate(model_key, prompt, photo_bytes=None, extra_photos=None, cdn_
             method='POST'
         )
         try:
-            with urllib.request.urlopen(req, timeout=120) as resp:
+            with urllib.request.urlopen(req, timeout=left) as resp:
                 result = json.loads(resp.read().decode('utf-8'))
             break
         except urllib.error.HTTPError as e:
@@ -753,9 +789,9 @@ def vsegpt_generate(model_key, prompt, photo_bytes=None, extra_photos=None, cdn_
             print(f'[VSEGPT] Exception (attempt {attempt+1}/{max_retries+1}): {str(e)}')
             last_err = str(e)
             if 'timed out' in err_str or 'timeout' in err_str:
-                return None, 'Таймаут: нейросеть не ответила за 120 секунд. Попробуйте ещё раз или выберите другую модель.'
-            if attempt < max_retries:
-                time.sleep(2)
+                return None, f'Таймаут: нейросеть не ответила за {int(timeout)} секунд. Попробуйте ещё раз или выберите другую модель.'
+            if attempt < max_retries and deadline - time.time() > VSEGPT_RETRY_PAUSE + VSEGPT_MIN_ATTEMPT:
+                time.sleep(VSEGPT_RETRY_PAUSE)
                 continue
             return None, f'Ошибка соединения: {last_err[:100]}'
     if result is None:
@@ -786,15 +822,156 @@ def vsegpt_generate(model_key, prompt, photo_bytes=None, extra_photos=None, cdn_
     return None, 'Модель не вернула изображение. Попробуйте другой промпт или модель.'
 
 
-def generate_image(model_key, prompt, photo_bytes=None, extra_photos=None, cdn_urls=None, aspect_ratio=None):
-    model_info = MODELS.get(model_key)
+def generate_image(model_key, prompt, photo_bytes=None, extra_photos=None, cdn_urls=None, aspect_ratio=None, timeout=None):
+    model_info = model_entry(model_key)
     if not model_info:
         return None, f'Неизвестная модель: {model_key}'
 
     if model_info['provider'] == 'gemini':
-        return gemini_generate(prompt, photo_bytes)
+        return gemini_generate(prompt, photo_bytes, timeout=min(GEMINI_TIMEOUT, timeout) if timeout else GEMINI_TIMEOUT)
+    else:
+        return vsegpt_generate(model_key, prompt, photo_bytes, extra_photos=extra_photos, cdn_urls=cdn_urls, aspect_ratio=aspect_ratio, timeout=timeout or 120)
+
+
+# Circuit breaker: после BREAKER_FAILURE_THRESHOLD сбоев подряд модель считается недоступной
+# на BREAKER_COOLDOWN секунд; затем один запрос пропускается пробным (half-open).
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN = 180
+GENERATION_BUDGET = 100
+MIN_FALLBACK_BUDGET = 25
+MAX_FALLBACKS = 2
+
+# Ошибки, которые говорят о проблеме у провайдера, а не о конкретном промпте
+PROVIDER_FAILURE_MARKERS = ('TIMEOUT', 'Таймаут', 'Ошибка соединения', 'VseGPT error 5', 'VseGPT error 429', 'Gemini API error 5', 'Gemini API error 429')
+
+
+def is_provider_failure(err):
+    return bool(err) and err.startswith(PROVIDER_FAILURE_MARKERS)
+
+
+def fallback_chain(model_key, photo_count=0):
+    """Модель, резервные модели того же провайдера и режима в порядке MODELS и последним звеном —
+    модель другого провайдера из FALLBACK_MODELS (если она умеет этот режим и число фото)"""
+    model_info = MODELS.get(model_key)
+    if not model_info:
+        return [model_key]
+    other = []
+    for key, info in FALLBACK_MODELS.items():
+        if info['provider'] == model_info['provider'] or model_info['mode'] not in info['modes']:
+            continue
+        if photo_count > 1 or (info['provider'] == 'gemini' and not GEMINI_KEY):
+            continue
+        other.append(key)
+        break
+    chain = [model_key]
+    seen_api = {model_info['api_id']}
+    for key, info in MODELS.items():
+        if len(chain) + len(other) > MAX_FALLBACKS:
+            break
+        if info['api_id'] in seen_api or info['provider'] != model_info['provider'] or info['mode'] != model_info['mode']:
+            continue
+        if photo_count > 1 and not info.get('multi_photo'):
+            continue
+        chain.append(key)
+        seen_api.add(info['api_id'])
+    return chain + other
+
+
+def breaker_allows(conn, model_key):
+    """True, если модель можно вызывать. Из открытого состояния пропускает ровно один пробный запрос на весь кластер"""
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT opened_until, opened_until > CURRENT_TIMESTAMP FROM {SCHEMA}.neurophoto_provider_health WHERE model_key = %s",
+        (model_key,)
+    )
+    row = cur.fetchone()
+    if not row or row[0] is None:
+        cur.close()
+        return True
+    if row[1]:
+        cur.close()
+        return False
+    cur.execute(
+        f"UPDATE {SCHEMA}.neurophoto_provider_health SET opened_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second', updated_at = CURRENT_TIMESTAMP "
+        f"WHERE model_key = %s AND opened_until <= CURRENT_TIMESTAMP RETURNING 1",
+        (BREAKER_COOLDOWN, model_key)
+    )
+    trial = cur.fetchone() is not None
+    cur.close()
+    return trial
+
+
+def breaker_record(conn, model_key, err=None):
+    provider = (model_entry(model_key) or {}).get('provider', '')
+    cur = conn.cursor()
+    if err is None:
+        cur.execute(
+            f"INSERT INTO {SCHEMA}.neurophoto_provider_health (model_key, provider, last_success_at) VALUES (%s, %s, CURRENT_TIMESTAMP) "
+            f"ON CONFLICT (model_key) DO UPDATE SET consecutive_failures = 0, opened_until = NULL, last_success_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP",
+            (model_key, provider)
+        )
     else:
-        return vsegpt_generate(model_key, prompt, photo_bytes, extra_photos=extra_photos, cdn_urls=cdn_urls, aspect_ratio=aspect_ratio)
+        cur.execute(
+            f"INSERT INTO {SCHEMA}.neurophoto_provider_health (model_key, provider, consecutive_failures, last_error, last_failure_at) VALUES (%s, %s, 1, %s, CURRENT_TIMESTAMP) "
+            f"ON CONFLICT (model_key) DO UPDATE SET consecutive_failures = neurophoto_provider_health.consecutive_failures + 1, "
+            f"last_error = EXCLUDED.last_error, last_failure_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP, "
+            f"opened_until = CASE WHEN neurophoto_provider_health.consecutive_failures + 1 >= %s "
+            f"THEN CURRENT_TIMESTAMP + %s * INTERVAL '1 second' ELSE neurophoto_provider_health.opened_until END",
+            (model_key, provider, err[:500], BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN)
+        )
+    cur.close()
+
+
+def generate_with_fallback(conn, model_key, prompt, photo_bytes=None, extra_photos=None, cdn_urls=None, aspect_ratio=None):
+    """Генерация с учётом circuit breaker и переключением на резервные модели.
+    Возвращает (img_bytes, err, used_model_key, conn) — соединение может быть переоткрыто после долгого вызова."""
+    photo_count = len(cdn_urls) if cdn_urls else ((1 + len(extra_photos or [])) if photo_bytes else 0)
+    started = time.time()
+    last_err = None
+    tried = False
+    chain = fallback_chain(model_key, photo_count)
+    for i, key in enumerate(chain):
+        budget = GENERATION_BUDGET - (time.time() - started)
+        if tried and budget < MIN_FALLBACK_BUDGET:
+            break
+        conn = ensure_conn(conn)
+        try:
+            allowed = breaker_allows(conn, key)
+        except Exception as e:
+            print(f'[BREAKER] State read failed: {e}')
+            allowed = True
+        if not allowed:
+            print(f'[BREAKER] {key} is open, skipping')
+            continue
+
+        tried = True
+        # следующим звеньям цепочки оставляем по MIN_FALLBACK_BUDGET — одна попытка не съедает весь бюджет
+        timeout = min(budget, max(MIN_FALLBACK_BUDGET, budget - MIN_FALLBACK_BUDGET * (len(chain) - i - 1)))
+        key_photo, key_cdn = photo_bytes, cdn_urls
+        if model_entry(key)['provider'] == 'gemini' and cdn_urls:
+            # Gemini принимает фото только байтами — резерву для VseGPT-запроса скачиваем его с CDN
+            data = download_url(cdn_urls[0])
+            if not data:
+                last_err = 'Ошибка соединения: не удалось скачать фото для резервной модели'
+                continue
+            key_photo, key_cdn = compress_photo(data), None
+        img, err = generate_image(key, prompt, key_photo, extra_photos=extra_photos, cdn_urls=key_cdn, aspect_ratio=aspect_ratio, timeout=timeout)
+        conn = ensure_conn(conn)
+        failed = is_provider_failure(err)
+        try:
+            breaker_record(conn, key, err if failed else None)
+        except Exception as e:
+            print(f'[BREAKER] State write failed: {e}')
+        if not failed:
+            if key != model_key and not err:
+                print(f'[BREAKER] Rerouted {model_key} -> {key}')
+            return img, err, key, conn
+        print(f'[BREAKER] {key} failed: {err[:100]}')
+        last_err = err
+
+    if not tried:
+        return None, 'Модель временно недоступна у провайдера. Попробуйте через несколько минут или выберите другую модель.', model_key, conn
+    return None, last_err, model_key, conn
 
 
 def openrouter_make_prompt(model_key, user_description):
@@ -988,6 +1165,66 @@ def get_last_generation(conn, tid):
     return None
 
 
+def _sha256(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+# Фото альбома лежат в S3 под хэшем содержимого — см. загрузку альбома в handler
+_ALBUM_PHOTO_NAME = re.compile(r'/album_\d+_([0-9a-f]{64})\.jpg$')
+
+
+def _photo_digest(url):
+    """sha256 содержимого фото по CDN-ссылке: из имени объекта альбома или по скачанным байтам.
+    Если фото не скачалось — сама ссылка, чтобы ключ оставался детерминированным"""
+    m = _ALBUM_PHOTO_NAME.search(url)
+    if m:
+        return m.group(1)
+    data = download_url(url)
+    return _sha256(data) if data else _sha256(url)
+
+
+def result_cache_key(model_key, prompt, photo_bytes=None, extra_photos=None, photo_cdn_urls=None, aspect_ratio=None):
+    """Ключ кэша: (модель, хэш промпта, хэш входных фото, соотношение сторон). None — кэш выключен"""
+    if RESULT_CACHE_TTL <= 0:
+        return None, None
+    prompt_hash = _sha256(' '.join((prompt or '').split()).lower())
+    image_hash = ''
+    if photo_cdn_urls:
+        # ссылки уникальны для каждой загрузки, поэтому ключ строится по содержимому фото
+        image_hash = _sha256('|'.join(_photo_digest(u) for u in photo_cdn_urls))
+    elif photo_bytes:
+        h = hashlib.sha256(photo_bytes)
+        for extra in extra_photos or []:
+            h.update(extra)
+        image_hash = h.hexdigest()
+    key = _sha256(f'{model_key}|{prompt_hash}|{image_hash}|{aspect_ratio or ""}')
+    return key, {'model': model_key, 'prompt_hash': prompt_hash, 'image_hash': image_hash, 'aspect_ratio': aspect_ratio or ''}
+
+
+def get_cached_result(conn, cache_key):
+    cur = conn.cursor()
+    cur.execute(
+        f"UPDATE {SCHEMA}.neurophoto_result_cache SET hits = hits + 1 WHERE cache_key = %s AND expires_at > CURRENT_TIMESTAMP RETURNING image_url",
+        (cache_key,)
+    )
+    row = cur.fetchone()
+    cur.close()
+    return row[0] if row else None
+
+
+def save_cached_result(conn, cache_key, cache_meta, image_url):
+    cur = conn.cursor()
+    cur.execute(
+        f"INSERT INTO {SCHEMA}.neurophoto_result_cache (cache_key, model, prompt_hash, image_hash, aspect_ratio, image_url, expires_at) "
+        f"VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second') "
+        f"ON CONFLICT (cache_key) DO UPDATE SET image_url = EXCLUDED.image_url, created_at = CURRENT_TIMESTAMP, expires_at = EXCLUDED.expires_at, hits = 0",
+        (cache_key, cache_meta['model'], cache_meta['prompt_hash'], cache_meta['image_hash'], cache_meta['aspect_ratio'], image_url, RESULT_CACHE_TTL)
+    )
+    cur.close()
+
+
 def remaining(u):
     return u['free'] + u['paid'] - u['used']
 
@@ -1173,7 +1410,14 @@ def after_gen_keyboard():
     ]}
 
 
-def run_generate_inline(conn, chat_id, tid, prompt, model_key, photo_bytes=None, extra_photos=None, photo_cdn_urls=None, aspect_ratio=None):
+def cached_result_keyboard(aspect_ratio):
+    return {'inline_keyboard': [
+        [{'text': '🔁 Сгенерировать заново', 'callback_data': f'regen:{aspect_ratio or DEFAULT_RATIO}'}],
+        [{'text': '🤖 Сменить модель', 'callback_data': 'show_img_models'}, {'text': '🏠 На главную', 'callback_data': 'go_start'}]
+    ]}
+
+
+def run_generate_inline(conn, chat_id, tid, prompt, model_key, photo_bytes=None, extra_photos=None, photo_cdn_urls=None, aspect_ratio=None, cache_key=None, cache_meta=None):
     model_info = MODELS.get(model_key, MODELS[DEFAULT_MODEL])
     print(f'[GEN] Starting inline: tid={tid}, model={model_key}, has_photo={photo_bytes is not None}, cdn_urls={len(photo_cdn_urls) if photo_cdn_urls else 0}')
 
@@ -1199,22 +1443,17 @@ def run_generate_inline(conn, chat_id, tid, prompt, model_key, photo_bytes=None,
             vsegpt_cdn = photo_cdn_urls
             print(f'[GEN] Passing {len(photo_cdn_urls)} CDN URLs directly to VseGPT')
         elif photo_bytes and model_info['provider'] != 'gemini':
-            compressed = compress_photo(photo_bytes)
-            fname_tmp = f'tmp_{tid}_{int(time.time())}_0.jpg'
-            cdn = upload_s3(compressed, fname_tmp)
-            vsegpt_cdn = [cdn]
+            ts = int(time.time())
+            uploads = [upload_s3_async(compress_photo(photo_bytes), f'tmp_{tid}_{ts}_0.jpg')]
             if extra_photos:
                 for i, ep in enumerate(extra_photos):
-                    comp = compress_photo(ep)
-                    fn = f'tmp_{tid}_{int(time.time())}_{i+1}.jpg'
-                    vsegpt_cdn.append(upload_s3(comp, fn))
+                    uploads.append(upload_s3_async(compress_photo(ep), f'tmp_{tid}_{ts}_{i+1}.jpg'))
+            vsegpt_cdn = [f.result() for f in uploads]
             gen_photo = None
             gen_extra = None
             print(f'[GEN] Uploaded {len(vsegpt_cdn)} photos to CDN for VseGPT')
 
-        img_bytes_result, err = generate_image(model_key, prompt, gen_photo, extra_photos=gen_extra, cdn_urls=vsegpt_cdn, aspect_ratio=aspect_ratio)
-
-        conn = ensure_conn(conn)
+        img_bytes_result, err, used_model, conn = generate_with_fallback(conn, model_key, prompt, gen_photo, extra_photos=gen_extra, cdn_urls=vsegpt_cdn, aspect_ratio=aspect_ratio)
 
         if err:
             print(f'[GEN] Error: {err}')
@@ -1227,27 +1466,37 @@ def run_generate_inline(conn, chat_id, tid, prompt, model_key, photo_bytes=None,
         ratio_info = ASPECT_RATIOS.get(aspect_ratio, {})
         ratio_label = f' | {ratio_info.get("icon", "")} {ratio_info.get("label", "")}' if ratio_info else ''
         caption = f'\u2728 \u0413\u043e\u0442\u043e\u0432\u043e! \u041c\u043e\u0434\u0435\u043b\u044c: {model_info["name"]}{ratio_label}\n\ud83d\udc8e \u041e\u0441\u0442\u0430\u043b\u043e\u0441\u044c: <b>{left}</b>'
+        if used_model != model_key:
+            caption += f'\n<i>{model_info["name"]} временно недоступна — использована {model_entry(used_model)["name"]}</i>'
         kb = after_gen_keyboard()
 
+        # Загрузка результата в S3 идёт в фоне параллельно с отправкой в Telegram
+        upload_future = upload_s3_async(img_bytes_result, f'{tid}_{int(time.time())}.png')
+
         print(f'[GEN] Got {len(img_bytes_result)} bytes, sending to Telegram...')
         res = send_photo_bytes(chat_id, img_bytes_result, caption, reply_markup=kb)
         print(f'[GEN] send_photo_bytes result ok={res.get("ok")}')
-        if not res.get('ok'):
-            fname_fb = f'{tid}_{int(time.time())}_fb.png'
-            cdn_fb = upload_s3(img_bytes_result, fname_fb)
-            print(f'[GEN] Fallback: sending as URL {cdn_fb[:60]}')
-            res2 = send_photo_url(chat_id, cdn_fb, caption, reply_markup=kb)
-            if not res2.get('ok'):
-                send_msg(chat_id, f'❌ Картинка сгенерирована, но не удалось отправить.\nПричина: {res.get("error", res.get("description", "неизвестно"))[:200]}')
 
         cdn_url = ''
         try:
-            fname_out = f'{tid}_{int(time.time())}.png'
-            cdn_url = upload_s3(img_bytes_result, fname_out)
+            cdn_url = upload_future.result()
         except Exception as e:
             print(f'[S3] Upload failed: {e}')
 
-        record_gen(conn, tid, prompt, model_key, cdn_url, user['paid'] > 0)
+        if not res.get('ok'):
+            sent = False
+            if cdn_url:
+                print(f'[GEN] Fallback: sending as URL {cdn_url[:60]}')
+                sent = send_photo_url(chat_id, cdn_url, caption, reply_markup=kb).get('ok')
+            if not sent:
+                send_msg(chat_id, f'❌ Картинка сгенерирована, но не удалось отправить.\nПричина: {res.get("error", res.get("description", "неизвестно"))[:200]}')
+
+        record_gen(conn, tid, prompt, used_model, cdn_url, user['paid'] > 0)
+        if cache_key and cdn_url and used_model == model_key:
+            try:
+                save_cached_result(conn, cache_key, cache_meta, cdn_url)
+            except Exception as e:
+                print(f'[CACHE] Save failed: {e}')
         set_session(conn, tid, 'after_gen', cdn_url or 'generated')
     except Exception as e:
         print(f'[GEN] Fatal error: {type(e).__name__}: {e}')
@@ -1259,7 +1508,7 @@ def run_generate_inline(conn, chat_id, tid, prompt, model_key, photo_bytes=None,
             pass
 
 
-def do_generate(conn, chat_id, tid, user, prompt, photo_bytes=None, extra_photos=None, photo_cdn_urls=None, skip_status_msg=False, aspect_ratio=None):
+def do_generate(conn, chat_id, tid, user, prompt, photo_bytes=None, extra_photos=None, photo_cdn_urls=None, skip_status_msg=False, aspect_ratio=None, use_cache=True):
     cur = conn.cursor()
     cur.execute(
         f"SELECT 1 FROM {SCHEMA}.neurophoto_users WHERE telegram_id = %s AND session_state = 'generating' AND session_updated_at > CURRENT_TIMESTAMP - INTERVAL '120 seconds'",
@@ -1271,11 +1520,24 @@ def do_generate(conn, chat_id, tid, user, prompt, photo_bytes=None, extra_photos
         send_msg(chat_id, '\u23f3 \u041f\u0440\u0435\u0434\u044b\u0434\u0443\u0449\u0430\u044f \u0433\u0435\u043d\u0435\u0440\u0430\u0446\u0438\u044f \u0435\u0449\u0451 \u0432\u044b\u043f\u043e\u043b\u043d\u044f\u0435\u0442\u0441\u044f. \u0414\u043e\u0436\u0434\u0438\u0442\u0435\u0441\u044c \u0440\u0435\u0437\u0443\u043b\u044c\u0442\u0430\u0442\u0430.')
         return
 
-    set_session(conn, tid, 'generating')
-
     model_key = user.get('model', DEFAULT_MODEL)
     model_info = MODELS.get(model_key, MODELS[DEFAULT_MODEL])
 
+    cache_key, cache_meta = result_cache_key(model_key, prompt, photo_bytes, extra_photos, photo_cdn_urls, aspect_ratio)
+    if cache_key and use_cache:
+        cached_url = get_cached_result(conn, cache_key)
+        if cached_url:
+            # Сессия не сбрасывается: входные данные остаются доступны для «Сгенерировать заново»
+            print(f'[CACHE] Hit: tid={tid}, model={model_key}, key={cache_key[:12]}')
+            res = send_photo_url(chat_id, cached_url,
+                f'⚡ Готово! Модель: {model_info["name"]}\n<i>Такой же запрос уже выполнялся — результат из кэша, генерация не списана.</i>',
+                reply_markup=cached_result_keyboard(aspect_ratio))
+            if res.get('ok'):
+                return
+            print(f'[CACHE] Cached URL send failed, regenerating: {res.get("description", "")[:100]}')
+
+    set_session(conn, tid, 'generating')
+
     tg('sendChatAction', {'chat_id': chat_id, 'action': 'upload_photo'})
 
     if not skip_status_msg:
@@ -1288,7 +1550,7 @@ def do_generate(conn, chat_id, tid, user, prompt, photo_bytes=None, extra_photos
             else:
                 send_msg(chat_id, f'🎨 Генерирую через {model_info["name"]}...\nОбычно 15-60 секунд.')
 
-    run_generate_inline(conn, chat_id, tid, prompt, model_key, photo_bytes, extra_photos, photo_cdn_urls, aspect_ratio=aspect_ratio)
+    run_generate_inline(conn, chat_id, tid, prompt, model_key, photo_bytes, extra_photos, photo_cdn_urls, aspect_ratio=aspect_ratio, cache_key=cache_key, cache_meta=cache_meta)
 
 
 def handler(event, context):
@@ -1358,7 +1620,7 @@ def handler(event, context):
                 largest = max(photos, key=lambda p: p.get('file_size', 0))
                 photo_data = download_tg_file(largest['file_id'])
                 if photo_data:
-                    fname_s3 = f'album_{tid}_{media_group_id}_{int(time.time())}_{len(photos)}.jpg'
+                    fname_s3 = f'album_{tid}_{_sha256(photo_data)}.jpg'
                     cdn_url = upload_s3(photo_data, fname_s3)
                     existing = get_album_photos(conn, tid, media_group_id)
                     save_album_photo(conn, tid, media_group_id, cdn_url, len(existing))
@@ -2633,7 +2895,9 @@ def _handle_callback_inner(callback, cb_data, cb_id, chat_id, msg_id, tid):
             conn.close()
         return ok()
 
-    if cb_data.startswith('ratio:'):
+    if cb_data.startswith('ratio:') or cb_data.startswith('regen:'):
+        # regen: — тот же запрос, но мимо кэша результатов
+        use_cache = cb_data.startswith('ratio:')
         ratio_key = cb_data.split(':', 1)[1]
         if ratio_key not in ASPECT_RATIOS:
             tg('answerCallbackQuery', {'callback_query_id': cb_id, 'text': 'Неизвестный размер'})
@@ -2647,6 +2911,10 @@ def _handle_callback_inner(callback, cb_data, cb_id, chat_id, msg_id, tid):
             user = get_user(conn, tid, uname, fname)
             state = user.get('state', '') or ''
 
+            if not use_cache and remaining(user) <= 0:
+                send_msg(chat_id, no_balance_text(user), reply_markup=buy_keyboard())
+                return ok()
+
             if state == 'choose_ratio_text':
                 saved_prompt = user.get('photo', '')
                 if not saved_prompt:
@@ -2660,7 +2928,7 @@ def _handle_callback_inner(callback, cb_data, cb_id, chat_id, msg_id, tid):
                     'text': f'🎨 Генерирую через {model_info["name"]}...\nОбычно 15-60 секунд.',
                     'parse_mode': 'HTML'
                 })
-                do_generate(conn, chat_id, tid, user, saved_prompt, skip_status_msg=True, aspect_ratio=ratio_key)
+                do_generate(conn, chat_id, tid, user, saved_prompt, skip_status_msg=True, aspect_ratio=ratio_key, use_cache=use_cache)
 
             elif state == 'choose_ratio_img':
                 photo_url = user.get('photo', '')
@@ -2681,7 +2949,7 @@ def _handle_callback_inner(callback, cb_data, cb_id, chat_id, msg_id, tid):
                     send_msg(chat_id, '❌ Фото устарело. Отправьте его ещё раз.')
                     set_session(conn, tid, None)
                     return ok()
-                do_generate(conn, chat_id, tid, user, saved_caption, photo_bytes, skip_status_msg=True, aspect_ratio=ratio_key)
+                do_generate(conn, chat_id, tid, user, saved_caption, photo_bytes, skip_status_msg=True, aspect_ratio=ratio_key, use_cache=use_cache)
 
             elif state == 'choose_ratio_album':
                 mg = get_user_media_group(conn, tid)
@@ -2702,7 +2970,7 @@ def _handle_callback_inner(callback, cb_data, cb_id, chat_id, msg_id, tid):
                     'text': f'🎨 Генерирую через {model_info["name"]}...\nОбычно 15-60 секунд.',
                     'parse_mode': 'HTML'
                 })
-                do_generate(conn, chat_id, tid, user, saved_caption, photo_cdn_urls=cdn_urls, skip_status_msg=True, aspect_ratio=ratio_key)
+                do_generate(conn, chat_id, tid, user, saved_caption, photo_cdn_urls=cdn_urls, skip_status_msg=True, aspect_ratio=ratio_key, use_cache=use_cache)
 
             else:
                 send_msg(chat_id, '❌ Сессия устарела. Начните заново.')
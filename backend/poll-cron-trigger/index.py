@@ -6,6 +6,8 @@ from typing import Dict, Any
 # URL'ы внешних воркеров, которые этот cron-триггер пробуждает каждый запуск.
 TELEGRAM_POLL_WORKER_URL = 'https://functions.poehali.dev/6937f818-f5ef-4075-afb4-48594cb1a442'
 GEO_CRON_URL = 'https://functions.poehali.dev/cab0cab4-16c4-4522-95e3-b95f8fb0fb12'
+KNOWLEDGE_BASE_URL = 'https://functions.poehali.dev/236ece2b-8750-483b-b84f-5d1e118c869e'
+EXPERT_UNPACKER_URL = 'https://functions.poehali.dev/a795746d-3812-4427-898e-b756ff0edc4f'
 
 
 def _call(url: str, payload: dict, timeout: int = 28, extra_headers: dict | None = None):
@@ -34,10 +36,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Cron-trigger каждые N минут. Будит:
       1) Telegram poll-scheduler-worker (старая система опросов)
-      2) GEO-Factory cron (автоопрос LLM и проверка публикаций)
+      2) GEO-Factory cron (автоопрос LLM и проверка публикаций) и выгрузку истории в Parquet
+      3) Очередь фоновой загрузки базы знаний
+      4) Очередь генерации распаковок expert-unpacker-bot
     Args: event - HTTP request (called by external cron service)
           context - cloud function context
-    Returns: HTTP-ответ с результатами обоих воркеров (не падает целиком, если один сломан)
+    Returns: HTTP-ответ с результатами всех воркеров (не падает целиком, если один сломан)
     '''
     method = event.get('httpMethod', 'POST')
 
@@ -68,6 +72,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if not geo_result.get('ok'):
         print(f'[cron] geo-cron: {geo_result.get("error")}')
 
+    # 2b) Инкрементальная выгрузка истории GEO в Parquet — продолжает с манифеста, ответа не ждём
+    export_result = _call(GEO_CRON_URL, {'kind': 'export'}, timeout=5, extra_headers=geo_headers)
+    if not export_result.get('ok'):
+        print(f'[cron] geo-cron export: {export_result.get("error")}')
+
+    # Служебные вызовы (_internal) очередей подписываются общим секретом функций
+    internal_headers = {'X-Internal-Key': os.environ.get('INTERNAL_KEY', '')}
+
+    # 3) Очередь загрузки базы знаний — подбирает источники, которые не обработал основной воркер
+    kb_result = _call(KNOWLEDGE_BASE_URL, {'_internal': 'process_queue'}, timeout=5, extra_headers=internal_headers)
+    if not kb_result.get('ok'):
+        print(f'[cron] knowledge-base queue: {kb_result.get("error")}')
+
+    # 4) Генерация распаковок — подбирает задачи, чей вызов потерялся или инстанс упал. Генерация идёт минутами, ответа не ждём
+    expert_result = _call(EXPERT_UNPACKER_URL, {'_internal': 'process_jobs'}, timeout=5, extra_headers=internal_headers)
+    if not expert_result.get('ok'):
+        print(f'[cron] expert-unpacker jobs: {expert_result.get("error")}')
+
     return {
         'statusCode': 200,
         'headers': {
@@ -79,5 +101,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'status': 'success',
             'telegram_poll': telegram_result,
             'geo_cron': geo_result,
+            'geo_export': export_result,
+            'knowledge_queue': kb_result,
+            'expert_jobs': expert_result,
         })
     }
\ No newline at end of file
@@ -1,8 +1,13 @@
 """Telegram бот-квалификатор для предпринимателей. Задаёт вопросы, подбирает решения по автоматизации и собирает заявки на консультацию."""
 
+import hashlib
+import hmac
+import itertools
 import json
 import os
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import psycopg2
 import requests
 from datetime import datetime
@@ -32,14 +37,22 @@ NOTIFY_CHAT_ID = os.environ.get("QUALIFIER_NOTIFY_CHAT_ID", "")
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
 DB_SCHEMA = os.environ.get("MAIN_DB_SCHEMA", "public")
 VSEGPT_API_KEY = os.environ.get("VSEGPT_API_KEY", "")
+# Общий секрет служебных вызовов (_internal): без него прогрев кэша из 360 платных запросов к LLM недоступен
+INTERNAL_KEY = os.environ.get("INTERNAL_KEY", "")
 
 print(f"[INIT] ADMIN_CHAT_ID loaded: '{ADMIN_CHAT_ID}' (len={len(ADMIN_CHAT_ID)})")
 print(f"[INIT] NOTIFY_CHAT_ID loaded: '{NOTIFY_CHAT_ID}' (len={len(NOTIFY_CHAT_ID)})")
 
 TELEGRAM_API = f"https://api.telegram.org/bot{BOT_TOKEN}"
 
-# Кэш file_id приветственного видео (чтобы не скачивать каждый раз)
+# Кэш file_id приветственного видео: в памяти инстанса и в telegram_media_cache (общий для всех инстансов)
 _welcome_video_file_id = None
+MEDIA_CACHE_BOT = "qualifier-bot"
+
+# Кэш персональных рекомендаций по набору ответов; прогрев идёт параллельно в пределах дедлайна вызова
+AI_ANSWER_FIELDS = ("niche", "pain", "automation_level", "sales_channel")
+AI_WARM_WORKERS = 8
+AI_WARM_DEADLINE = 25
 
 
 def get_yandex_download_url(public_url):
@@ -69,6 +82,36 @@ def send_video(chat_id, video, caption=None, reply_markup=None):
     return resp.json()
 
 
+def get_cached_file_id(source_url):
+    try:
+        rows = db_execute(
+            f"SELECT file_id FROM {DB_SCHEMA}.telegram_media_cache WHERE bot = %s AND source_url = %s",
+            [MEDIA_CACHE_BOT, source_url],
+        )
+    except Exception as e:
+        logger.warning(f"[VIDEO] media cache read failed: {e}")
+        return None
+    return rows[0][0] if rows else None
+
+
+def save_cached_file_id(source_url, file_id):
+    """Сохраняет file_id; при file_id=None удаляет протухшую запись"""
+    try:
+        if file_id:
+            db_execute(
+                f"INSERT INTO {DB_SCHEMA}.telegram_media_cache (bot, source_url, file_id) VALUES (%s, %s, %s) "
+                f"ON CONFLICT (bot, source_url) DO UPDATE SET file_id = EXCLUDED.file_id, updated_at = NOW()",
+                [MEDIA_CACHE_BOT, source_url, file_id],
+            )
+        else:
+            db_execute(
+                f"DELETE FROM {DB_SCHEMA}.telegram_media_cache WHERE bot = %s AND source_url = %s",
+                [MEDIA_CACHE_BOT, source_url],
+            )
+    except Exception as e:
+        logger.warning(f"[VIDEO] media cache write failed: {e}")
+
+
 def send_welcome_video(chat_id, caption=None, buttons=None):
     """Отправить приветственное видео с Яндекс.Диска. Кэширует file_id после первой отправки."""
     global _welcome_video_file_id
@@ -84,7 +127,9 @@ def send_welcome_video(chat_id, caption=None, buttons=None):
                 keyboard.append([{"text": btn, "callback_data": cb_key}])
         reply_markup = {"inline_keyboard": keyboard}
 
-    # Если уже есть закэшированный file_id — используем его
+    # Если уже есть закэшированный file_id (в памяти или в БД) — используем его
+    if not _welcome_video_file_id:
+        _welcome_video_file_id = get_cached_file_id(WELCOME_VIDEO_YANDEX_PUBLIC_URL)
     if _welcome_video_file_id:
         logger.info(f"[VIDEO] Sending with cached file_id: {_welcome_video_file_id[:20]}...")
         result = send_video(chat_id, _welcome_video_file_id, caption, reply_markup)
@@ -93,6 +138,7 @@ def send_welcome_video(chat_id, caption=None, buttons=None):
         else:
             logger.warning(f"[VIDEO] Cached file_id failed, re-downloading: {result}")
             _welcome_video_file_id = None
+            save_cached_file_id(WELCOME_VIDEO_YANDEX_PUBLIC_URL, None)
 
     # Получаем прямую ссылку с Яндекс.Диска
     download_url = get_yandex_download_url(WELCOME_VIDEO_YANDEX_PUBLIC_URL)
@@ -108,6 +154,7 @@ def send_welcome_video(chat_id, caption=None, buttons=None):
         video_obj = result.get("result", {}).get("video")
         if video_obj and video_obj.get("file_id"):
             _welcome_video_file_id = video_obj["file_id"]
+            save_cached_file_id(WELCOME_VIDEO_YANDEX_PUBLIC_URL, _welcome_video_file_id)
             logger.info(f"[VIDEO] Cached file_id: {_welcome_video_file_id[:20]}...")
     else:
         logger.error(f"[VIDEO] Failed to send video: {result}")
@@ -134,35 +181,39 @@ STATES = {
 }
 
 
+# Одно соединение на инстанс: все запросы апдейта (и следующих апдейтов тёплого инстанса) идут через него
+_db_conn = None
+
+
 def get_db():
-    conn = psycopg2.connect(DATABASE_URL)
-    conn.autocommit = True
-    return conn
+    global _db_conn
+    if _db_conn is None or _db_conn.closed:
+        _db_conn = psycopg2.connect(DATABASE_URL)
+        _db_conn.autocommit = True
+    return _db_conn
+
+
+def close_db():
+    global _db_conn
+    if _db_conn is not None:
+        try:
+            _db_conn.close()
+        except Exception:
+            pass
+        _db_conn = None
 
 
 def db_execute(query, params=None):
-    conn = get_db()
-    cur = conn.cursor()
-    if params:
-        full_query = query
-        for p in params:
-            if p is None:
-                full_query = full_query.replace("%s", "NULL", 1)
-            elif isinstance(p, (int, float)):
-                full_query = full_query.replace("%s", str(p), 1)
-            else:
-                escaped = str(p).replace("'", "''")
-                full_query = full_query.replace("%s", f"'{escaped}'", 1)
-        cur.execute(full_query)
-    else:
-        cur.execute(query)
-    try:
-        rows = cur.fetchall()
-    except Exception:
-        rows = []
-    cur.close()
-    conn.close()
-    return rows
+    """Выполняет запрос с параметрами на стороне драйвера. Соединение, закрытое сервером за время простоя, пересоздаётся один раз"""
+    for attempt in range(2):
+        try:
+            with get_db().cursor() as cur:
+                cur.execute(query, params)
+                return cur.fetchall() if cur.description else []
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            close_db()
+            if attempt:
+                raise
 
 
 def send_message(chat_id, text, reply_markup=None):
@@ -212,20 +263,11 @@ def answer_callback(callback_query_id):
 
 def get_or_create_user(user_id, username, first_name, utm_source=None):
     rows = db_execute(
-        f"SELECT id, current_state FROM {DB_SCHEMA}.qualifier_users WHERE user_id = %s",
-        [user_id],
-    )
-    if rows:
-        db_execute(
-            f"UPDATE {DB_SCHEMA}.qualifier_users SET last_active_at = NOW() WHERE user_id = %s",
-            [user_id],
-        )
-        return rows[0][1]
-    db_execute(
-        f"INSERT INTO {DB_SCHEMA}.qualifier_users (user_id, username, first_name, utm_source) VALUES (%s, %s, %s, %s)",
+        f"INSERT INTO {DB_SCHEMA}.qualifier_users (user_id, username, first_name, utm_source) VALUES (%s, %s, %s, %s) "
+        f"ON CONFLICT (user_id) DO UPDATE SET last_active_at = NOW() RETURNING current_state",
         [user_id, username, first_name, utm_source],
     )
-    return "start"
+    return rows[0][0] or "start"
 
 
 def set_state(user_id, state):
@@ -245,20 +287,37 @@ def get_state(user_id):
     return "start"
 
 
-def save_answer(user_id, field, value):
-    rows = db_execute(
-        f"SELECT id FROM {DB_SCHEMA}.qualifier_answers WHERE user_id = %s AND completed_at IS NULL",
-        [user_id],
+def _upsert_open_row(table, open_condition, field, value, user_id, state):
+    """Пишет поле в открытую строку таблицы (создаёт её при отсутствии) и, если передан state, переводит пользователя
+    в новое состояние — всё одним запросом через data-modifying CTE"""
+    query = (
+        f"WITH upd AS (UPDATE {DB_SCHEMA}.{table} SET {field} = %(value)s "
+        f"WHERE user_id = %(user_id)s AND {open_condition} RETURNING id), "
+        f"ins AS (INSERT INTO {DB_SCHEMA}.{table} (user_id, {field}) "
+        f"SELECT %(user_id)s, %(value)s WHERE NOT EXISTS (SELECT 1 FROM upd) RETURNING id) "
     )
-    if not rows:
-        db_execute(
-            f"INSERT INTO {DB_SCHEMA}.qualifier_answers (user_id) VALUES (%s)",
-            [user_id],
+    if state is None:
+        query += "SELECT 1"
+    else:
+        query += (
+            f"UPDATE {DB_SCHEMA}.qualifier_users SET current_state = %(state)s, last_active_at = NOW() "
+            f"WHERE user_id = %(user_id)s"
         )
-    db_execute(
-        f"UPDATE {DB_SCHEMA}.qualifier_answers SET {field} = %s WHERE user_id = %s AND completed_at IS NULL",
-        [value, user_id],
+    db_execute(query, {"value": value, "user_id": user_id, "state": state})
+
+
+def reset_answers(user_id, state, open_new=False):
+    """Удаляет незавершённые ответы (при open_new — заводит пустую строку) и ставит состояние одним запросом"""
+    query = (
+        f"WITH del AS (DELETE FROM {DB_SCHEMA}.qualifier_answers WHERE user_id = %(user_id)s AND completed_at IS NULL), "
+        f"ins AS (INSERT INTO {DB_SCHEMA}.qualifier_answers (user_id) SELECT %(user_id)s WHERE %(open_new)s) "
+        f"UPDATE {DB_SCHEMA}.qualifier_users SET current_state = %(state)s, last_active_at = NOW() WHERE user_id = %(user_id)s"
     )
+    db_execute(query, {"user_id": user_id, "state": state, "open_new": open_new})
+
+
+def save_answer(user_id, field, value, state=None):
+    _upsert_open_row("qualifier_answers", "completed_at IS NULL", field, value, user_id, state)
 
 
 def complete_answers(user_id):
@@ -283,20 +342,8 @@ def get_answers(user_id):
     return {}
 
 
-def save_lead(user_id, field, value):
-    rows = db_execute(
-        f"SELECT id FROM {DB_SCHEMA}.qualifier_leads WHERE user_id = %s AND status = 'new'",
-        [user_id],
-    )
-    if not rows:
-        db_execute(
-            f"INSERT INTO {DB_SCHEMA}.qualifier_leads (user_id) VALUES (%s)",
-            [user_id],
-        )
-    db_execute(
-        f"UPDATE {DB_SCHEMA}.qualifier_leads SET {field} = %s WHERE user_id = %s AND status = 'new'",
-        [value, user_id],
-    )
+def save_lead(user_id, field, value, state=None):
+    _upsert_open_row("qualifier_leads", "status = 'new'", field, value, user_id, state)
 
 
 def get_lead(user_id):
@@ -335,7 +382,92 @@ def get_case_for_niche(niche):
     return CASES["default"]
 
 
+def ai_cache_key(answers):
+    """Ключ кэша — SHA-256 нормализованного набора из четырёх ответов"""
+    parts = [" ".join(str(answers.get(f) or "").lower().split()) for f in AI_ANSWER_FIELDS]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def get_cached_ai_solutions(key):
+    try:
+        rows = db_execute(
+            f"UPDATE {DB_SCHEMA}.qualifier_ai_solutions SET hits = hits + 1 WHERE cache_key = %s RETURNING content",
+            [key],
+        )
+    except Exception as e:
+        logger.warning(f"[AI] cache read failed: {e}")
+        return None
+    return rows[0][0] if rows else None
+
+
+def save_ai_solutions(key, answers, content):
+    try:
+        db_execute(
+            f"INSERT INTO {DB_SCHEMA}.qualifier_ai_solutions (cache_key, niche, pain, automation_level, sales_channel, content) "
+            f"VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (cache_key) DO NOTHING",
+            [key] + [answers.get(f) for f in AI_ANSWER_FIELDS] + [content],
+        )
+    except Exception as e:
+        logger.warning(f"[AI] cache write failed: {e}")
+
+
 def generate_ai_solutions(answers):
+    """Персональная рекомендация: из кэша по набору ответов, при промахе — запрос к LLM с сохранением результата"""
+    key = ai_cache_key(answers)
+    cached = get_cached_ai_solutions(key)
+    if cached:
+        return cached
+    content = request_ai_solutions(answers)
+    if content:
+        save_ai_solutions(key, answers, content)
+    return content
+
+
+def internal_authorized(event):
+    """Служебный вызов (_internal) разрешён только с X-Internal-Key, совпадающим с INTERNAL_KEY.
+    Если секрет не задан, служебные вызовы отклоняются"""
+    if not INTERNAL_KEY:
+        return False
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    return hmac.compare_digest(headers.get("x-internal-key") or "", INTERNAL_KEY)
+
+
+def warm_ai_solutions():
+    """Прогрев кэша: генерирует рекомендации для всех сочетаний вариантов из кнопок, которых ещё нет в кэше.
+    Свой вариант ниши (свободный текст) сюда не попадает и кэшируется при первом лиде. Вызов можно повторять —
+    каждый продолжает с оставшихся сочетаний"""
+    started = time.time()
+    niches = [o for o in QUESTION_1_OPTIONS if o != CALLBACK_MAP.get("q1_5")]
+    combos = [
+        dict(zip(AI_ANSWER_FIELDS, combo))
+        for combo in itertools.product(niches, QUESTION_2_OPTIONS, QUESTION_3_OPTIONS, QUESTION_4_OPTIONS)
+    ]
+    keys = [ai_cache_key(c) for c in combos]
+    cached = {r[0] for r in db_execute(
+        f"SELECT cache_key FROM {DB_SCHEMA}.qualifier_ai_solutions WHERE cache_key = ANY(%s)",
+        [keys],
+    )}
+    pending = iter([(k, c) for k, c in zip(keys, combos) if k not in cached])
+    warmed = 0
+    with ThreadPoolExecutor(max_workers=AI_WARM_WORKERS) as pool:
+        futures = {pool.submit(request_ai_solutions, c): (k, c) for k, c in itertools.islice(pending, AI_WARM_WORKERS)}
+        while futures:
+            done = next(as_completed(futures))
+            k, c = futures.pop(done)
+            content = done.result()
+            if content:
+                save_ai_solutions(k, c, content)
+                warmed += 1
+            if time.time() - started < AI_WARM_DEADLINE:
+                for nk, nc in itertools.islice(pending, 1):
+                    futures[pool.submit(request_ai_solutions, nc)] = (nk, nc)
+    remaining = len(combos) - len(cached) - warmed
+    logger.info(f"[AI] warmed {warmed} combinations in {time.time() - started:.1f}s, {remaining} remaining")
+    return {"total": len(combos), "warmed": warmed, "remaining": remaining}
+
+
+def request_ai_solutions(answers):
+    """Запрос персональной рекомендации к LLM (до 30 секунд)"""
     if not VSEGPT_API_KEY:
         return None
 
@@ -423,12 +555,8 @@ def send_admin_notification(user_id, username, answers, lead):
 def handle_start(chat_id, user_id, username, first_name, start_param=None):
     utm = start_param if start_param and start_param != "start" else None
     get_or_create_user(user_id, username, first_name, utm)
-    set_state(user_id, STATES["start"])
-
-    db_execute(
-        f"DELETE FROM {DB_SCHEMA}.qualifier_answers WHERE user_id = %s AND completed_at IS NULL",
-        [user_id],
-    )
+    # Кнопки приветствия ведут к первому вопросу — состояние q1 ставится сразу вместе со сбросом ответов
+    reset_answers(user_id, STATES["q1"])
 
     # Отправляем приветственное видео с текстом и кнопками
     video_result = send_welcome_video(
@@ -448,23 +576,16 @@ def handle_start(chat_id, user_id, username, first_name, start_param=None):
             "Примеры автоматизаций",
         ])
 
-    set_state(user_id, STATES["q1"])
-
 
 def handle_callback(chat_id, user_id, username, callback_data, callback_query_id):
     answer_callback(callback_query_id)
-    state = get_state(user_id)
 
     # Resolve short callback key to full text via CALLBACK_MAP
     full_text = CALLBACK_MAP.get(callback_data, callback_data)
 
     if callback_data == "go" or callback_data == "diag_yes":
-        db_execute(
-            f"DELETE FROM {DB_SCHEMA}.qualifier_answers WHERE user_id = %s AND completed_at IS NULL",
-            [user_id],
-        )
+        reset_answers(user_id, STATES["q1"])
         send_message_inline(chat_id, QUESTION_1_TEXT, QUESTION_1_OPTIONS)
-        set_state(user_id, STATES["q1"])
         return
 
     if callback_data == "examples":
@@ -475,17 +596,9 @@ def handle_callback(chat_id, user_id, username, callback_data, callback_query_id
         return
 
     if callback_data == "consult_now":
-        db_execute(
-            f"DELETE FROM {DB_SCHEMA}.qualifier_answers WHERE user_id = %s AND completed_at IS NULL",
-            [user_id],
-        )
-        db_execute(
-            f"INSERT INTO {DB_SCHEMA}.qualifier_answers (user_id) VALUES (%s)",
-            [user_id],
-        )
+        reset_answers(user_id, STATES["ask_name"], open_new=True)
         send_message(chat_id, CONSULTATION_TEXT)
         send_message(chat_id, ASK_NAME_TEXT)
-        set_state(user_id, STATES["ask_name"])
         return
 
     if callback_data in ["q1_1", "q1_2", "q1_3", "q1_4", "q1_5"]:
@@ -493,21 +606,18 @@ def handle_callback(chat_id, user_id, username, callback_data, callback_query_id
             send_message(chat_id, "Напишите вашу нишу в 1-2 словах:")
             set_state(user_id, STATES["q1_custom"])
             return
-        save_answer(user_id, "niche", full_text)
+        save_answer(user_id, "niche", full_text, STATES["q2"])
         send_message_inline(chat_id, QUESTION_2_TEXT, QUESTION_2_OPTIONS)
-        set_state(user_id, STATES["q2"])
         return
 
     if callback_data in ["q2_1", "q2_2", "q2_3", "q2_4", "q2_5"]:
-        save_answer(user_id, "pain", full_text)
+        save_answer(user_id, "pain", full_text, STATES["q3"])
         send_message_inline(chat_id, QUESTION_3_TEXT, QUESTION_3_OPTIONS)
-        set_state(user_id, STATES["q3"])
         return
 
     if callback_data in ["q3_1", "q3_2", "q3_3"]:
-        save_answer(user_id, "automation_level", full_text)
+        save_answer(user_id, "automation_level", full_text, STATES["q4"])
         send_message_inline(chat_id, QUESTION_4_TEXT, QUESTION_4_OPTIONS)
-        set_state(user_id, STATES["q4"])
         return
 
     if callback_data in ["q4_1", "q4_2", "q4_3", "q4_4", "q4_5", "q4_6"]:
@@ -533,9 +643,8 @@ def handle_callback(chat_id, user_id, username, callback_data, callback_query_id
         return
 
     if callback_data in ["fmt_1", "fmt_2", "fmt_3", "fmt_4"]:
-        save_lead(user_id, "preferred_format", full_text)
+        save_lead(user_id, "preferred_format", full_text, STATES["ask_time"])
         send_message_inline(chat_id, ASK_TIME_TEXT, TIME_OPTIONS)
-        set_state(user_id, STATES["ask_time"])
         return
 
     if callback_data in ["time_1", "time_2", "time_3", "time_4"]:
@@ -607,36 +716,33 @@ def finalize_lead(chat_id, user_id, username):
     set_state(user_id, STATES["done"])
 
 
-def handle_text_message(chat_id, user_id, username, text):
-    state = get_state(user_id)
+def handle_text_message(chat_id, user_id, username, text, state=None):
+    if state is None:
+        state = get_state(user_id)
 
     if state == STATES["q1_custom"]:
-        save_answer(user_id, "niche", text.strip())
+        save_answer(user_id, "niche", text.strip(), STATES["q2"])
         send_message_inline(chat_id, QUESTION_2_TEXT, QUESTION_2_OPTIONS)
-        set_state(user_id, STATES["q2"])
         return
 
     if state == STATES["ask_name"]:
-        save_lead(user_id, "contact_name", text.strip())
+        save_lead(user_id, "contact_name", text.strip(), STATES["ask_contact"])
         send_message_contact_keyboard(chat_id, ASK_CONTACT_TEXT)
-        set_state(user_id, STATES["ask_contact"])
         return
 
     if state == STATES["ask_contact"]:
         contact = text.strip()
         if contact.startswith("@") or contact.startswith("+") or contact.replace(" ", "").replace("-", "").replace("(", "").replace(")", "").isdigit():
             if contact.startswith("@"):
-                save_lead(user_id, "contact_telegram", contact)
+                save_lead(user_id, "contact_telegram", contact, STATES["ask_format"])
             else:
-                save_lead(user_id, "contact_phone", contact)
+                save_lead(user_id, "contact_phone", contact, STATES["ask_format"])
             remove_keyboard(chat_id, "Принято!")
             send_message_inline(chat_id, ASK_FORMAT_TEXT, FORMAT_OPTIONS)
-            set_state(user_id, STATES["ask_format"])
         else:
-            save_lead(user_id, "contact_telegram", contact)
+            save_lead(user_id, "contact_telegram", contact, STATES["ask_format"])
             remove_keyboard(chat_id, "Принято!")
             send_message_inline(chat_id, ASK_FORMAT_TEXT, FORMAT_OPTIONS)
-            set_state(user_id, STATES["ask_format"])
         return
 
     if state == STATES["ask_time_custom"]:
@@ -717,6 +823,20 @@ def handler(event, context):
             "body": json.dumps({"status": "ok"}),
         }
 
+    if body.get("_internal") == "warm_ai_cache":
+        if not internal_authorized(event):
+            logger.warning("[WARM] Rejected _internal call without a valid X-Internal-Key")
+            return {
+                "statusCode": 403,
+                "headers": {"Access-Control-Allow-Origin": "*"},
+                "body": json.dumps({"error": "forbidden"}),
+            }
+        return {
+            "statusCode": 200,
+            "headers": {"Access-Control-Allow-Origin": "*"},
+            "body": json.dumps(warm_ai_solutions()),
+        }
+
     try:
         if "callback_query" in body:
             cq = body["callback_query"]
@@ -749,8 +869,8 @@ def handler(event, context):
                 elif text == "/about":
                     send_message(chat_id, ABOUT_TEXT)
                 else:
-                    get_or_create_user(user_id, username, first_name)
-                    handle_text_message(chat_id, user_id, username, text)
+                    state = get_or_create_user(user_id, username, first_name)
+                    handle_text_message(chat_id, user_id, username, text, state)
 
     except Exception as e:
         logger.error(f"Error processing update: {e}", exc_info=True)
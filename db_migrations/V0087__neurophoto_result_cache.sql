@@ -0,0 +1,14 @@
+-- Кэш результатов генерации: одинаковые (модель, промпт, входные фото, соотношение сторон) отдаются без повторного платного вызова
+CREATE TABLE IF NOT EXISTS neurophoto_result_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    model TEXT NOT NULL,
+    prompt_hash VARCHAR(64) NOT NULL,
+    image_hash VARCHAR(64) NOT NULL DEFAULT '',
+    aspect_ratio VARCHAR(32) NOT NULL DEFAULT '',
+    image_url TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_neurophoto_result_cache_expires ON neurophoto_result_cache(expires_at);
@@ -0,0 +1,11 @@
+-- Состояние circuit breaker по моделям генерации, общее для всех инстансов функции
+CREATE TABLE IF NOT EXISTS neurophoto_provider_health (
+    model_key VARCHAR(64) PRIMARY KEY,
+    provider VARCHAR(32) NOT NULL,
+    consecutive_failures INTEGER NOT NULL DEFAULT 0,
+    opened_until TIMESTAMP DEFAULT NULL,
+    last_error TEXT DEFAULT NULL,
+    last_success_at TIMESTAMP DEFAULT NULL,
+    last_failure_at TIMESTAMP DEFAULT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,14 @@
+-- Чанки источников базы знаний с полнотекстовым индексом (русская конфигурация)
+CREATE TABLE IF NOT EXISTS t_p60354232_chatbot_platform_cre.knowledge_chunks (
+    id BIGSERIAL PRIMARY KEY,
+    source_id INTEGER NOT NULL REFERENCES t_p60354232_chatbot_platform_cre.knowledge_sources(id),
+    bot_id INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('russian', content)) STORED,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_chunks_tsv ON t_p60354232_chatbot_platform_cre.knowledge_chunks USING GIN (tsv);
+CREATE INDEX IF NOT EXISTS idx_knowledge_chunks_bot ON t_p60354232_chatbot_platform_cre.knowledge_chunks (bot_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_knowledge_chunks_source ON t_p60354232_chatbot_platform_cre.knowledge_chunks (source_id, chunk_index);
@@ -0,0 +1,2 @@
+-- Локальные векторы чанков (float32, хэшированный TF-IDF) для векторного поиска без внешних сервисов
+ALTER TABLE t_p60354232_chatbot_platform_cre.knowledge_chunks ADD COLUMN IF NOT EXISTS embedding BYTEA DEFAULT NULL;
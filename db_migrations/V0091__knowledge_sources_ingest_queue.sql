@@ -0,0 +1,10 @@
+-- Фоновая загрузка источников базы знаний: очередь pending -> processing -> ready/error с арендой
+ALTER TABLE t_p60354232_chatbot_platform_cre.knowledge_sources
+  ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS locked_until TIMESTAMP DEFAULT NULL,
+  ADD COLUMN IF NOT EXISTS text_length INTEGER DEFAULT NULL,
+  ADD COLUMN IF NOT EXISTS chunks_count INTEGER DEFAULT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_sources_queue
+  ON t_p60354232_chatbot_platform_cre.knowledge_sources (id)
+  WHERE status IN ('pending', 'processing');
@@ -0,0 +1,5 @@
+-- Хэш извлечённого текста: массовый импорт пропускает страницы с уже проиндексированным содержимым
+ALTER TABLE t_p60354232_chatbot_platform_cre.knowledge_sources ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64) DEFAULT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_sources_bot_hash
+  ON t_p60354232_chatbot_platform_cre.knowledge_sources (bot_id, content_hash);
@@ -0,0 +1,19 @@
+-- Дедупликация источников: хэш текста уникален в пределах бота, хэш файла позволяет переиспользовать объект в S3
+UPDATE t_p60354232_chatbot_platform_cre.knowledge_sources SET content_hash = NULL
+WHERE status = 'error' AND content_hash IS NOT NULL;
+
+UPDATE t_p60354232_chatbot_platform_cre.knowledge_sources s SET content_hash = NULL
+WHERE content_hash IS NOT NULL AND EXISTS (
+  SELECT 1 FROM t_p60354232_chatbot_platform_cre.knowledge_sources d
+  WHERE d.bot_id = s.bot_id AND d.content_hash = s.content_hash AND d.id < s.id
+);
+
+DROP INDEX IF EXISTS t_p60354232_chatbot_platform_cre.idx_knowledge_sources_bot_hash;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_knowledge_sources_bot_content_hash
+  ON t_p60354232_chatbot_platform_cre.knowledge_sources (bot_id, content_hash) WHERE content_hash IS NOT NULL;
+
+ALTER TABLE t_p60354232_chatbot_platform_cre.knowledge_sources ADD COLUMN IF NOT EXISTS file_hash VARCHAR(64) DEFAULT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_sources_file_hash
+  ON t_p60354232_chatbot_platform_cre.knowledge_sources (file_hash) WHERE file_hash IS NOT NULL;
@@ -0,0 +1,20 @@
+-- Очередь генерации распаковок: задача переживает потерю вызова и рестарт инстанса
+CREATE TABLE IF NOT EXISTS expert_generation_jobs (
+    id SERIAL PRIMARY KEY,
+    telegram_id TEXT NOT NULL,
+    chat_id BIGINT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'processing', 'done', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    locked_until TIMESTAMP DEFAULT NULL,
+    result TEXT DEFAULT NULL,
+    error_message TEXT DEFAULT NULL,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Ключ идемпотентности — пользователь: одновременно у него может быть только одна активная задача
+CREATE UNIQUE INDEX IF NOT EXISTS idx_expert_generation_jobs_active_user
+  ON expert_generation_jobs (telegram_id) WHERE status IN ('pending', 'processing');
+
+CREATE INDEX IF NOT EXISTS idx_expert_generation_jobs_queue
+  ON expert_generation_jobs (status, locked_until) WHERE status IN ('pending', 'processing');
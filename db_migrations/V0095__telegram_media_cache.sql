@@ -0,0 +1,9 @@
+-- file_id медиа, уже загруженных в Telegram: повторная отправка идёт по file_id без скачивания исходника.
+-- file_id привязан к боту, поэтому ключ — (бот, исходная ссылка)
+CREATE TABLE IF NOT EXISTS telegram_media_cache (
+    bot VARCHAR(64) NOT NULL,
+    source_url TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (bot, source_url)
+);
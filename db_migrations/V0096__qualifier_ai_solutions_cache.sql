@@ -0,0 +1,12 @@
+-- Кэш персональных рекомендаций квалификатора: ответы диагностики выбираются из коротких списков,
+-- поэтому одинаковый набор ответов получает готовый текст без запроса к LLM
+CREATE TABLE IF NOT EXISTS qualifier_ai_solutions (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    niche TEXT,
+    pain TEXT,
+    automation_level TEXT,
+    sales_channel TEXT,
+    content TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,13 @@
+-- Кэш проверки живости URL публикаций: валидаторы для условных запросов (If-None-Match / If-Modified-Since),
+-- хэш и размер тела. Неизменившиеся страницы перепроверяются без скачивания
+CREATE TABLE IF NOT EXISTS geo_url_probe_cache (
+  url text PRIMARY KEY,
+  status integer NOT NULL,
+  ok boolean NOT NULL DEFAULT false,
+  etag text NULL,
+  last_modified text NULL,
+  content_hash text NULL,
+  size integer NULL,
+  fetched_at timestamptz NULL,
+  checked_at timestamptz NOT NULL DEFAULT now()
+);
@@ -0,0 +1,20 @@
+-- Один запрос с данным текстом (без учёта регистра) на проект: дубли схлопываются в самый ранний,
+-- ссылки на них переносятся, после чего bulk-импорт опирается на уникальный индекс (ON CONFLICT DO NOTHING)
+CREATE TEMP TABLE geo_query_dups AS
+SELECT id, keep_id FROM (
+  SELECT id,
+         FIRST_VALUE(id) OVER (PARTITION BY tenant_id, project_id, LOWER(text) ORDER BY created_at, id) AS keep_id
+  FROM geo_tracked_queries
+  WHERE project_id IS NOT NULL
+) d
+WHERE id <> keep_id;
+
+UPDATE geo_llm_responses r SET query_id = d.keep_id FROM geo_query_dups d WHERE r.query_id = d.id;
+UPDATE geo_content_drafts c SET query_id = d.keep_id FROM geo_query_dups d WHERE c.query_id = d.id;
+UPDATE geo_drafts g SET query_id = d.keep_id FROM geo_query_dups d WHERE g.query_id = d.id;
+UPDATE geo_publications p SET query_id = d.keep_id FROM geo_query_dups d WHERE p.query_id = d.id;
+UPDATE geo_publications_v2 p SET query_id = d.keep_id FROM geo_query_dups d WHERE p.query_id = d.id;
+DELETE FROM geo_tracked_queries q USING geo_query_dups d WHERE q.id = d.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS geo_queries_project_text_uidx
+  ON geo_tracked_queries (tenant_id, project_id, LOWER(text));
@@ -0,0 +1,7 @@
+-- Версия данных tenant'а для кэша ответов geo-эндпоинтов чтения (ETag / 304).
+-- Увеличивается писателями: опрос нейросетей, проверка публикаций, CRUD запросов/брендов/публикаций
+CREATE TABLE IF NOT EXISTS geo_data_versions (
+  tenant_id uuid PRIMARY KEY,
+  version bigint NOT NULL DEFAULT 0,
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
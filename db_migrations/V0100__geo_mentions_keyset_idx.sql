@@ -0,0 +1,2 @@
+-- Keyset-пагинация ленты упоминаний и экспорт: порядок (created_at, id) внутри tenant'а берётся из индекса
+CREATE INDEX IF NOT EXISTS ix_geo_ment_tenant_created ON geo_mentions (tenant_id, created_at DESC, id DESC);
@@ -0,0 +1,16 @@
+-- Манифест выгрузки истории опросов в Parquet: какие (tenant, набор, день) уже лежат в S3.
+-- Дни без данных тоже записываются (rows = 0, s3_key = NULL), чтобы выгрузка шла дальше
+CREATE TABLE IF NOT EXISTS geo_export_manifest (
+  tenant_id uuid NOT NULL,
+  dataset text NOT NULL,
+  day date NOT NULL,
+  s3_key text NULL,
+  rows integer NOT NULL DEFAULT 0,
+  bytes bigint NOT NULL DEFAULT 0,
+  exported_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (tenant_id, dataset, day)
+);
+
+-- Выборка «tenant за сутки» для каждого набора идёт по индексу
+CREATE INDEX IF NOT EXISTS ix_geo_resp_tenant_polled ON geo_llm_responses (tenant_id, polled_at);
+CREATE INDEX IF NOT EXISTS idx_geo_pub_checks_v2_tenant_checked ON geo_publication_checks_v2 (tenant_id, checked_at);
@@ -0,0 +1,3 @@
+-- Векторы чанков перешли с плотных 128 float32 на разреженные (хэши признаков uint32 + tf float32):
+-- старые значения сбрасываются, vectors.embed_missing пересчитает их при первом поиске по боту
+UPDATE t_p60354232_chatbot_platform_cre.knowledge_chunks SET embedding = NULL WHERE embedding IS NOT NULL;
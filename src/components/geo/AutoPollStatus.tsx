@@ -127,9 +127,7 @@ export default function AutoPollStatus() {
       });
       // Сбрасываем кэш — индикатор обновит «не запускался → только что»
       qc.invalidateQueries({ queryKey: ['geo-settings-status'] });
-      qc.invalidateQueries({ queryKey: ['geo-overview'] });
-      qc.invalidateQueries({ queryKey: ['geo-trend'] });
-      qc.invalidateQueries({ queryKey: ['geo-mentions'] });
+      qc.invalidateQueries({ queryKey: ['geo-dashboard'] });
       qc.invalidateQueries({ queryKey: ['geo-coverage'] });
       qc.invalidateQueries({ queryKey: ['geo-queries'] });
     },
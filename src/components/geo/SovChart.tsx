@@ -1,11 +1,26 @@
+import { useMemo } from 'react';
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer, Legend } from 'recharts';
+import type { GeoSovTrend } from '@/lib/geo/api';
 
-type Brand = { id: string; name: string; is_own: boolean };
 type Point = Record<string, number | string>;
 
 const PALETTE = ['#6366f1', '#10b981', '#f59e0b', '#ef4444', '#8b5cf6', '#06b6d4', '#84cc16', '#ec4899'];
 
-export default function SovChart({ trend, brands }: { trend: Point[]; brands: Brand[] }) {
+export default function SovChart({ data }: { data?: GeoSovTrend }) {
+  // Точки для recharts: ключи линий — id брендов, чтобы одноимённые бренды не склеивались
+  const trend = useMemo<Point[]>(
+    () =>
+      (data?.days || []).map((day, di) => {
+        const point: Point = { day, total: data!.total[di] };
+        data!.brands.forEach((b, bi) => {
+          point[b.id] = data!.share[bi][di];
+        });
+        return point;
+      }),
+    [data],
+  );
+  const brands = data?.brands || [];
+
   if (!trend.length || !brands.length) {
     return (
       <div className="h-72 flex items-center justify-center text-slate-400 text-sm">
@@ -33,7 +48,8 @@ export default function SovChart({ trend, brands }: { trend: Point[]; brands: Br
             <Line
               key={b.id}
               type="monotone"
-              dataKey={b.name}
+              dataKey={b.id}
+              name={b.name}
               stroke={b.is_own ? '#6366f1' : PALETTE[(i + 1) % PALETTE.length]}
               strokeWidth={b.is_own ? 3 : 2}
               dot={{ r: 3 }}
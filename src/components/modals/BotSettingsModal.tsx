@@ -84,6 +84,14 @@ export default function BotSettingsModal({ isOpen, onClose, botName, botId }: Bo
     }
   }, [isOpen, currentBotId]);
 
+  const hasPendingSources = sources.some(s => s.status === 'pending' || s.status === 'processing');
+
+  useEffect(() => {
+    if (!isOpen || !hasPendingSources) return;
+    const timer = setInterval(loadSources, 3000);
+    return () => clearInterval(timer);
+  }, [isOpen, hasPendingSources, currentBotId]);
+
   const loadBotSettings = async () => {
     if (!BOTS_API || !currentBotId) return;
     try {
@@ -156,8 +164,11 @@ export default function BotSettingsModal({ isOpen, onClose, botName, botId }: Bo
         body: JSON.stringify({ action: 'add_url', bot_id: currentBotId, url: websiteUrl })
       });
       const data = await res.json();
-      if (data.status === 'ready') {
-        toast({ title: 'Сайт добавлен', description: `Извлечено ${data.text_length} символов текста` });
+      if (data.duplicate_of) {
+        toast({ title: 'Сайт уже в базе знаний' });
+        setWebsiteUrl('');
+      } else if (data.status === 'pending') {
+        toast({ title: 'Сайт добавлен', description: 'Текст извлекается в фоне — статус обновится автоматически' });
         setWebsiteUrl('');
         loadSources();
       } else {
@@ -183,7 +194,10 @@ export default function BotSettingsModal({ isOpen, onClose, botName, botId }: Bo
         body: JSON.stringify({ action: 'add_text', bot_id: currentBotId, title: 'Текст', text: textInput })
       });
       const data = await res.json();
-      if (data.status === 'ready') {
+      if (data.duplicate_of) {
+        toast({ title: 'Такой текст уже есть в базе знаний' });
+        setTextInput('');
+      } else if (data.status === 'ready') {
         toast({ title: 'Текст добавлен в базу знаний' });
         setTextInput('');
         loadSources();
@@ -220,8 +234,10 @@ export default function BotSettingsModal({ isOpen, onClose, botName, botId }: Bo
           body: JSON.stringify({ action: 'add_file', bot_id: currentBotId, file_data: base64, file_name: file.name, file_type: ext })
         });
         const data = await res.json();
-        if (data.status === 'ready') {
-          toast({ title: 'Файл загружен', description: `${file.name} — извлечено ${data.text_length} символов` });
+        if (data.duplicate_of) {
+          toast({ title: 'Файл уже в базе знаний', description: file.name });
+        } else if (data.status === 'pending') {
+          toast({ title: 'Файл загружен', description: `${file.name} — текст извлекается в фоне` });
           loadSources();
         } else {
           toast({ title: 'Ошибка обработки файла', description: data.error, variant: 'destructive' });
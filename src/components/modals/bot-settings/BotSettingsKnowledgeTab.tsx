@@ -134,8 +134,8 @@ export default function BotSettingsKnowledgeTab({
                     <p className="text-xs text-muted-foreground">
                       {s.source_type === 'url' ? s.url : s.file_type?.toUpperCase() || 'Текст'}
                       {' '}&middot;{' '}
-                      <Badge variant={s.status === 'ready' ? 'secondary' : 'destructive'} className="text-[10px]">
-                        {s.status === 'ready' ? 'Готово' : 'Ошибка'}
+                      <Badge variant={s.status === 'ready' ? 'secondary' : s.status === 'error' ? 'destructive' : 'outline'} className="text-[10px]">
+                        {s.status === 'ready' ? 'Готово' : s.status === 'error' ? 'Ошибка' : 'В обработке'}
                       </Badge>
                     </p>
                   </div>
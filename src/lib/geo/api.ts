@@ -56,8 +56,17 @@ function withProject(url: string, init: RequestInit): { url: string; init: Reque
   return { url: nextUrl, init: nextInit };
 }
 
+// Сервер разрешает браузеру stale-while-revalidate для отчётов. Сразу после собственных изменений
+// (опрос, проверка, правка) перечитываем без устаревшей копии — браузер пошлёт If-None-Match.
+const FRESH_AFTER_WRITE_MS = 60_000;
+let lastWriteAt = 0;
+
 async function request<T>(url: string, init: RequestInit = {}): Promise<T> {
   const token = tokenStore.get();
+  const isRead = (init.method || 'GET').toUpperCase() === 'GET';
+  if (isRead && Date.now() - lastWriteAt < FRESH_AFTER_WRITE_MS) {
+    init = { ...init, cache: 'no-cache' };
+  }
   const headers: Record<string, string> = {
     'Content-Type': 'application/json',
     ...(init.headers as Record<string, string> | undefined),
@@ -76,6 +85,7 @@ async function request<T>(url: string, init: RequestInit = {}): Promise<T> {
       'Не удалось связаться с сервером. Проверьте интернет-соединение и попробуйте ещё раз.',
     );
   }
+  if (!isRead) lastWriteAt = Date.now();
   const text = await res.text();
   let data: { error?: string; message?: string } = {};
   if (text) {
@@ -238,6 +248,11 @@ export const geoApi = {
         `${GEO_QUERIES_URL}?action=bulk_create`,
         { method: 'POST', body: JSON.stringify({ items }) },
       ),
+    bulkCreateCsv: (csv: string) =>
+      request<{ created: number; skipped: number; total: number }>(
+        `${GEO_QUERIES_URL}?action=bulk_create`,
+        { method: 'POST', body: JSON.stringify({ csv }) },
+      ),
     competitorGaps: (days = 14) =>
       request<{ gaps: GeoCompetitorGap[]; weak_spots: GeoCompetitorGap[]; window_days: number }>(
         `${GEO_QUERIES_URL}?action=competitor_gaps&days=${days}`,
@@ -303,17 +318,28 @@ export const geoApi = {
     overview: (days = 7) =>
       request<GeoOverview>(`${GEO_ANALYTICS_URL}?action=overview&days=${days}`, { method: 'GET' }),
     sovTrend: (days = 7) =>
-      request<{ trend: Array<Record<string, number | string>>; brands: Array<{ id: string; name: string; is_own: boolean }> }>(
+      request<GeoSovTrend>(
         `${GEO_ANALYTICS_URL}?action=sov_trend&days=${days}`,
         { method: 'GET' },
       ),
-    mentions: (days = 7, limit = 20) =>
-      request<{ mentions: GeoMention[] }>(
-        `${GEO_ANALYTICS_URL}?action=mentions&days=${days}&limit=${limit}`,
+    mentions: (days = 7, limit = 20, cursor?: string | null) =>
+      request<{ mentions: GeoMention[]; next_cursor: string | null }>(
+        `${GEO_ANALYTICS_URL}?action=mentions&days=${days}&limit=${limit}` +
+          (cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''),
+        { method: 'GET' },
+      ),
+    exportMentions: (days = 30, format: 'csv' | 'ndjson' = 'csv') =>
+      request<{ url: string; expires_in: number; format: string; rows: number; days: number }>(
+        `${GEO_ANALYTICS_URL}?action=export&days=${days}&format=${format}`,
         { method: 'GET' },
       ),
     coverage: (days = 7) =>
       request<{ coverage: GeoCoverageRow[] }>(`${GEO_ANALYTICS_URL}?action=coverage&days=${days}`, { method: 'GET' }),
+    dashboard: (days = 7, limit = 20) =>
+      request<GeoDashboardData>(
+        `${GEO_ANALYTICS_URL}?action=dashboard&days=${days}&limit=${limit}`,
+        { method: 'GET' },
+      ),
   },
 
   content: {
@@ -362,6 +388,15 @@ export const geoApi = {
           error?: string;
         }>;
       }>(`${GEO_PUBS_URL}?id=${id}&action=check`, { method: 'POST', body: '{}' }),
+    checkBatch: () =>
+      request<{
+        publications: number;
+        queries: number;
+        skipped_queries: number;
+        requests: number;
+        found: number;
+        results: Record<string, Record<string, { found: boolean; snippet: string; matches: string[] }>>;
+      }>(`${GEO_PUBS_URL}?action=check_batch`, { method: 'POST', body: '{}' }),
     history: (id: string) =>
       request<{ checks: Array<{ id: string; provider: string; found: boolean; snippet: string | null; checked_at: string }> }>(
         `${GEO_PUBS_URL}?id=${id}&action=checks`,
@@ -530,4 +565,21 @@ export type GeoCoverageRow = {
   own_mentions: number;
   competitor_mentions: number;
   last_polled: string | null;
-};
\ No newline at end of file
+};
+/** Колоночный SOV по дням: counts/share — [индекс бренда в brands][индекс дня в days]. */
+export type GeoSovTrend = {
+  days: string[];
+  total: number[];
+  brands: Array<{ id: string; name: string; is_own: boolean }>;
+  counts: number[][];
+  share: number[][];
+};
+
+export type GeoDashboardData = {
+  project_id: string;
+  overview: GeoOverview;
+  sov_trend: GeoSovTrend;
+  mentions: GeoMention[];
+  mentions_next_cursor: string | null;
+  coverage: GeoCoverageRow[];
+};
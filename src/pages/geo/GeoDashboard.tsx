@@ -1,7 +1,7 @@
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
 import { useGeoAuth } from '@/contexts/GeoAuthContext';
-import { geoApi } from '@/lib/geo/api';
+import { geoApi, type GeoMention } from '@/lib/geo/api';
 import StatCard from '@/components/geo/StatCard';
 import SovChart from '@/components/geo/SovChart';
 import SovBars from '@/components/geo/SovBars';
@@ -23,24 +23,37 @@ export default function GeoDashboard() {
   const qc = useQueryClient();
   const [days, setDays] = useState(7);
 
-  const overviewQ = useQuery({
-    queryKey: ['geo-overview', days],
-    queryFn: () => geoApi.analytics.overview(days),
+  // Все блоки страницы — одним запросом action=dashboard (один снимок данных, ETag)
+  const dashboardQ = useQuery({
+    queryKey: ['geo-dashboard', days],
+    queryFn: () => geoApi.analytics.dashboard(days, 15),
   });
 
-  const trendQ = useQuery({
-    queryKey: ['geo-trend', days],
-    queryFn: () => geoApi.analytics.sovTrend(days),
-  });
+  // Догрузка ленты упоминаний по курсору (keyset) поверх первой страницы из dashboard
+  const [moreMentions, setMoreMentions] = useState<GeoMention[]>([]);
+  const [moreCursor, setMoreCursor] = useState<string | null | undefined>(undefined);
+  useEffect(() => {
+    setMoreMentions([]);
+    setMoreCursor(undefined);
+  }, [dashboardQ.data]);
+  const mentionsCursor = moreCursor === undefined ? dashboardQ.data?.mentions_next_cursor : moreCursor;
 
-  const mentionsQ = useQuery({
-    queryKey: ['geo-mentions', days],
-    queryFn: () => geoApi.analytics.mentions(days, 15),
+  const loadMoreMentions = useMutation({
+    mutationFn: () => geoApi.analytics.mentions(days, 15, mentionsCursor),
+    onSuccess: (r) => {
+      setMoreMentions((prev) => [...prev, ...r.mentions]);
+      setMoreCursor(r.next_cursor);
+    },
+    onError: (e: Error) => toast({ title: 'Не удалось загрузить упоминания', description: e.message, variant: 'destructive' }),
   });
 
-  const coverageQ = useQuery({
-    queryKey: ['geo-coverage', days],
-    queryFn: () => geoApi.analytics.coverage(days),
+  const exportMentions = useMutation({
+    mutationFn: () => geoApi.analytics.exportMentions(days, 'csv'),
+    onSuccess: (r) => {
+      toast({ title: 'Выгрузка готова', description: `Упоминаний: ${r.rows} за ${r.days} дн.` });
+      window.open(r.url, '_blank');
+    },
+    onError: (e: Error) => toast({ title: 'Ошибка выгрузки', description: e.message, variant: 'destructive' }),
   });
 
   const [pollProgress, setPollProgress] = useState<{ processed: number; total: number } | null>(null);
@@ -51,9 +64,7 @@ export default function GeoDashboard() {
     onMutate: () => setPollProgress({ processed: 0, total: 0 }),
     onSettled: () => setPollProgress(null),
     onSuccess: (r) => {
-      qc.invalidateQueries({ queryKey: ['geo-overview'] });
-      qc.invalidateQueries({ queryKey: ['geo-trend'] });
-      qc.invalidateQueries({ queryKey: ['geo-mentions'] });
+      qc.invalidateQueries({ queryKey: ['geo-dashboard'] });
       qc.invalidateQueries({ queryKey: ['geo-coverage'] });
       qc.invalidateQueries({ queryKey: ['geo-queries'] });
       const errCount = r.errors?.length || 0;
@@ -89,7 +100,7 @@ export default function GeoDashboard() {
       }),
   });
 
-  const o = overviewQ.data;
+  const o = dashboardQ.data?.overview;
   const isEmpty = o && o.queries.total === 0;
 
   return (
@@ -218,15 +229,15 @@ export default function GeoDashboard() {
       <div className="grid grid-cols-1 lg:grid-cols-3 gap-6 mb-6">
         <div className="lg:col-span-2 bg-white border rounded-2xl p-6">
           <h2 className="font-semibold mb-4">Динамика SOV по дням</h2>
-          {trendQ.isLoading ? (
+          {dashboardQ.isLoading ? (
             <div className="h-72 flex items-center justify-center text-slate-400">Загрузка…</div>
           ) : (
-            <SovChart trend={trendQ.data?.trend || []} brands={trendQ.data?.brands || []} />
+            <SovChart data={dashboardQ.data?.sov_trend} />
           )}
         </div>
         <div className="bg-white border rounded-2xl p-6">
           <h2 className="font-semibold mb-4">SOV по брендам</h2>
-          {overviewQ.isLoading ? (
+          {dashboardQ.isLoading ? (
             <div className="text-slate-400 text-sm">Загрузка…</div>
           ) : (
             <SovBars sov={o?.sov || []} />
@@ -236,19 +247,38 @@ export default function GeoDashboard() {
 
       <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
         <div className="bg-white border rounded-2xl p-6">
-          <h2 className="font-semibold mb-4">Последние упоминания</h2>
-          {mentionsQ.isLoading ? (
+          <div className="flex items-center justify-between mb-4">
+            <h2 className="font-semibold">Последние упоминания</h2>
+            <Button size="sm" variant="outline" onClick={() => exportMentions.mutate()} disabled={exportMentions.isPending}>
+              <Icon name={exportMentions.isPending ? 'Loader2' : 'Download'} size={14} className={`mr-1.5 ${exportMentions.isPending ? 'animate-spin' : ''}`} />
+              CSV
+            </Button>
+          </div>
+          {dashboardQ.isLoading ? (
             <div className="text-slate-400 text-sm">Загрузка…</div>
           ) : (
-            <MentionsFeed mentions={mentionsQ.data?.mentions || []} />
+            <>
+              <MentionsFeed mentions={[...(dashboardQ.data?.mentions || []), ...moreMentions]} />
+              {mentionsCursor && (
+                <Button
+                  size="sm"
+                  variant="ghost"
+                  className="w-full mt-3"
+                  onClick={() => loadMoreMentions.mutate()}
+                  disabled={loadMoreMentions.isPending}
+                >
+                  {loadMoreMentions.isPending ? 'Загрузка…' : 'Показать ещё'}
+                </Button>
+              )}
+            </>
           )}
         </div>
         <div className="bg-white border rounded-2xl p-6">
           <h2 className="font-semibold mb-4">Покрытие запросов</h2>
-          {coverageQ.isLoading ? (
+          {dashboardQ.isLoading ? (
             <div className="text-slate-400 text-sm">Загрузка…</div>
           ) : (
-            <CoverageTable rows={coverageQ.data?.coverage || []} />
+            <CoverageTable rows={dashboardQ.data?.coverage || []} />
           )}
         </div>
       </div>
@@ -106,9 +106,11 @@ const TEMPLATES: Array<{ id: string; label: string; emoji: string; items: string
 
 export default function QueryBulkImportDialog({ open, onClose, onImported }: QueryBulkImportDialogProps) {
   const [text, setText] = useState('');
+  const [csvFile, setCsvFile] = useState<{ name: string; content: string } | null>(null);
 
   const mut = useMutation({
     mutationFn: () => {
+      if (csvFile) return geoApi.queries.bulkCreateCsv(csvFile.content);
       const items = text
         .split(/\r?\n/)
         .map((l) => l.trim())
@@ -122,6 +124,7 @@ export default function QueryBulkImportDialog({ open, onClose, onImported }: Que
       });
       onImported();
       setText('');
+      setCsvFile(null);
       onClose();
     },
     onError: (e: Error) => toast({ title: 'Ошибка импорта', description: e.message, variant: 'destructive' }),
@@ -134,7 +137,13 @@ export default function QueryBulkImportDialog({ open, onClose, onImported }: Que
     toast({ title: `Шаблон загружен: ${t.label}`, description: `${t.items.length} запросов в поле ниже — можете отредактировать и импортировать.` });
   };
 
+  const onCsvSelected = async (file: File | undefined) => {
+    if (!file) return;
+    setCsvFile({ name: file.name, content: await file.text() });
+  };
+
   const lineCount = text.split(/\r?\n/).filter((l) => l.trim()).length;
+  const canImport = Boolean(csvFile) || lineCount > 0;
 
   return (
     <Dialog open={open} onOpenChange={(v) => { if (!v) onClose(); }}>
@@ -183,17 +192,33 @@ export default function QueryBulkImportDialog({ open, onClose, onImported }: Que
               placeholder={'лучший CRM для малого бизнеса\nгде купить кабель оптом в Москве\nкак выбрать поставщика розеток\n…'}
               className="font-mono text-xs"
             />
-            <p className="text-[11px] text-slate-400 mt-1">Максимум 200 запросов за раз.</p>
+            <p className="text-[11px] text-slate-400 mt-1">Максимум 10 000 запросов за раз.</p>
+          </div>
+
+          <div>
+            <Label htmlFor="bulk-csv" className="mb-2 block">Или загрузите CSV</Label>
+            <input
+              id="bulk-csv"
+              type="file"
+              accept=".csv,text/csv"
+              onChange={(e) => onCsvSelected(e.target.files?.[0])}
+              className="block w-full text-xs text-slate-600 file:mr-3 file:rounded-md file:border-0 file:bg-indigo-50 file:px-3 file:py-1.5 file:text-indigo-700"
+            />
+            <p className="text-[11px] text-slate-400 mt-1">
+              {csvFile
+                ? `Файл: ${csvFile.name} — будет импортирован вместо текста выше.`
+                : 'Запрос в первой колонке или заголовок с колонками text, category, intent, notes.'}
+            </p>
           </div>
         </div>
 
         <DialogFooter>
           <Button variant="outline" onClick={onClose}>Отмена</Button>
-          <Button onClick={() => mut.mutate()} disabled={!lineCount || mut.isPending}>
+          <Button onClick={() => mut.mutate()} disabled={!canImport || mut.isPending}>
             {mut.isPending ? (
               <><Icon name="Loader2" size={14} className="mr-2 animate-spin" />Импортируем…</>
             ) : (
-              <><Icon name="Upload" size={14} className="mr-2" />Импортировать {lineCount > 0 ? `(${lineCount})` : ''}</>
+              <><Icon name="Upload" size={14} className="mr-2" />Импортировать {!csvFile && lineCount > 0 ? `(${lineCount})` : ''}</>
             )}
           </Button>
         </DialogFooter>